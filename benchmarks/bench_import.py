@@ -0,0 +1,80 @@
+"""
+Measure how long importing the package takes and enforce a startup budget.
+
+Every statement is run in a fresh interpreter with ``-X importtime`` and the
+cumulative import time of the modules it imports is compared with its
+budget. The best of several runs is used to keep noise down.
+
+Run from the repository root with ``python -m benchmarks.bench_import``. The
+exit status is 1 if any statement is over budget.
+"""
+
+import subprocess
+import sys
+
+
+#: Statements and their budgets in milliseconds. The budgets leave plenty of
+#: room on a laptop, but are well below what importing ``xmlrpc.client`` and
+#: ``asyncio`` eagerly used to cost
+BUDGETS = [
+    ("import loopialib", 10.0),
+    ("from loopialib import DnsRecord", 25.0),
+    ("from loopialib import split_domain", 25.0),
+    ("from loopialib import Loopia", 150.0),
+]
+
+
+def _importtime(statement):
+    """
+    Return ``(cumulative microseconds, indented name)`` for every import made
+    by running the given statement in a fresh interpreter.
+    """
+
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True).stderr
+
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), name))
+    return imports
+
+
+def import_time(statement, startup_modules):
+    """
+    Return the time in milliseconds that the imports of the given statement
+    took, excluding modules that the interpreter imports at startup.
+    """
+
+    total = 0
+    for cumulative, name in _importtime(statement):
+        # Only count top level imports, since nested ones are included in
+        # their cumulative time. Those are indented by a single space
+        indent = len(name) - len(name.lstrip())
+        if indent == 1 and name.strip() not in startup_modules:
+            total += cumulative
+    return total / 1000.0
+
+
+def main(repeat=5):
+    startup_modules = {name.strip() for _, name in _importtime("pass")}
+
+    over_budget = False
+    for statement, budget in BUDGETS:
+        best = min(
+            import_time(statement, startup_modules) for _ in range(repeat))
+        status = "ok" if best <= budget else "OVER BUDGET"
+        over_budget = over_budget or best > budget
+        print("{:<40} {:>8.1f} ms  (budget {:.0f} ms) {}".format(
+            statement, best, budget, status))
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""
+Compare the validating and trusted ways of creating ``DnsRecord`` from API
+responses.
+
+Run from the repository root with ``python -m benchmarks.bench_records``.
+"""
+
+import timeit
+
+from loopialib.types import DnsRecord
+
+
+RECORD = {
+    "type": "TXT",
+    "ttl": 3600,
+    "priority": 0,
+    "rdata": "v=spf1 include:_spf.loopia.se -all",
+    "record_id": 12345,
+}
+
+
+def bench(name, stmt, number=200000):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print("{:<28} {:>8.0f} ns/record".format(name, best / number * 1e9))
+
+
+def main():
+    bench("DnsRecord(...)", lambda: DnsRecord(
+        "TXT", 3600, 0, RECORD["rdata"], 12345))
+    bench("DnsRecord.from_dict", lambda: DnsRecord.from_dict(RECORD))
+    bench(
+        "DnsRecord.from_trusted_dict",
+        lambda: DnsRecord.from_trusted_dict(RECORD))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare ``split_domain`` with the two level lookup table it replaced.
+
+Run from the repository root with ``python -m benchmarks.bench_split_domain``.
+"""
+
+import timeit
+
+from loopialib import _suffix_data
+from loopialib.utils import split_domain
+
+
+def build_legacy_table():
+    """
+    Build a lookup table in the same shape as the old ``_sld`` table, from the
+    two label rules of the bundled list.
+    """
+
+    table = {}
+    for rule in (_suffix_data.ICANN + _suffix_data.PRIVATE).split():
+        labels = rule.split(".")
+        if len(labels) == 2 and "*" not in rule and "!" not in rule:
+            table.setdefault(labels[1], set()).add(labels[0])
+    return {tld: frozenset(slds) for tld, slds in table.items()}
+
+
+_sld = build_legacy_table()
+
+
+def legacy_split_domain(domain):
+    parts = domain.split(".")
+
+    domain_parts = 2
+    if parts[-1] in _sld and len(parts) >= 2 and parts[-2] in _sld[parts[-1]]:
+        domain_parts = 3
+
+    return (
+        ".".join(parts[-domain_parts:]),
+        ".".join(parts[:-domain_parts]) or None,
+    )
+
+
+NAMES = [
+    "{}.host{}.example.{}".format(sub, i, tld)
+    for i in range(2000)
+    for sub, tld in [
+        ("www", "com"),
+        ("mail", "co.uk"),
+        ("static.img", "se"),
+        ("api", "city.kawasaki.jp"),
+    ]
+]
+
+
+def bench(name, func, names, number=5):
+    def run():
+        for hostname in names:
+            func(hostname)
+
+    best = min(timeit.repeat(run, number=1, repeat=number))
+    print("{:<32} {:>8.0f} ns/name".format(name, best / len(names) * 1e9))
+
+
+def main():
+    bench("legacy two level table", legacy_split_domain, NAMES)
+    split_domain.cache_clear()
+    bench("suffix trie, not memoized", split_domain.__wrapped__, NAMES)
+    bench("suffix trie, memoized", split_domain, NAMES)
+
+
+if __name__ == "__main__":
+    main()
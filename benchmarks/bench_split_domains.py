@@ -0,0 +1,61 @@
+"""
+Compare ``split_domains`` with calling ``split_domain`` in a loop.
+
+Run from the repository root with ``python -m benchmarks.bench_split_domains``.
+"""
+
+import io
+import random
+import timeit
+
+from loopialib.utils import iter_split_domains, split_domain, split_domains
+
+
+def make_names(count, unique):
+    """
+    Return a list of host names where roughly ``unique`` names repeat, like in
+    a log file.
+    """
+
+    rng = random.Random(0)
+    tlds = ["com", "se", "co.uk", "net", "city.kawasaki.jp"]
+    subs = ["www", "mail", "api", "static.img", "a.b.c"]
+    pool = [
+        "{}.host{}.{}".format(rng.choice(subs), i, rng.choice(tlds))
+        for i in range(unique)
+    ]
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def bench(name, func, count, repeat=3):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print("{:<36} {:>10.0f} names/s".format(name, count / best))
+
+
+def main():
+    count = 200000
+    for unique in (1000, 100000):
+        names = make_names(count, unique)
+        text = "\n".join(names) + "\n"
+        print("{} names, {} unique".format(count, unique))
+
+        def per_item():
+            split_domain.cache_clear()
+            domains = []
+            subdomains = []
+            for name in names:
+                parts = split_domain(name)
+                domains.append(parts.domain)
+                subdomains.append(parts.subdomain)
+
+        def streaming():
+            for _ in iter_split_domains(io.StringIO(text)):
+                pass
+
+        bench("  split_domain in a loop", per_item, count)
+        bench("  split_domains", lambda: split_domains(names), count)
+        bench("  iter_split_domains from file", streaming, count)
+
+
+if __name__ == "__main__":
+    main()
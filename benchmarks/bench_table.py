@@ -0,0 +1,89 @@
+"""
+Compare the memory used by a ``list`` of ``DnsRecord`` with a
+``RecordTable`` of the same records, and the time it takes to filter them.
+``RecordTable.filter`` copies the matching rows into a new table, which
+costs more than finding them with ``RecordTable.rows``.
+
+Run from the repository root with ``python -m benchmarks.bench_table``. The
+number of records can be given as an argument and defaults to a million.
+"""
+
+import gc
+import sys
+import timeit
+import tracemalloc
+
+from loopialib.table import RecordTable
+from loopialib.types import DnsRecord
+
+
+def make_records(count):
+    """
+    Return records that look like those of a large account, where addresses
+    and mail servers are shared by many zones.
+    """
+
+    records = []
+    for i in range(count):
+        if i % 4 == 3:
+            records.append(DnsRecord(
+                "MX", priority=10, data="mx{}.example.net.".format(i % 50),
+                id=i + 1))
+        elif i % 4 == 2:
+            records.append(DnsRecord(
+                "TXT", data="v=spf1 include:_spf.example.net -all", id=i + 1))
+        else:
+            records.append(DnsRecord(
+                "A", ttl=300, data="203.0.113.{}".format(i % 250), id=i + 1))
+    return records
+
+
+def measure(func):
+    """
+    Return the result of ``func`` and the number of bytes allocated for it.
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000000
+
+    # Data strings are created by the parser in practice, so every record has
+    # a string of its own in the list
+    records, list_size = measure(lambda: [
+        DnsRecord.from_trusted_dict({
+            "type": r.type, "ttl": r.ttl, "priority": r.priority,
+            "rdata": r.data.encode().decode(), "record_id": r.id,
+        })
+        for r in make_records(count)
+    ])
+    table, table_size = measure(lambda: RecordTable(records))
+
+    print("{} records".format(count))
+    for name, size in [("list of DnsRecord", list_size),
+                       ("RecordTable", table_size)]:
+        print("  {:<24} {:>10.1f} MB {:>8.1f} bytes/record".format(
+            name, size / 1e6, size / count))
+
+    for name, func in [
+            ("list comprehension", lambda: [
+                r for r in records if r.type == "MX" and r.priority == 10]),
+            ("RecordTable.rows", lambda: table.rows(
+                type="MX", priority=10)),
+            ("RecordTable.filter", lambda: table.filter(
+                type="MX", priority=10))]:
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print("  filter with {:<24} {:>7.1f} ms".format(name, best * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
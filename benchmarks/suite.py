@@ -0,0 +1,297 @@
+"""
+Benchmark suite for the hot paths of the client.
+
+Run from the repository root with ``python -m benchmarks.suite``. Results are
+printed as a table and can be written as JSON with ``--output``. When a
+baseline is given with ``--baseline`` the suite exits with status 1 if any
+benchmark is more than ``--tolerance`` slower than in the baseline::
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json
+
+Timings depend heavily on the machine, so a baseline is only meaningful on
+the machine it was recorded on. Record a new one with ``--output`` before
+comparing branches. Use ``-k`` to only run benchmarks whose names contain the
+given string.
+
+Micro benchmarks report the best of ``--repeat`` runs. End to end benchmarks
+against the emulator go through sockets and threads, which makes them much
+noisier, so they report the median and are compared with the wider
+``--end-to-end-tolerance``.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+from collections import OrderedDict
+
+from loopialib import Loopia
+from loopialib.client import _parse_status_code
+from loopialib.testing import LoopiaEmulator
+from loopialib.types import DnsRecord, Domain
+from loopialib.utils import split_domain
+
+
+#: Benchmarks in the order they are run. Every benchmark is a function that
+#: returns a tuple of a function to time and the number of operations it
+#: performs per call
+BENCHMARKS = OrderedDict()
+
+#: Names of the benchmarks that go through the emulator
+END_TO_END = set()
+
+
+def benchmark(name, end_to_end=False):
+    def wrapper(func):
+        BENCHMARKS[name] = func
+        if end_to_end:
+            END_TO_END.add(name)
+        return func
+    return wrapper
+
+
+RECORD = {
+    "type": "TXT",
+    "ttl": 3600,
+    "priority": 0,
+    "rdata": "v=spf1 include:_spf.loopia.se -all",
+    "record_id": 12345,
+}
+
+DOMAIN = {
+    "domain": "example.com",
+    "expiration_date": "2030-01-01",
+    "renewal_status": "NORMAL",
+    "registered": 1,
+    "paid": 1,
+    "reference_no": 0,
+}
+
+HOSTNAMES = [
+    "{}.host{}.example.{}".format(sub, i, tld)
+    for i in range(2500)
+    for sub, tld in [
+        ("www", "com"),
+        ("mail", "co.uk"),
+        ("static.img", "se"),
+        ("api", "city.kawasaki.jp"),
+    ]
+]
+
+
+def _repeat(func, arg, number):
+    def run():
+        for _ in range(number):
+            func(arg)
+    return run, number
+
+
+@benchmark("DnsRecord.from_dict")
+def bench_record_from_dict():
+    return _repeat(DnsRecord.from_dict, RECORD, 20000)
+
+
+@benchmark("DnsRecord.from_trusted_dict")
+def bench_record_from_trusted_dict():
+    return _repeat(DnsRecord.from_trusted_dict, RECORD, 20000)
+
+
+@benchmark("DnsRecord.to_dict")
+def bench_record_to_dict():
+    record = DnsRecord.from_dict(RECORD)
+    return _repeat(DnsRecord.to_dict, record, 20000)
+
+
+@benchmark("Domain.from_dict")
+def bench_domain_from_dict():
+    return _repeat(Domain.from_dict, DOMAIN, 20000)
+
+
+@benchmark("split_domain (memoized)")
+def bench_split_domain():
+    def run():
+        for hostname in HOSTNAMES:
+            split_domain(hostname)
+    return run, len(HOSTNAMES)
+
+
+@benchmark("split_domain (not memoized)")
+def bench_split_domain_uncached():
+    split = split_domain.__wrapped__
+
+    def run():
+        for hostname in HOSTNAMES:
+            split(hostname)
+    return run, len(HOSTNAMES)
+
+
+@benchmark("_parse_status_code (status)")
+def bench_parse_status_code_status():
+    return _repeat(_parse_status_code, "OK", 50000)
+
+
+@benchmark("_parse_status_code (records)")
+def bench_parse_status_code_records():
+    return _repeat(_parse_status_code, [RECORD] * 100, 50000)
+
+
+def _emulator_benchmarks():
+    """
+    Register end to end benchmarks against a local emulator for several zone
+    sizes and numbers of concurrent workers. The operation is a single API
+    call, which means concurrent benchmarks measure throughput rather than
+    latency.
+    """
+
+    for records in (10, 100, 1000):
+        for workers in (1, 8):
+            suffix = "({} records, {} workers)".format(records, workers)
+            benchmark("get_zone_records " + suffix, end_to_end=True)(
+                _emulator_benchmark("get", records, workers))
+            benchmark("update_zone_record " + suffix, end_to_end=True)(
+                _emulator_benchmark("update", records, workers))
+
+
+def _emulator_benchmark(action, size, workers):
+    # Large zones are slow to serve so make fewer calls
+    calls = max(8, 6400 // size)
+
+    def setup():
+        emulator = _emulators.get(size)
+        if emulator is None:
+            emulator = _emulators[size] = LoopiaEmulator()
+            emulator.start()
+            emulator.add_domain("example.com")
+            emulator.domains["example.com"]["@"] = [
+                dict(RECORD, record_id=i + 1) for i in range(size)
+            ]
+
+        # Identical concurrent reads would otherwise share a request, and
+        # every call is meant to be a request of its own
+        loopia = Loopia(
+            "user", "password", base_url=emulator.url, single_flight=False)
+        if action == "get":
+            call = loopia.get_zone_records
+            items = [("example.com",)] * calls
+        else:
+            call = loopia.update_zone_record
+            records = loopia.get_zone_records("example.com")
+            items = [
+                (records[i % size], "example.com") for i in range(calls)
+            ]
+
+        if workers == 1:
+            def run():
+                for item in items:
+                    call(*item)
+        else:
+            def run():
+                loopia._bulk(call, items, workers, stop_on_error=True)
+        return run, calls
+    return setup
+
+
+_emulators = {}
+_emulator_benchmarks()
+
+
+def measure(func, repeat, median=False):
+    """
+    Return the best, or the median, time in nanoseconds per operation of the
+    given benchmark.
+    """
+
+    run, ops = func()
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    if median:
+        elapsed = statistics.median(times)
+    else:
+        elapsed = min(times)
+    return elapsed / ops * 1e9
+
+
+def compare(results, baseline, tolerance, end_to_end_tolerance=None):
+    """
+    Return a ``list`` of ``(name, result, baseline)`` tuples for benchmarks
+    that are more than their tolerance slower than the baseline. End to end
+    benchmarks use ``end_to_end_tolerance``, or aren't compared if it is
+    ``None``.
+    """
+
+    regressions = []
+    for name, ns in results.items():
+        limit = tolerance
+        if name in END_TO_END:
+            limit = end_to_end_tolerance
+        if limit is None or name not in baseline:
+            continue
+        if ns > baseline[name] * (1 + limit):
+            regressions.append((name, ns, baseline[name]))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.suite",
+        description="Benchmark the hot paths of loopialib.")
+    parser.add_argument("-k", dest="keyword", default="")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--end-to-end-tolerance", type=float, default=1.0,
+        help="tolerance of the end to end benchmarks, which are not compared "
+             "at all if negative")
+    args = parser.parse_args(argv[1:])
+
+    results = OrderedDict()
+    try:
+        for name, func in BENCHMARKS.items():
+            if args.keyword not in name:
+                continue
+            results[name] = measure(
+                func, args.repeat, median=name in END_TO_END)
+            print("{:<48} {:>12.0f} ns/op".format(name, results[name]))
+    finally:
+        for emulator in _emulators.values():
+            emulator.stop()
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, fp, indent=2)
+            fp.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["results"]
+
+        end_to_end_tolerance = args.end_to_end_tolerance
+        if end_to_end_tolerance < 0:
+            end_to_end_tolerance = None
+        regressions = compare(
+            results, baseline, args.tolerance, end_to_end_tolerance)
+        for name, ns, expected in regressions:
+            print("REGRESSION {}: {:.0f} ns/op, baseline {:.0f} ns/op".format(
+                name, ns, expected))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
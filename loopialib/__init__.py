@@ -1,7 +1,44 @@
-from .client import Loopia
-from .exceptions import LoopiaError
-from .types import DnsRecord
-from .utils import split_domain
+"""
+A pythonic interface to Loopia's XML-RPC API.
 
+The names exported here are imported on first use, so that importing the
+package stays cheap for programs that only need a part of it.
+"""
+
+__all__ = [
+    "AsyncLoopia",
+    "DnsRecord",
+    "Loopia",
+    "LoopiaError",
+    "split_domain",
+    "split_domains",
+]
 
 __version__ = "0.2.0"
+
+
+#: Module that every lazily imported name is defined in
+_lazy = {
+    "AsyncLoopia": ".aio",
+    "DnsRecord": ".types",
+    "Loopia": ".client",
+    "LoopiaError": ".exceptions",
+    "split_domain": ".utils",
+    "split_domains": ".utils",
+}
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+
+    from importlib import import_module
+
+    value = getattr(import_module(_lazy[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
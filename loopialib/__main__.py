@@ -0,0 +1,148 @@
+"""
+Command line interface of loopialib.
+
+Credentials are read from the ``LOOPIA_USER`` and ``LOOPIA_PASSWORD``
+environment variables unless given as options. For example, to keep two
+host names pointed at the public address of this machine::
+
+    python -m loopialib ddns --source url:https://api.ipify.org \\
+        home.example.com vpn.example.com
+
+Zone files can be exported and imported with the ``export`` and ``import``
+commands, which read and write standard input and output by default::
+
+    python -m loopialib export example.com example.com.zone
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from .client import Loopia
+from .ddns import DynDnsUpdater, parse_source
+
+
+def ddns(args):
+    loopia = Loopia(args.user, args.password, base_url=args.base_url)
+    updater = DynDnsUpdater(
+        loopia,
+        args.hostnames,
+        ttl=args.ttl,
+        refresh_interval=args.refresh_interval)
+    if args.state and os.path.exists(args.state):
+        with open(args.state, encoding="utf-8") as fp:
+            updater.load_state(fp)
+
+    iterations = 1 if args.once else None
+    try:
+        updater.run(args.source, interval=args.interval, iterations=iterations)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.state:
+            with open(args.state, "w", encoding="utf-8") as fp:
+                updater.save_state(fp)
+    return 0
+
+
+def export_zone(args):
+    loopia = Loopia(args.user, args.password, base_url=args.base_url)
+    if args.file == "-":
+        loopia.export_zone_file(args.domain, sys.stdout)
+    else:
+        with open(args.file, "w", encoding="utf-8") as fp:
+            loopia.export_zone_file(args.domain, fp)
+    return 0
+
+
+def import_zone(args):
+    loopia = Loopia(args.user, args.password, base_url=args.base_url)
+    if args.file == "-":
+        result = loopia.import_zone_file(
+            args.domain, sys.stdin, replace=args.replace)
+    else:
+        with open(args.file, encoding="utf-8") as fp:
+            result = loopia.import_zone_file(
+                args.domain, fp, replace=args.replace)
+
+    logging.info(
+        "Imported %d sub domains: %d added, %d updated, %d removed",
+        *result)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="loopialib",
+        description="Tools for the Loopia API.")
+    parser.add_argument(
+        "--user", default=os.environ.get("LOOPIA_USER"),
+        help="API user, defaults to $LOOPIA_USER")
+    parser.add_argument(
+        "--password", default=os.environ.get("LOOPIA_PASSWORD"),
+        help="API password, defaults to $LOOPIA_PASSWORD")
+    parser.add_argument("--base-url", help="override the API endpoint")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    ddns_parser = commands.add_parser(
+        "ddns",
+        help="keep A and AAAA records pointed at changing addresses")
+    ddns_parser.set_defaults(func=ddns)
+    ddns_parser.add_argument("hostnames", nargs="+", metavar="hostname")
+    ddns_parser.add_argument(
+        "--source", action="append", required=True, type=parse_source,
+        help="address source: url:<url>, route, route6 or static:<address>. "
+             "May be given once per address family")
+    ddns_parser.add_argument(
+        "--interval", type=float, default=300.0,
+        help="seconds between checks (default: %(default)s)")
+    ddns_parser.add_argument(
+        "--refresh-interval", type=float, default=3600.0,
+        help="seconds to trust the cached records (default: %(default)s)")
+    ddns_parser.add_argument(
+        "--ttl", type=int, default=None,
+        help="TTL of records that have to be added")
+    ddns_parser.add_argument(
+        "--state", help="file to keep the cached records in between runs")
+    ddns_parser.add_argument(
+        "--once", action="store_true", help="check once and exit")
+
+    export_parser = commands.add_parser(
+        "export", help="write the records of a domain as a zone file")
+    export_parser.set_defaults(func=export_zone)
+    export_parser.add_argument("domain")
+    export_parser.add_argument(
+        "file", nargs="?", default="-",
+        help="zone file to write, defaults to standard output")
+
+    import_parser = commands.add_parser(
+        "import", help="add the records of a zone file to a domain")
+    import_parser.set_defaults(func=import_zone)
+    import_parser.add_argument("domain")
+    import_parser.add_argument(
+        "file", nargs="?", default="-",
+        help="zone file to read, defaults to standard input")
+    import_parser.add_argument(
+        "--replace", action="store_true",
+        help="remove records of the sub domains in the file that are not in "
+             "the file")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.user or not args.password:
+        parser.error("API user and password are required")
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,3 @@
-try:
-    # Python 2
-    from xmlrpclib import ServerProxy
-except ImportError:
-    # Python 3
-    from xmlrpc.client import ServerProxy
-
 try:
     # Python 2
     string_types = basestring
@@ -17,3 +10,33 @@ try:
     ustr = unicode
 except NameError:
     ustr = str
+
+
+#: Names from the XML-RPC client module, which is imported on first use
+#: since it pulls in a large part of the standard library
+_xmlrpc_names = frozenset([
+    "Fault", "ProtocolError", "ServerProxy", "Transport", "dumps", "loads"])
+
+
+def __getattr__(name):
+    if name in _xmlrpc_names:
+        try:
+            # Python 2
+            import xmlrpclib as module
+        except ImportError:
+            # Python 3
+            import xmlrpc.client as module
+        value = getattr(module, name)
+    elif name == "http_client":
+        try:
+            # Python 2
+            import httplib as value
+        except ImportError:
+            # Python 3
+            import http.client as value
+    else:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+
+    globals()[name] = value
+    return value
@@ -0,0 +1,330 @@
+import asyncio
+import ssl
+import time
+
+from urllib.parse import urlsplit
+
+from ._compat import ProtocolError, dumps, loads
+from .client import _check_response, _notify_rate_limiter
+from .singleflight import AsyncSingleFlight
+from .types import DnsRecord, Domain, _validate_int
+
+
+__all__ = [
+    "AsyncLoopia",
+    "AsyncTransport",
+]
+
+
+_RESET_ERRORS = (ConnectionError, asyncio.IncompleteReadError)
+
+
+class AsyncTransport(object):
+    """
+    Non-blocking XML-RPC transport built on ``asyncio`` streams.
+
+    It speaks just enough HTTP/1.1 to talk XML-RPC and keeps connections alive
+    between requests in the same way as ``PooledTransport``.
+
+    :param url: URL of the XML-RPC endpoint
+    :param max_connections: Maximum number of idle connections to keep
+    :param idle_timeout: Number of seconds a connection may be idle and still
+                         be reused
+    :param ssl_context: ``ssl.SSLContext`` to use for HTTPS connections
+    :param clock: Monotonic clock function, mainly useful for testing
+    """
+
+    user_agent = "loopialib"
+    encoding = "utf-8"
+
+    def __init__(
+            self, url, max_connections=10, idle_timeout=30.0,
+            ssl_context=None, clock=time.monotonic):
+        parts = urlsplit(url)
+        self.use_https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.use_https else 80)
+        self.handler = parts.path or "/"
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._clock = clock
+
+        if self.use_https and ssl_context is None:
+            ssl_context = ssl.create_default_context()
+        self.ssl_context = ssl_context
+
+        self._idle = []
+
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.connections_evicted = 0
+        self.reconnects = 0
+
+    async def _checkout(self):
+        now = self._clock()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if now - last_used <= self.idle_timeout:
+                self.connections_reused += 1
+                return reader, writer, True
+            self.connections_evicted += 1
+            writer.close()
+
+        self.connections_opened += 1
+        reader, writer = await asyncio.open_connection(
+            self.host,
+            self.port,
+            ssl=self.ssl_context if self.use_https else None)
+        return reader, writer, False
+
+    def _checkin(self, reader, writer, keep_alive):
+        if keep_alive and len(self._idle) < self.max_connections:
+            self._idle.append((reader, writer, self._clock()))
+        else:
+            writer.close()
+
+    async def request(self, method, params):
+        """
+        Call the given XML-RPC method and return the unmarshalled response.
+        """
+
+        body = dumps(
+            tuple(params),
+            method,
+            encoding=self.encoding).encode(self.encoding)
+
+        for attempt in (0, 1):
+            reader, writer, reused = await self._checkout()
+            try:
+                data, keep_alive = await self._single_request(
+                    reader, writer, body)
+            except _RESET_ERRORS:
+                writer.close()
+                if attempt or not reused:
+                    raise
+                self.reconnects += 1
+                continue
+            except BaseException:
+                writer.close()
+                raise
+
+            self._checkin(reader, writer, keep_alive)
+            return loads(data)[0][0]
+
+    async def _single_request(self, reader, writer, body):
+        host = self.host
+        if self.port != (443 if self.use_https else 80):
+            host = "{}:{}".format(self.host, self.port)
+
+        writer.write((
+            "POST {handler} HTTP/1.1\r\n"
+            "Host: {host}\r\n"
+            "User-Agent: {user_agent}\r\n"
+            "Content-Type: text/xml\r\n"
+            "Content-Length: {length}\r\n"
+            "\r\n"
+        ).format(
+            handler=self.handler,
+            host=host,
+            user_agent=self.user_agent,
+            length=len(body),
+        ).encode("ascii") + body)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b"\r\n")
+        version, status, reason = (
+            status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""]
+        )[:3]
+
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            data = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            headers["connection"] = "close"
+
+        if status != "200":
+            raise ProtocolError(
+                self.host + self.handler, int(status), reason, headers)
+
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.0":
+            keep_alive = connection == "keep-alive"
+        else:
+            keep_alive = connection != "close"
+        return data, keep_alive
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                # Skip trailers
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    def close(self):
+        """
+        Close all idle connections in the pool.
+        """
+
+        idle, self._idle = self._idle, []
+        for _, writer, _ in idle:
+            writer.close()
+
+
+class AsyncLoopia(object):
+    """
+    Coroutine based counterpart of ``Loopia``.
+
+    :param user: API user name
+    :param password: API password
+    :param domain: Top level domain of the Loopia API to use
+    :param base_url: Override the API endpoint
+    :param transport: ``AsyncTransport`` to use
+    :param max_concurrency: Maximum number of requests in flight at once
+    :param rate_limiter: ``RateLimiter`` to wait for before every call
+    :param retry_policy: ``RetryPolicy`` to retry failed calls with
+    :param single_flight: ``AsyncSingleFlight`` that identical reads made at
+                          the same time share a request through, or ``False``
+                          to not share requests
+    """
+
+    def __init__(
+            self, user, password, domain="se", base_url=None, transport=None,
+            max_concurrency=10, rate_limiter=None, retry_policy=None,
+            single_flight=None):
+        if base_url is None:
+            base_url = f"https://api.loopia.{domain}/RPCSERV"
+        self.base_url = base_url
+        self.user = user
+        self.password = password
+
+        if transport is None:
+            transport = AsyncTransport(
+                self.base_url, max_connections=max_concurrency)
+        self.transport = transport
+
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+
+        if single_flight is None:
+            single_flight = AsyncSingleFlight()
+        elif single_flight is False:
+            single_flight = None
+        self.single_flight = single_flight
+
+    async def _call(self, method, *args):
+        if self.single_flight is None:
+            return await self._call_unshared(method, *args)
+        return await self.single_flight.call(
+            method, args, self._call_unshared)
+
+    async def _call_unshared(self, method, *args):
+        if self.retry_policy is None:
+            return await self._call_once(method, *args)
+        return await self.retry_policy.call_async(
+            method, self._call_once, method, *args)
+
+    async def _call_once(self, method, *args):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async()
+
+        async with self._semaphore:
+            response = await self.transport.request(
+                method, (self.user, self.password) + args)
+
+        _notify_rate_limiter(self.rate_limiter, response)
+        return _check_response(response)
+
+    async def get_domain(self, domain):
+        """
+        Return information about the given domain name.
+
+        :param domain: Domain name to return information about
+        :return: A ``Domain`` ``namedtuple``
+        """
+
+        return Domain.from_dict(await self._call("getDomain", domain))
+
+    async def get_domains(self):
+        """
+        Return a list of all domains belonging to this account.
+
+        :return: A ``list`` of ``Domain`` ``namedtuple``
+        """
+
+        return [
+            Domain.from_dict(domain)
+            for domain in await self._call("getDomains")
+        ]
+
+    async def get_subdomains(self, domain):
+        # Copy since concurrent callers share the response
+        return list(await self._call("getSubdomains", domain))
+
+    async def add_subdomain(self, domain, subdomain):
+        return await self._call("addSubdomain", domain, subdomain)
+
+    async def remove_subdomain(self, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        return await self._call("removeSubdomain", domain, subdomain)
+
+    async def add_zone_record(self, record, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        if record.id != 0:
+            raise ValueError("Record must not have an ID")
+
+        await self._call("addZoneRecord", domain, subdomain, record.to_dict())
+
+    async def get_zone_records(self, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        return [
+            DnsRecord.from_trusted_dict(record)
+            for record in await self._call(
+                "getZoneRecords", domain, subdomain)
+        ]
+
+    async def update_zone_record(self, record, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        await self._call(
+            "updateZoneRecord", domain, subdomain, record.to_dict())
+
+    async def remove_zone_record(self, id, domain, subdomain=None):
+        """
+        Remove the zone record with the given ID that belongs to the given
+        domain and sub domain. If no sub domain is given the wildcard sub-domain
+        is assumed.
+        """
+
+        if subdomain is None:
+            subdomain = "@"
+
+        _validate_int("id", id)
+
+        await self._call("removeZoneRecord", domain, subdomain, id)
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,184 @@
+from concurrent.futures import Future
+
+from ._compat import Fault
+from .types import DnsRecord, Domain, _validate_int
+
+
+__all__ = [
+    "Batch",
+]
+
+
+#: Fault code for unknown methods according to the XML-RPC fault code spec
+_METHOD_NOT_FOUND = -32601
+
+
+def _is_multicall_unsupported(fault):
+    return (
+        fault.faultCode == _METHOD_NOT_FOUND or
+        "system.multicall" in str(fault.faultString))
+
+
+def _convert_domains(response):
+    return [Domain.from_dict(domain) for domain in response]
+
+
+def _convert_zone_records(response):
+    return [DnsRecord.from_trusted_dict(record) for record in response]
+
+
+def _convert_none(response):
+    return None
+
+
+class Batch(object):
+    """
+    Queue of calls that are sent together in as few requests as possible.
+
+    Calls are sent using ``system.multicall`` when the API supports it, or
+    concurrently over the worker pool of the client when it doesn't. Every
+    queued call returns a ``concurrent.futures.Future`` that holds the result
+    or the ``LoopiaError`` of the call once the batch has been sent.
+
+    Batches are normally used through ``Loopia.batch`` as a context manager,
+    which sends the batch on exit::
+
+        with loopia.batch() as batch:
+            www = batch.get_zone_records("example.com", "www")
+            batch.update_zone_record(record, "example.com")
+        www.result()
+
+    :param loopia: ``Loopia`` client to send the calls with
+    :param max_calls: Maximum number of calls per multicall request
+    """
+
+    def __init__(self, loopia, max_calls=100):
+        self.loopia = loopia
+        self.max_calls = max_calls
+        self._calls = []
+
+    def __len__(self):
+        return len(self._calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+        else:
+            for _, _, _, future in self._calls:
+                future.cancel()
+            self._calls = []
+
+    def _queue(self, method, args, convert):
+        future = Future()
+        self._calls.append((method, args, convert, future))
+        return future
+
+    def send(self):
+        """
+        Send all queued calls and resolve their futures.
+        """
+
+        calls, self._calls = self._calls, []
+        with self.loopia._defer_index_refresh():
+            self._send(calls)
+
+    def _send(self, calls):
+        loopia = self.loopia
+        while calls:
+            if loopia._multicall is False:
+                self._resolve(calls, loopia._bulk(
+                    loopia._call,
+                    [(method,) + args for method, args, _, _ in calls]))
+                return
+
+            chunk = calls[:self.max_calls]
+            try:
+                results = loopia._multicall_request(
+                    [(method, args) for method, args, _, _ in chunk])
+            except Fault as e:
+                if not _is_multicall_unsupported(e):
+                    self._fail(calls, e)
+                    raise
+                loopia._multicall = False
+                continue
+            except Exception as e:
+                self._fail(calls, e)
+                raise
+
+            loopia._multicall = True
+            self._resolve(chunk, results)
+            calls = calls[self.max_calls:]
+
+    def _fail(self, calls, error):
+        for _, _, _, future in calls:
+            future.set_exception(error)
+
+    def _resolve(self, calls, results):
+        for (_, _, convert, future), result in zip(calls, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+                continue
+
+            try:
+                future.set_result(convert(result))
+            except Exception as e:
+                future.set_exception(e)
+
+    def get_domain(self, domain):
+        return self._queue("getDomain", (domain,), Domain.from_dict)
+
+    def get_domains(self):
+        return self._queue("getDomains", (), _convert_domains)
+
+    def get_subdomains(self, domain):
+        return self._queue("getSubdomains", (domain,), list)
+
+    def add_subdomain(self, domain, subdomain):
+        return self._queue("addSubdomain", (domain, subdomain), _convert_none)
+
+    def remove_subdomain(self, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        return self._queue(
+            "removeSubdomain", (domain, subdomain), _convert_none)
+
+    def add_zone_record(self, record, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        if record.id != 0:
+            raise ValueError("Record must not have an ID")
+
+        return self._queue(
+            "addZoneRecord",
+            (domain, subdomain, record.to_dict()),
+            _convert_none)
+
+    def get_zone_records(self, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        return self._queue(
+            "getZoneRecords", (domain, subdomain), _convert_zone_records)
+
+    def update_zone_record(self, record, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        return self._queue(
+            "updateZoneRecord",
+            (domain, subdomain, record.to_dict()),
+            _convert_none)
+
+    def remove_zone_record(self, id, domain, subdomain=None):
+        if subdomain is None:
+            subdomain = "@"
+
+        _validate_int("id", id)
+
+        return self._queue(
+            "removeZoneRecord", (domain, subdomain, id), _convert_none)
@@ -0,0 +1,160 @@
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+
+__all__ = [
+    "ResponseCache",
+]
+
+
+#: Default number of seconds to keep responses of read methods
+_default_ttls = {
+    "getDomain": 300.0,
+    "getDomains": 300.0,
+    "getSubdomains": 60.0,
+    "getZoneRecords": 60.0,
+}
+
+#: Read responses affected by write methods, as a list of read methods and the
+#: number of leading arguments the write and read methods have in common
+_invalidations = {
+    "addSubdomain": [("getSubdomains", 1)],
+    "addZoneRecord": [("getZoneRecords", 2), ("getSubdomains", 1)],
+    "updateZoneRecord": [("getZoneRecords", 2)],
+    "removeZoneRecord": [("getZoneRecords", 2)],
+    "removeSubdomain": [("getZoneRecords", 2), ("getSubdomains", 1)],
+}
+
+
+def _sizeof(value):
+    """
+    Return the approximate number of bytes used by a response
+    """
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_sizeof(v) for v in value)
+    return size
+
+
+class ResponseCache(object):
+    """
+    Read-through cache of raw API responses keyed on method name and arguments.
+
+    Only methods with a TTL are cached. Write methods invalidate the cached
+    responses they affect, no matter if they succeeded or not. When the cache
+    is full the least recently used responses are evicted.
+
+    :param ttls: ``dict`` of method names and the number of seconds to keep
+                 their responses. Defaults to all read methods
+    :param max_entries: Maximum number of responses to keep
+    :param max_size: Maximum approximate number of bytes to keep, or ``None``
+                     for no limit
+    :param clock: Monotonic clock function, mainly useful for testing
+    """
+
+    def __init__(
+            self, ttls=None, max_entries=1024, max_size=None,
+            clock=time.monotonic):
+        if ttls is None:
+            ttls = _default_ttls
+        self.ttls = dict(ttls)
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _pop(self, key):
+        _, _, size = self._entries.pop(key)
+        self.size -= size
+
+    def get(self, method, args):
+        """
+        Return a tuple of whether there was a fresh response cached and the
+        response itself.
+        """
+
+        key = (method,) + tuple(args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                self._pop(key)
+            self.misses += 1
+        return False, None
+
+    def set(self, method, args, response):
+        ttl = self.ttls.get(method)
+        if not ttl:
+            return
+
+        key = (method,) + tuple(args)
+        size = _sizeof(response) if self.max_size is not None else 0
+        if self.max_size is not None and size > self.max_size:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (self._clock() + ttl, response, size)
+            self.size += size
+
+            while len(self._entries) > self.max_entries or (
+                    self.max_size is not None and self.size > self.max_size):
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, method, args):
+        """
+        Drop cached responses affected by calling the given write method with
+        the given arguments.
+        """
+
+        with self._lock:
+            for read_method, count in _invalidations.get(method, ()):
+                key = (read_method,) + tuple(args[:count])
+                if key in self._entries:
+                    self._pop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def call(self, method, args, func):
+        """
+        Return the cached response for the given call if possible, otherwise
+        call ``func(method, *args)`` and cache its response.
+        """
+
+        if method not in self.ttls:
+            try:
+                return func(method, *args)
+            finally:
+                self.invalidate(method, args)
+
+        hit, response = self.get(method, args)
+        if not hit:
+            response = func(method, *args)
+            self.set(method, args, response)
+        return response
@@ -1,8 +1,22 @@
-from ._compat import ServerProxy, string_types
-from .exceptions import LoopiaError
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+# Modules that are only needed by some methods are imported by those methods,
+# which keeps importing the client fast
+from ._compat import Fault, ServerProxy, dumps, loads, string_types
+from .exceptions import LoopiaError, RateLimitedError
+from .metrics import CallInfo
+from .singleflight import SingleFlight
+from .transport import PooledTransport
 from .types import DnsRecord, Domain, _validate_int
 
 
+logger = logging.getLogger(__name__)
+
 def _parse_status_code(response):
     """
     Return error string code if the response is an error, otherwise ``"OK"``
@@ -21,26 +35,402 @@ def _parse_status_code(response):
     return "OK"
 
 
+def _check_response(response):
+    """
+    Raise the matching ``LoopiaError`` if the response is an error, otherwise
+    return the response unless it is a plain status string
+    """
+
+    # Check if there was an error with the request
+    status = _parse_status_code(response)
+    if status != "OK":
+        raise LoopiaError.from_code(status)
+
+    # If it's not a string and not an error we want to return the value
+    if not isinstance(response, string_types):
+        return response
+
+
+def _notify_rate_limiter(rate_limiter, response):
+    """
+    Let the rate limiter adapt to the outcome of a call
+    """
+
+    if rate_limiter is None:
+        return
+
+    if _parse_status_code(response) == RateLimitedError.code:
+        rate_limiter.rate_limited()
+    else:
+        rate_limiter.succeeded()
+
+
 class Loopia(object):
     encoding = "utf-8"
 
-    def __init__(self, user, password, domain = 'se'):
-        self.base_url = f"https://api.loopia.{domain}/RPCSERV"
+    def __init__(
+            self, user, password, domain = 'se', base_url=None,
+            transport=None, workers=8, rate_limiter=None, retry_policy=None,
+            cache=None, hooks=None, single_flight=None, index=None):
+        if base_url is None:
+            base_url = f"https://api.loopia.{domain}/RPCSERV"
+        self.base_url = base_url
         self.user = user
         self.password = password
-        self._client = ServerProxy(self.base_url, encoding=self.encoding)
+
+        # Keep connections alive between calls to avoid a new TCP and TLS
+        # handshake for every request
+        if transport is None:
+            transport = PooledTransport(
+                use_https=self.base_url.startswith("https:"))
+        self.transport = transport
+        self.workers = workers
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.cache = cache
+
+        # Identical reads that are made at the same time share a single
+        # request unless disabled with False
+        if single_flight is None:
+            single_flight = SingleFlight()
+        elif single_flight is False:
+            single_flight = None
+        self.single_flight = single_flight
+
+        # Instrumentation hooks, see ``loopialib.metrics.CallHook``
+        self.hooks = list(hooks or ())
+
+        # ``RecordIndex`` kept up to date with the writes made by the client
+        self.index = index
+        self._index_lock = threading.Lock()
+
+        self._client = self._new_client()
+        self._local = threading.local()
+
+        # Whether the API supports ``system.multicall``, or ``None`` until a
+        # batch has found out
+        self._multicall = None
+
+    def _new_client(self):
+        return ServerProxy(
+            self.base_url, transport=self.transport, encoding=self.encoding)
 
     def _call(self, method, *args):
-        response = getattr(self._client, method)(self.user, self.password, *args)
+        if self.cache is None:
+            response = self._call_shared(method, *args)
+        else:
+            response = self.cache.call(method, args, self._call_shared)
+
+        if self.index is not None:
+            self._update_index([(method, args)])
+        return response
+
+    def _update_index(self, calls):
+        """
+        Apply successful ``(method, args)`` calls to the index. Sub domains
+        that got records added are fetched again to learn their IDs, since
+        the API doesn't return them. Within ``_defer_index_refresh`` every sub
+        domain is only fetched once, when it ends.
+        """
+
+        stale = set()
+        for method, args in calls:
+            if self.index.apply(method, args):
+                stale.add((args[0], args[1]))
+        if not stale:
+            return
+
+        deferred = getattr(self._local, "index_stale", None)
+        if deferred is not None:
+            with self._index_lock:
+                deferred.update(stale)
+            return
+        self._refresh_index(stale)
+
+    def _refresh_index(self, zones):
+        """
+        Fetch the records of the given sub domains, and of those that could
+        not be fetched before, for the index.
+
+        The writes that made them stale have already been made, so failures
+        are logged and the sub domains are marked stale in the index instead
+        of failing the write. Callers that retry would add the records again.
+        """
+
+        # Bypass the cache and single flight, which could hand out a response
+        # to a read that started before the write
+        zones = set(zones).union(self.index.stale_zones())
+        for domain, subdomain in sorted(zones):
+            try:
+                records = self._call_uncached(
+                    "getZoneRecords", domain, subdomain)
+                self.index.set_zone(domain, subdomain, [
+                    DnsRecord.from_trusted_dict(record) for record in records
+                ])
+            except Exception as e:
+                logger.warning(
+                    "Fetching %s of %s for the index failed: %s",
+                    subdomain, domain, e)
+                self.index.mark_stale(domain, subdomain)
+
+    @contextmanager
+    def _defer_index_refresh(self):
+        """
+        Collect the sub domains that have to be fetched again for the index
+        while many writes are made by the current thread, and fetch each of
+        them once at the end.
+
+        :return: The ``set`` of stale sub domains, which worker threads of a
+                 bulk call share by setting it as ``self._local.index_stale``
+        """
+
+        stale = getattr(self._local, "index_stale", None)
+        outermost = stale is None
+        if outermost:
+            stale = self._local.index_stale = set()
+        try:
+            yield stale
+        finally:
+            if outermost:
+                del self._local.index_stale
+                if stale and self.index is not None:
+                    self._refresh_index(stale)
+
+    def _call_shared(self, method, *args):
+        if self.single_flight is None:
+            return self._call_uncached(method, *args)
+        return self.single_flight.call(method, args, self._call_uncached)
+
+    def _call_uncached(self, method, *args):
+        if self.retry_policy is None:
+            return self._call_once(method, *args)
+        return self.retry_policy.call(method, self._call_once, method, *args)
+
+    def _call_once(self, method, *args):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        if self.hooks:
+            return self._call_instrumented(method, args)
+
+        # Bulk workers have a client of their own
+        client = getattr(self._local, "client", self._client)
+        response = getattr(client, method)(self.user, self.password, *args)
+
+        _notify_rate_limiter(self.rate_limiter, response)
+        return _check_response(response)
+
+    def _request_target(self):
+        """
+        Return the host and path of the API for use with the transport.
+        """
+
+        parts = urlsplit(self.base_url)
+        return parts.netloc, urlunsplit(("", "") + parts[2:]) or "/"
+
+    def _request_body(self, method, args):
+        return dumps(
+            (self.user, self.password) + args,
+            method,
+            encoding=self.encoding,
+        ).encode(self.encoding, "xmlcharrefreplace")
+
+    def _call_instrumented(self, method, args):
+        """
+        Make a request like ``_call_once`` while timing the serialization,
+        transport and deserialization of it for the hooks.
+        """
+
+        for hook in self.hooks:
+            hook.before_call(method, args)
+
+        clock = time.perf_counter
+        start = clock()
+        timings = [None] * 5
+        status = None
+        try:
+            if hasattr(self.transport, "request_raw"):
+                request_body = self._request_body(method, args)
+                sent = clock()
+                response_body = self.transport.request_raw(
+                    *self._request_target() + (request_body,))
+                received = clock()
+                response = loads(response_body)[0][0]
+                timings = [
+                    sent - start,
+                    received - sent,
+                    clock() - received,
+                    len(request_body),
+                    len(response_body),
+                ]
+            else:
+                client = getattr(self._local, "client", self._client)
+                response = getattr(client, method)(
+                    self.user, self.password, *args)
+                timings[1] = clock() - start
+
+            status = _parse_status_code(response)
+            _notify_rate_limiter(self.rate_limiter, response)
+            result = _check_response(response)
+        except Exception as e:
+            if status is None:
+                status = type(e).__name__
+                if isinstance(e, Fault):
+                    status = str(e.faultCode)
+
+            info = CallInfo(method, status, clock() - start, *timings)
+            for hook in self.hooks:
+                hook.call_failed(info, e)
+            raise
+
+        info = CallInfo(method, status, clock() - start, *timings)
+        for hook in self.hooks:
+            hook.after_call(info)
+        return result
+
+    def _call_stream(self, method, factory, *args):
+        """
+        Call a method that returns an array of structs and yield them as
+        objects created by ``factory`` while the response is being received.
+
+        Streamed calls are never cached or retried, since the items may
+        already have been consumed when an error occurs.
+        """
+
+        if not hasattr(self.transport, "request_stream"):
+            for item in self._call(method, *args):
+                yield factory(item)
+            return
+
+        from .stream import StreamParser
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        host, handler = self._request_target()
+        items = self.transport.request_stream(
+            host,
+            handler,
+            self._request_body(method, args),
+            StreamParser(factory))
+
+        first = True
+        for item in items:
+            # Errors are reported as a string instead of the expected array,
+            # or as an array containing only a string
+            if first:
+                first = False
+                if isinstance(item, string_types):
+                    items.close()
+                    _notify_rate_limiter(self.rate_limiter, item)
+                    raise LoopiaError.from_code(item)
+                _notify_rate_limiter(self.rate_limiter, "OK")
+            yield item
+
+    def _multicall_request(self, calls):
+        """
+        Send ``(method, args)`` tuples in a single ``system.multicall`` request.
+
+        Returns a list with the response of every call in the same order as
+        the calls, where calls that failed have their exception in place of a
+        response. Multicall requests are never cached or retried, but cached
+        responses are invalidated by the write calls they contain.
+        """
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        client = getattr(self._local, "client", self._client)
+        try:
+            responses = client.system.multicall([
+                {
+                    "methodName": method,
+                    "params": [self.user, self.password] + list(args),
+                }
+                for method, args in calls
+            ])
+        finally:
+            if self.cache is not None:
+                for method, args in calls:
+                    if method not in self.cache.ttls:
+                        self.cache.invalidate(method, args)
+
+        results = []
+        for response in responses:
+            # Calls that raised a fault are returned as a fault struct,
+            # otherwise the response is wrapped in a list
+            if isinstance(response, dict):
+                results.append(
+                    Fault(response["faultCode"], response["faultString"]))
+                continue
+
+            _notify_rate_limiter(self.rate_limiter, response[0])
+            try:
+                results.append(_check_response(response[0]))
+            except LoopiaError as e:
+                results.append(e)
+
+        if self.index is not None:
+            self._update_index([
+                call
+                for call, result in zip(calls, results)
+                if not isinstance(result, Exception)
+            ])
+        return results
+
+    def batch(self, max_calls=100):
+        """
+        Return a ``Batch`` that queues calls and sends them together when it
+        is used as a context manager and exits. See ``loopialib.batch.Batch``.
+
+        :param max_calls: Maximum number of calls per multicall request
+        """
 
-        # Check if there was an error with the request
-        status = _parse_status_code(response)
-        if status != "OK":
-            raise LoopiaError.from_code(status)
+        from .batch import Batch
 
-        # If it's not a string and not an error we want to return the value
-        if not isinstance(response, string_types):
-            return response
+        return Batch(self, max_calls=max_calls)
+
+    def _bulk(self, func, items, workers=None, stop_on_error=False):
+        """
+        Call ``func(*item)`` for every item using a pool of worker threads.
+
+        Returns a list with the result of every call in the same order as the
+        items. Calls that failed have their exception in place of a result,
+        unless ``stop_on_error`` is set in which case the first error is
+        raised and calls that haven't started yet are cancelled.
+        """
+
+        from concurrent.futures import (
+            FIRST_EXCEPTION, ThreadPoolExecutor, wait)
+
+        if workers is None:
+            workers = self.workers
+
+        def init_worker(index_stale):
+            self._local.client = self._new_client()
+            self._local.index_stale = index_stale
+
+        def call(item):
+            try:
+                return func(*item)
+            except Exception as e:
+                if stop_on_error:
+                    raise
+                return e
+
+        with self._defer_index_refresh() as index_stale, \
+                ThreadPoolExecutor(
+                    workers, initializer=init_worker,
+                    initargs=(index_stale,)) as executor:
+            futures = [executor.submit(call, tuple(item)) for item in items]
+            if stop_on_error:
+                done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in pending:
+                    future.cancel()
+                for future in futures:
+                    if future in done and future.exception() is not None:
+                        raise future.exception()
+            return [future.result() for future in futures]
 
     def get_domain(self, domain):
         """
@@ -64,8 +454,23 @@ class Loopia(object):
             for domain in self._call("getDomains")
         ]
 
+    def iter_domains(self):
+        """
+        Return an iterator of all domains belonging to this account that
+        parses the response while it is being received. Use this instead of
+        ``get_domains`` for very large accounts.
+
+        :return: An iterator of ``Domain`` ``namedtuple``
+        """
+
+        return self._call_stream("getDomains", Domain.from_dict)
+
     def get_subdomains(self, domain):
-        return self._call("getSubdomains", domain)
+        # Copy since the response may be cached
+        return list(self._call("getSubdomains", domain))
+
+    def add_subdomain(self, domain, subdomain):
+        return self._call("addSubdomain", domain, subdomain)
 
     def remove_subdomain(self, domain, subdomain=None):
         if subdomain is None:
@@ -87,10 +492,25 @@ class Loopia(object):
             subdomain = "@"
 
         return [
-            DnsRecord.from_dict(record)
+            DnsRecord.from_trusted_dict(record)
             for record in self._call("getZoneRecords", domain, subdomain)
         ]
 
+    def iter_zone_records(self, domain, subdomain=None):
+        """
+        Return an iterator of the records of the given sub domain that parses
+        the response while it is being received. Use this instead of
+        ``get_zone_records`` for very large zones.
+
+        :return: An iterator of ``DnsRecord`` ``namedtuple``
+        """
+
+        if subdomain is None:
+            subdomain = "@"
+
+        return self._call_stream(
+            "getZoneRecords", DnsRecord.from_trusted_dict, domain, subdomain)
+
     def update_zone_record(self, record, domain, subdomain=None):
         if subdomain is None:
             subdomain = "@"
@@ -110,3 +530,171 @@ class Loopia(object):
         _validate_int("id", id)
 
         self._call("removeZoneRecord", domain, subdomain, id)
+
+    def add_zone_records(self, items, workers=None, stop_on_error=False):
+        """
+        Add many zone records concurrently.
+
+        :param items: Iterable of ``(record, domain, subdomain)`` tuples. The
+                      sub domain may be left out
+        :param workers: Number of worker threads, defaults to ``self.workers``
+        :param stop_on_error: Raise the first error instead of returning it
+        :return: A ``list`` with ``None`` or an exception for every item
+        """
+
+        return self._bulk(
+            self.add_zone_record, items, workers, stop_on_error)
+
+    def get_zone_records_many(self, items, workers=None, stop_on_error=False):
+        """
+        Fetch the zone records of many sub domains concurrently.
+
+        :param items: Iterable of ``(domain, subdomain)`` tuples. The sub
+                      domain may be left out
+        :param workers: Number of worker threads, defaults to ``self.workers``
+        :param stop_on_error: Raise the first error instead of returning it
+        :return: A ``list`` with a ``list`` of records or an exception for every
+                 item
+        """
+
+        return self._bulk(
+            self.get_zone_records, items, workers, stop_on_error)
+
+    def update_zone_records(self, items, workers=None, stop_on_error=False):
+        """
+        Update many zone records concurrently.
+
+        :param items: Iterable of ``(record, domain, subdomain)`` tuples. The
+                      sub domain may be left out
+        :param workers: Number of worker threads, defaults to ``self.workers``
+        :param stop_on_error: Raise the first error instead of returning it
+        :return: A ``list`` with ``None`` or an exception for every item
+        """
+
+        return self._bulk(
+            self.update_zone_record, items, workers, stop_on_error)
+
+    def remove_zone_records(self, items, workers=None, stop_on_error=False):
+        """
+        Remove many zone records concurrently.
+
+        :param items: Iterable of ``(id, domain, subdomain)`` tuples. The sub
+                      domain may be left out
+        :param workers: Number of worker threads, defaults to ``self.workers``
+        :param stop_on_error: Raise the first error instead of returning it
+        :return: A ``list`` with ``None`` or an exception for every item
+        """
+
+        return self._bulk(
+            self.remove_zone_record, items, workers, stop_on_error)
+
+    def sync_zone(
+            self, domain, subdomain, desired_records, dry_run=False,
+            workers=1):
+        """
+        Make the records of the given sub domain match the desired records
+        using as few calls as possible.
+
+        Updates are applied first and removals last, so the sub domain is
+        never empty in between unless that is the desired state.
+
+        :param domain: Domain name
+        :param subdomain: Sub domain, or ``None`` for the wildcard sub domain
+        :param desired_records: Iterable of ``DnsRecord`` that should exist
+        :param dry_run: Only return the plan without applying it
+        :param workers: Number of worker threads to apply the plan with
+        :return: The ``ZonePlan`` that was applied
+        """
+
+        if subdomain is None:
+            subdomain = "@"
+
+        from .sync import plan_zone
+
+        plan = plan_zone(
+            self.get_zone_records(domain, subdomain), desired_records)
+        if dry_run:
+            return plan
+
+        steps = [
+            (self.update_zone_record, plan.update),
+            (self.add_zone_record, plan.add),
+            (self.remove_zone_record, [record.id for record in plan.remove]),
+        ]
+        for func, values in steps:
+            items = [(value, domain, subdomain) for value in values]
+            if workers > 1:
+                self._bulk(func, items, workers, stop_on_error=True)
+            else:
+                for item in items:
+                    func(*item)
+        return plan
+
+    def export_zone_file(self, domain, fp):
+        """
+        Write all records of a domain to a text file in the zone file format.
+        See ``loopialib.zonefile.export_zone_file``.
+
+        :param domain: Domain name
+        :param fp: File object opened in text mode
+        :return: Number of records written
+        """
+
+        from .zonefile import export_zone_file
+
+        return export_zone_file(self, domain, fp)
+
+    def import_zone_file(self, domain, fp, replace=False):
+        """
+        Add the records of a zone file to a domain while reading it. See
+        ``loopialib.zonefile.import_zone_file``.
+
+        :param domain: Domain name
+        :param fp: File object opened in text mode
+        :param replace: Remove records of the sub domains in the file that
+                        are not in the file
+        :return: A ``ZoneImport`` with the number of changes
+        """
+
+        from .zonefile import import_zone_file
+
+        return import_zone_file(self, domain, fp, replace=replace)
+
+    def snapshot(self, workers=None, skip_domains=(), skip_zones=()):
+        """
+        Crawl the whole account and yield a ``ZoneSnapshot`` for every sub
+        domain as soon as it has been fetched.
+
+        :param workers: Number of worker threads, defaults to ``self.workers``
+        :param skip_domains: Domain names to leave out
+        :param skip_zones: ``(domain, subdomain)`` tuples to leave out
+        """
+
+        if workers is None:
+            workers = self.workers
+
+        from .snapshot import crawl
+
+        return crawl(
+            self,
+            workers=workers,
+            skip_domains=skip_domains,
+            skip_zones=skip_zones)
+
+    def save_snapshot(self, path, workers=None, resume=True):
+        """
+        Crawl the whole account into a JSON Lines file. See
+        ``loopialib.snapshot.save_snapshot``.
+
+        :param path: Path of the snapshot file
+        :param workers: Number of worker threads, defaults to ``self.workers``
+        :param resume: Continue an interrupted snapshot in the same file
+        :return: Number of zones written
+        """
+
+        if workers is None:
+            workers = self.workers
+
+        from .snapshot import save_snapshot
+
+        return save_snapshot(self, path, workers=workers, resume=resume)
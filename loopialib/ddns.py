@@ -0,0 +1,364 @@
+"""
+Dynamic DNS updating of A and AAAA records.
+
+``DynDnsUpdater`` keeps the last known records of every host name in memory
+and only calls the API when an address actually differs from them. Reads and
+writes for all host names are sent together using ``Loopia.batch``.
+"""
+
+import ipaddress
+import json
+import logging
+import socket
+import time
+
+from collections import OrderedDict, namedtuple
+from urllib.request import urlopen
+
+from ._compat import Fault, ProtocolError, http_client
+from .exceptions import LoopiaError
+from .types import DnsRecord
+from .utils import split_domains
+
+
+__all__ = [
+    "AddressUpdate",
+    "DynDnsUpdater",
+    "address_from_route",
+    "address_from_url",
+    "get_addresses",
+    "parse_source",
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+#: A change of the address of a host name. ``old`` is ``None`` when a record
+#: was added and ``new`` is ``None`` when a surplus record was removed.
+#: ``error`` is the exception if the change failed, otherwise ``None``
+AddressUpdate = namedtuple(
+    "AddressUpdate", ["hostname", "type", "old", "new", "error"])
+
+
+def _record_type(address):
+    return "A" if ipaddress.ip_address(address).version == 4 else "AAAA"
+
+
+def address_from_url(url, timeout=10.0):
+    """
+    Return the address that a web service such as ``https://api.ipify.org``
+    responds with as plain text.
+    """
+
+    with urlopen(url, timeout=timeout) as response:
+        address = response.read(64).decode("ascii").strip()
+    return str(ipaddress.ip_address(address))
+
+
+#: Documentation addresses used to find the local address of the default
+#: route. Connecting a UDP socket doesn't send anything
+_route_targets = {
+    socket.AF_INET: "192.0.2.1",
+    socket.AF_INET6: "2001:db8::1",
+}
+
+
+def address_from_route(family=socket.AF_INET):
+    """
+    Return the local address of the interface that the default route goes
+    through, for hosts that have a public address of their own.
+    """
+
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.connect((_route_targets[family], 53))
+        return sock.getsockname()[0]
+
+
+def parse_source(source):
+    """
+    Return a function that returns an address from the given source
+    specification, which is one of:
+
+    - ``url:<url>`` for a web service that responds with the address
+    - ``route`` or ``route6`` for the local IPv4 or IPv6 address of the
+      default route
+    - ``static:<address>`` for a fixed address
+    """
+
+    kind, _, value = source.partition(":")
+    if kind == "url" and value:
+        return lambda: address_from_url(value)
+    if kind == "route" and not value:
+        return lambda: address_from_route(socket.AF_INET)
+    if kind == "route6" and not value:
+        return lambda: address_from_route(socket.AF_INET6)
+    if kind == "static" and value:
+        address = str(ipaddress.ip_address(value))
+        return lambda: address
+    raise ValueError("Unknown address source '{}'".format(source))
+
+
+def get_addresses(sources):
+    """
+    Return a ``dict`` of record types and addresses from the given address
+    source functions. Sources that fail are logged and skipped, which means
+    that records of that type are left as they are. When several sources
+    return an address of the same type the first one wins.
+    """
+
+    addresses = {}
+    for source in sources:
+        try:
+            address = source()
+        except (OSError, ValueError, http_client.HTTPException) as e:
+            logger.warning("Address source failed: %s", e)
+            continue
+        addresses.setdefault(_record_type(address), address)
+    return addresses
+
+
+class DynDnsUpdater(object):
+    """
+    Point the A and AAAA records of host names at changing addresses.
+
+    The records of every host name are fetched once and then kept in memory,
+    so a sync where no address changed makes no API calls at all. The cached
+    records are refreshed every ``refresh_interval`` seconds to pick up
+    changes made elsewhere. All reads and writes of a sync are sent together
+    through ``Loopia.batch``, ordered by domain.
+
+    :param loopia: ``Loopia`` client
+    :param hostnames: Host names to update, such as ``home.example.com``
+    :param ttl: TTL of records that have to be added
+    :param refresh_interval: Number of seconds to trust cached records
+    :param clock: Monotonic clock function, mainly useful for testing
+    """
+
+    def __init__(
+            self, loopia, hostnames, ttl=None, refresh_interval=3600.0,
+            clock=time.monotonic):
+        self.loopia = loopia
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+
+        hostnames = list(hostnames)
+        domains, subdomains = split_domains(hostnames)
+        hosts = sorted(
+            (domain, subdomain or "@", hostname)
+            for hostname, domain, subdomain in zip(
+                hostnames, domains, subdomains))
+
+        #: ``(domain, subdomain)`` of every host name, grouped by domain
+        self.hosts = OrderedDict(
+            ((domain, subdomain), hostname)
+            for domain, subdomain, hostname in hosts)
+
+        self._records = {}
+        self._refreshed = None
+
+    def _fetch(self, keys):
+        """
+        Fetch the records of the given hosts into the cache. Hosts that fail
+        are left out of it and logged.
+        """
+
+        with self.loopia.batch() as batch:
+            futures = [
+                (key, batch.get_zone_records(*key))
+                for key in keys
+            ]
+
+        for key, future in futures:
+            error = future.exception()
+            if error is None:
+                self._records[key] = future.result()
+            else:
+                logger.warning(
+                    "Fetching records of %s failed: %s", self.hosts[key], error)
+
+    def plan(self, addresses):
+        """
+        Return a ``list`` of ``(key, old record, new record)`` tuples of the
+        changes needed to point every cached host at the given addresses.
+        ``old`` is ``None`` for records that have to be added and ``new`` is
+        ``None`` for records that have to be removed.
+
+        A host ends up with a single record of every type. A record that
+        already has the address is kept, or else the first one is updated,
+        and any other records of the type are removed.
+        """
+
+        changes = []
+        for key in self.hosts:
+            records = self._records.get(key)
+            if records is None:
+                continue
+
+            for type, address in sorted(addresses.items()):
+                current = [record for record in records if record.type == type]
+                if not current:
+                    changes.append((key, None, DnsRecord(
+                        type, ttl=self.ttl, data=address)))
+                    continue
+
+                keep = next(
+                    (r for r in current if r.data == address), current[0])
+                if keep.data != address:
+                    changes.append((key, keep, keep.replace(data=address)))
+                for record in current:
+                    if record is not keep:
+                        changes.append((key, record, None))
+        return changes
+
+    def sync(self, addresses):
+        """
+        Make the A and AAAA records of every host name point at the given
+        addresses, calling the API only for records that differ.
+
+        :param addresses: ``dict`` of record types and addresses, such as
+                          ``{"A": "192.0.2.10"}``
+        :return: A ``list`` of ``AddressUpdate``
+        """
+
+        now = self._clock()
+        refresh_due = (
+            self._refreshed is None or
+            now - self._refreshed >= self.refresh_interval)
+        if refresh_due:
+            self._records.clear()
+            self._refreshed = now
+
+        missing = [key for key in self.hosts if key not in self._records]
+        if missing:
+            self._fetch(missing)
+
+        changes = self.plan(addresses)
+        if not changes:
+            return []
+
+        with self.loopia.batch() as batch:
+            futures = []
+            for key, old, new in changes:
+                if old is None:
+                    future = batch.add_zone_record(new, *key)
+                elif new is None:
+                    future = batch.remove_zone_record(old.id, *key)
+                else:
+                    future = batch.update_zone_record(new, *key)
+                futures.append(future)
+
+        updates = []
+        stale = []
+        for (key, old, new), future in zip(changes, futures):
+            error = future.exception()
+            if error is not None or old is None:
+                # Added records have no known ID and failed ones an unknown
+                # state, so they have to be fetched again
+                if self._records.pop(key, None) is not None:
+                    stale.append(key)
+            elif key in self._records:
+                # Hosts that are fetched again get the other changes too
+                self._records[key] = [
+                    new if record == old else record
+                    for record in self._records[key]
+                    if new is not None or record != old
+                ]
+
+            update = AddressUpdate(
+                self.hosts[key],
+                (new or old).type,
+                old.data if old is not None else None,
+                new.data if new is not None else None,
+                error)
+            updates.append(update)
+            if error is None and new is None:
+                logger.info(
+                    "Removed %s %s record of %s",
+                    update.hostname, update.type, update.old)
+            elif error is None:
+                logger.info(
+                    "Pointed %s %s record at %s",
+                    update.hostname, update.type, update.new)
+            else:
+                logger.warning(
+                    "Updating %s %s record failed: %s",
+                    update.hostname, update.type, error)
+
+        if stale:
+            self._fetch(stale)
+        return updates
+
+    def run(self, sources, interval=300.0, iterations=None, sleep=time.sleep):
+        """
+        Sync the addresses from the given source functions every ``interval``
+        seconds. Syncs that fail because the API or the network is down are
+        logged and tried again in the next round.
+
+        :param sources: Address source functions, see ``parse_source``
+        :param interval: Number of seconds between syncs
+        :param iterations: Number of syncs to make, or ``None`` to run forever
+        :param sleep: Sleep function, mainly useful for testing
+        """
+
+        count = 0
+        while iterations is None or count < iterations:
+            if count:
+                sleep(interval)
+            count += 1
+
+            addresses = get_addresses(sources)
+            if not addresses:
+                logger.warning("No address sources succeeded")
+                continue
+
+            # Outages of the API must not stop the updater, the next round
+            # tries again
+            try:
+                self.sync(addresses)
+            except (LoopiaError, OSError, Fault, ProtocolError,
+                    http_client.HTTPException) as e:
+                logger.warning("Sync failed: %s", e)
+
+    def save_state(self, fp):
+        """
+        Write the cached records to the given text file as JSON, so that a
+        later process can continue without fetching them again.
+        """
+
+        age = None
+        if self._refreshed is not None:
+            age = self._clock() - self._refreshed
+
+        json.dump(
+            {
+                "saved": time.time(),
+                "age": age,
+                "records": [
+                    [domain, subdomain, [r.to_dict() for r in records]]
+                    for (domain, subdomain), records in sorted(
+                        self._records.items())
+                ],
+            },
+            fp,
+            separators=(",", ":"))
+
+    def load_state(self, fp):
+        """
+        Load cached records written by ``save_state``. Host names that are no
+        longer configured are ignored. The records are only trusted until
+        ``refresh_interval`` seconds after they were fetched.
+        """
+
+        state = json.load(fp)
+        if state["age"] is None:
+            return
+
+        age = state["age"] + max(0.0, time.time() - state["saved"])
+        self._refreshed = self._clock() - age
+        for domain, subdomain, records in state["records"]:
+            if (domain, subdomain) in self.hosts:
+                self._records[(domain, subdomain)] = [
+                    DnsRecord.from_dict(record) for record in records
+                ]
@@ -0,0 +1,260 @@
+import bisect
+import threading
+
+from collections import namedtuple
+
+from .types import DnsRecord
+
+
+__all__ = [
+    "IndexedRecord",
+    "RecordIndex",
+]
+
+
+#: A record along with the domain and sub domain it belongs to
+IndexedRecord = namedtuple("IndexedRecord", ["domain", "subdomain", "record"])
+
+
+def _index_add(index, value, key):
+    keys = index.get(value)
+    if keys is None:
+        keys = index[value] = set()
+    keys.add(key)
+    return keys
+
+
+def _index_discard(index, value, key):
+    keys = index[value]
+    keys.discard(key)
+    if not keys:
+        del index[value]
+        return True
+    return False
+
+
+class RecordIndex(object):
+    """
+    In-memory index of the zone records of an account that answers questions
+    such as which host names point at an address without going through every
+    zone.
+
+    Records are indexed by type, data, priority, TTL, domain and sub domain.
+    Lookups on a single value take constant time and TTL ranges are found by
+    bisecting the sorted TTLs. Lookups on several values intersect the
+    matching records, starting with the smallest set.
+
+    Pass the index to ``Loopia`` as ``index`` to keep it up to date with the
+    writes made through the client, so that it never has to be rebuilt::
+
+        index = RecordIndex(loopia.snapshot())
+        loopia.index = index
+        index.hostnames(type="A", data="203.0.113.7")
+
+    :param zones: Iterable of ``(domain, subdomain, records)`` tuples such as
+                  ``ZoneSnapshot``, to build the index from
+    """
+
+    def __init__(self, zones=()):
+        self._lock = threading.RLock()
+        self._records = {}
+        self._zones = {}
+        self._domains = {}
+        self._types = {}
+        self._data = {}
+        self._priorities = {}
+        self._ttls = {}
+        self._sorted_ttls = []
+
+        # Sub domains whose records could not be fetched after a write
+        self._stale = set()
+
+        for domain, subdomain, records in zones:
+            self.set_zone(domain, subdomain, records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def _add(self, domain, subdomain, record):
+        if record.id == 0:
+            raise ValueError("Record must have an ID")
+
+        key = (domain, subdomain, record.id)
+        if key in self._records:
+            self._remove(key)
+
+        self._records[key] = IndexedRecord(domain, subdomain, record)
+        _index_add(self._zones, (domain, subdomain), key)
+        _index_add(self._domains, domain, key)
+        _index_add(self._types, record.type, key)
+        _index_add(self._data, record.data, key)
+        _index_add(self._priorities, record.priority, key)
+        if len(_index_add(self._ttls, record.ttl, key)) == 1:
+            bisect.insort(self._sorted_ttls, record.ttl)
+
+    def _remove(self, key):
+        domain, subdomain, record = self._records.pop(key)
+        _index_discard(self._zones, (domain, subdomain), key)
+        _index_discard(self._domains, domain, key)
+        _index_discard(self._types, record.type, key)
+        _index_discard(self._data, record.data, key)
+        _index_discard(self._priorities, record.priority, key)
+        if _index_discard(self._ttls, record.ttl, key):
+            del self._sorted_ttls[
+                bisect.bisect_left(self._sorted_ttls, record.ttl)]
+
+    def set_zone(self, domain, subdomain, records):
+        """
+        Replace the indexed records of a sub domain.
+        """
+
+        with self._lock:
+            self.remove_zone(domain, subdomain)
+            for record in records:
+                self._add(domain, subdomain, record)
+
+    def remove_zone(self, domain, subdomain):
+        with self._lock:
+            self._stale.discard((domain, subdomain))
+            for key in list(self._zones.get((domain, subdomain), ())):
+                self._remove(key)
+
+    def mark_stale(self, domain, subdomain):
+        """
+        Mark the records of a sub domain as out of date until it is replaced
+        with ``set_zone`` or removed.
+        """
+
+        with self._lock:
+            self._stale.add((domain, subdomain))
+
+    def stale_zones(self):
+        """
+        Return a sorted ``list`` of the ``(domain, subdomain)`` tuples whose
+        indexed records are out of date.
+        """
+
+        with self._lock:
+            return sorted(self._stale)
+
+    def add(self, domain, subdomain, record):
+        """
+        Add a record, or replace the record with the same ID.
+        """
+
+        with self._lock:
+            self._add(domain, subdomain, record)
+
+    update = add
+
+    def remove(self, domain, subdomain, id):
+        with self._lock:
+            key = (domain, subdomain, id)
+            if key in self._records:
+                self._remove(key)
+
+    def apply(self, method, args):
+        """
+        Apply a successful write call made with the given API method and
+        arguments, without the credentials.
+
+        :return: ``True`` if the sub domain must be fetched again with
+                 ``set_zone``, since the API doesn't tell the IDs of added
+                 records
+        """
+
+        if method == "addZoneRecord":
+            return True
+        if method == "updateZoneRecord":
+            domain, subdomain, record = args
+            self.update(domain, subdomain, DnsRecord.from_dict(record))
+        elif method == "removeZoneRecord":
+            self.remove(*args)
+        elif method == "removeSubdomain":
+            self.remove_zone(*args)
+        return False
+
+    def _candidates(self, type, data, priority, ttl, min_ttl, max_ttl,
+                    domain, subdomain):
+        """
+        Return a list of the sets of keys that match every given value.
+        """
+
+        candidates = []
+        if domain is not None and subdomain is not None:
+            candidates.append(self._zones.get((domain, subdomain), ()))
+        elif domain is not None:
+            candidates.append(self._domains.get(domain, ()))
+        elif subdomain is not None:
+            raise ValueError("A sub domain must be given with its domain")
+
+        for index, value in [
+                (self._types, type),
+                (self._data, data),
+                (self._priorities, priority),
+                (self._ttls, ttl)]:
+            if value is not None:
+                candidates.append(index.get(value, ()))
+
+        if min_ttl is not None or max_ttl is not None:
+            start = 0
+            end = len(self._sorted_ttls)
+            if min_ttl is not None:
+                start = bisect.bisect_left(self._sorted_ttls, min_ttl)
+            if max_ttl is not None:
+                end = bisect.bisect_right(self._sorted_ttls, max_ttl)
+            keys = set()
+            for value in self._sorted_ttls[start:end]:
+                keys.update(self._ttls[value])
+            candidates.append(keys)
+        return candidates
+
+    def find(self, type=None, data=None, priority=None, ttl=None,
+             min_ttl=None, max_ttl=None, domain=None, subdomain=None):
+        """
+        Return the records that match all of the given values, ordered by
+        domain, sub domain and ID.
+
+        :param min_ttl: Smallest TTL to include
+        :param max_ttl: Largest TTL to include
+        :param subdomain: Sub domain, which requires ``domain``
+        :return: A ``list`` of ``IndexedRecord``
+        """
+
+        with self._lock:
+            candidates = self._candidates(
+                type, data, priority, ttl, min_ttl, max_ttl, domain,
+                subdomain)
+            if not candidates:
+                keys = self._records
+            else:
+                candidates.sort(key=len)
+                keys = set(candidates[0])
+                for other in candidates[1:]:
+                    if not keys:
+                        break
+                    keys.intersection_update(other)
+            return [self._records[key] for key in sorted(keys)]
+
+    def hostnames(self, **criteria):
+        """
+        Return a sorted ``list`` of the host names that have records matching
+        the given values, which are the same as for ``find``.
+        """
+
+        names = set()
+        for domain, subdomain, _ in self.find(**criteria):
+            if subdomain == "@":
+                names.add(domain)
+            else:
+                names.add("{}.{}".format(subdomain, domain))
+        return sorted(names)
+
+    def zones(self):
+        """
+        Return a sorted ``list`` of the ``(domain, subdomain)`` tuples that
+        have indexed records.
+        """
+
+        with self._lock:
+            return sorted(self._zones)
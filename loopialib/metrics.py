@@ -0,0 +1,236 @@
+import threading
+
+from bisect import bisect_left
+from collections import namedtuple
+
+
+__all__ = [
+    "CallHook",
+    "CallInfo",
+    "Histogram",
+    "MetricsCollector",
+]
+
+
+#: Measurements of a single API request. Times are in seconds. The serialize
+#: and deserialize times and the payload sizes are ``None`` when the transport
+#: doesn't support ``request_raw``, in which case the transport time covers
+#: the whole request. ``status`` is the status code of the response, the
+#: code of a fault as a string, or the name of the exception when there was
+#: no response
+CallInfo = namedtuple("CallInfo", [
+    "method",
+    "status",
+    "duration",
+    "serialize_time",
+    "transport_time",
+    "deserialize_time",
+    "request_bytes",
+    "response_bytes",
+])
+
+
+class CallHook(object):
+    """
+    Base class for hooks that are called around every API request made by
+    ``Loopia``. Retried calls result in one request per attempt, while calls
+    answered from the cache result in none.
+
+    Hooks are called from the thread making the request and must therefore be
+    thread-safe when the client is used from multiple threads.
+    """
+
+    def before_call(self, method, args):
+        """
+        Called before a request is sent.
+        """
+
+    def after_call(self, info):
+        """
+        Called with a ``CallInfo`` after a successful request.
+        """
+
+    def call_failed(self, info, error):
+        """
+        Called with a ``CallInfo`` and the exception when a request failed,
+        either because of the transport or because the API responded with an
+        error status.
+        """
+
+
+#: Default buckets for durations in seconds
+DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0)
+
+#: Default buckets for payload sizes in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram(object):
+    """
+    Histogram with fixed bucket upper bounds, in the style of Prometheus.
+
+    :param buckets: Sorted upper bounds of the buckets. Values that are larger
+                    than all of them are only counted in the total
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """
+        Return a ``list`` of ``(upper bound, count)`` tuples where every count
+        includes all smaller buckets, ending with ``float("inf")``.
+        """
+
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append((float("inf"), self.count))
+        return result
+
+
+def _labels(**labels):
+    return ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in sorted(labels.items()))
+
+
+def _format_bound(bound):
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(float(bound))
+
+
+class MetricsCollector(CallHook):
+    """
+    Hook that keeps histograms of durations and payload sizes per method in
+    memory, and counts calls per method and status.
+
+    Use ``to_prometheus`` to export the metrics in the Prometheus text
+    exposition format.
+
+    :param duration_buckets: Bucket upper bounds for durations in seconds
+    :param size_buckets: Bucket upper bounds for payload sizes in bytes
+    """
+
+    def __init__(
+            self, duration_buckets=DURATION_BUCKETS, size_buckets=SIZE_BUCKETS):
+        self.duration_buckets = duration_buckets
+        self.size_buckets = size_buckets
+
+        self._lock = threading.Lock()
+
+        # Keyed on (method, phase), where phase is "total", "serialize",
+        # "transport" or "deserialize"
+        self.durations = {}
+
+        # Keyed on (method, direction), where direction is "request" or
+        # "response"
+        self.sizes = {}
+
+        # Keyed on (method, status)
+        self.calls = {}
+
+    def after_call(self, info):
+        self._record(info)
+
+    def call_failed(self, info, error):
+        self._record(info)
+
+    def _observe(self, histograms, key, buckets, value):
+        if value is None:
+            return
+
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def _record(self, info):
+        phases = (
+            ("total", info.duration),
+            ("serialize", info.serialize_time),
+            ("transport", info.transport_time),
+            ("deserialize", info.deserialize_time),
+        )
+        with self._lock:
+            key = (info.method, info.status)
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+            for phase, value in phases:
+                self._observe(
+                    self.durations,
+                    (info.method, phase),
+                    self.duration_buckets,
+                    value)
+
+            self._observe(
+                self.sizes,
+                (info.method, "request"),
+                self.size_buckets,
+                info.request_bytes)
+            self._observe(
+                self.sizes,
+                (info.method, "response"),
+                self.size_buckets,
+                info.response_bytes)
+
+    def to_prometheus(self, prefix="loopia"):
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+
+        lines = []
+        with self._lock:
+            name = prefix + "_calls_total"
+            lines.append("# HELP {} Number of API requests".format(name))
+            lines.append("# TYPE {} counter".format(name))
+            for (method, status), count in sorted(self.calls.items()):
+                lines.append("{}{{{}}} {}".format(
+                    name, _labels(method=method, status=status), count))
+
+            histograms = (
+                (
+                    prefix + "_call_duration_seconds",
+                    "Duration of API requests by phase",
+                    "phase",
+                    self.durations,
+                ),
+                (
+                    prefix + "_call_payload_bytes",
+                    "Size of API request and response bodies",
+                    "direction",
+                    self.sizes,
+                ),
+            )
+            for name, help, label, values in histograms:
+                lines.append("# HELP {} {}".format(name, help))
+                lines.append("# TYPE {} histogram".format(name))
+                for (method, value), histogram in sorted(values.items()):
+                    labels = {"method": method, label: value}
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append("{}_bucket{{{}}} {}".format(
+                            name,
+                            _labels(le=_format_bound(bound), **labels),
+                            count))
+                    lines.append("{}_sum{{{}}} {}".format(
+                        name, _labels(**labels), histogram.sum))
+                    lines.append("{}_count{{{}}} {}".format(
+                        name, _labels(**labels), histogram.count))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+
+__all__ = [
+    "RateLimiter",
+]
+
+
+class RateLimiter(object):
+    """
+    Token bucket that limits the rate of API calls.
+
+    The limiter may be shared between threads and ``asyncio`` tasks, even at
+    the same time. Every caller reserves a token up front and then waits until
+    its reservation is due, which means callers are spread out over time
+    instead of waking up all at once.
+
+    When the API responds with ``RATE_LIMITED`` the rate is cut by
+    ``backoff``. Every successful call after that increases it by ``recovery``
+    tokens per second until the configured rate is reached again.
+
+    :param rate: Number of calls per second
+    :param burst: Maximum number of tokens that may accumulate, defaults to
+                  ``rate``
+    :param backoff: Factor to multiply the rate with when rate limited
+    :param min_rate: Lowest rate that backoff may lead to
+    :param recovery: Number of calls per second to add to the rate after every
+                     successful call, defaults to 5 % of ``rate``
+    :param clock: Monotonic clock function, mainly useful for testing
+    :param sleep: Sleep function to use with ``clock``
+    """
+
+    def __init__(
+            self, rate, burst=None, backoff=0.5, min_rate=None, recovery=None,
+            clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("'rate' must be greater than 0")
+
+        if burst is None:
+            burst = rate
+        if min_rate is None:
+            min_rate = rate / 100.0
+        if recovery is None:
+            recovery = rate / 20.0
+
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.backoff = backoff
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self._clock = clock
+        self._sleep = sleep
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+
+        self.waited = 0.0
+        self.rate_limited_count = 0
+
+    def _reserve(self):
+        """
+        Take a token and return the number of seconds to wait until it may be
+        used.
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # The token count may go negative. That represents callers that
+            # are already waiting for a token
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+
+            delay = -self._tokens / self.rate
+            self.waited += delay
+            return delay
+
+    def acquire(self):
+        """
+        Block until a call may be made.
+        """
+
+        delay = self._reserve()
+        if delay:
+            self._sleep(delay)
+
+    async def acquire_async(self):
+        """
+        Wait until a call may be made without blocking the event loop.
+        """
+
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def rate_limited(self):
+        """
+        Slow down after the API responded with ``RATE_LIMITED``.
+        """
+
+        with self._lock:
+            self.rate_limited_count += 1
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+
+            # Throw away saved up tokens since the server evidently disagrees
+            # with them
+            self._tokens = min(self._tokens, 0.0)
+
+    def succeeded(self):
+        """
+        Speed up again after a successful call.
+        """
+
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.recovery)
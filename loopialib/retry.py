@@ -0,0 +1,176 @@
+import asyncio
+import random
+import threading
+import time
+
+from ._compat import ProtocolError, http_client
+from .exceptions import LoopiaError, RateLimitedError
+
+
+__all__ = [
+    "RetryPolicy",
+]
+
+
+#: Methods that have the same effect no matter how many times they are called
+_idempotent_methods = frozenset([
+    "getDomain",
+    "getDomains",
+    "getSubdomains",
+    "getZoneRecords",
+    "removeSubdomain",
+    "removeZoneRecord",
+    "updateZoneRecord",
+])
+
+
+class RetryPolicy(object):
+    """
+    Decides when failed calls are tried again and how long to wait in between.
+
+    API errors are only retried when they are instances of ``retry_on``. Since
+    the API refused those requests they are safe to retry for any method.
+    Transport errors are different, since the request may have reached the
+    server before the connection failed. They are only retried for methods in
+    ``idempotent_methods``, unless the connection was refused.
+
+    The delay before retry ``n`` is ``base_delay * multiplier ** (n - 1)``
+    capped at ``max_delay``, of which up to ``jitter`` (a fraction between 0
+    and 1) is randomly removed to avoid synchronized retries.
+
+    :param max_attempts: Maximum number of attempts, including the first one
+    :param retry_on: Tuple of ``LoopiaError`` subclasses to retry
+    :param transport_errors: Tuple of exceptions considered transport errors
+    :param idempotent_methods: Names of API methods that are safe to repeat
+    :param base_delay: Delay in seconds before the first retry
+    :param multiplier: Factor the delay grows with for every retry
+    :param max_delay: Maximum delay in seconds between two attempts
+    :param jitter: Fraction of the delay that is randomized
+    :param deadline: Maximum number of seconds to spend on a call including
+                     waiting, or ``None`` for no limit
+    :param clock: Monotonic clock function, mainly useful for testing
+    :param sleep: Sleep function to use with ``clock``
+    :param random: Function returning a random float in ``[0, 1)``
+    """
+
+    def __init__(
+            self, max_attempts=3, retry_on=(RateLimitedError,),
+            transport_errors=(
+                OSError, EOFError, ProtocolError, http_client.HTTPException),
+            idempotent_methods=_idempotent_methods, base_delay=0.5,
+            multiplier=2.0, max_delay=30.0, jitter=1.0, deadline=None,
+            clock=time.monotonic, sleep=time.sleep, random=random.random):
+        if max_attempts < 1:
+            raise ValueError("'max_attempts' must not be less than 1")
+
+        self.max_attempts = max_attempts
+        self.retry_on = tuple(retry_on)
+        self.transport_errors = tuple(transport_errors)
+        self.idempotent_methods = frozenset(idempotent_methods)
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random
+
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.backoff_time = 0.0
+
+    def is_retryable(self, method, error):
+        """
+        Return ``True`` if the given error may be retried for the given API
+        method.
+        """
+
+        if isinstance(error, LoopiaError):
+            return isinstance(error, self.retry_on)
+
+        if not isinstance(error, self.transport_errors):
+            return False
+
+        # Nothing was sent if the connection was refused
+        if isinstance(error, ConnectionRefusedError):
+            return True
+
+        return method in self.idempotent_methods
+
+    def delay(self, attempt):
+        """
+        Return the number of seconds to wait after the given attempt, which
+        starts at 1.
+        """
+
+        delay = min(
+            self.max_delay,
+            self.base_delay * self.multiplier ** (attempt - 1))
+        return delay * (1.0 - self.jitter * self._random())
+
+    def _next_delay(self, method, error, attempt, start):
+        """
+        Return the delay before the next attempt or ``None`` to give up.
+        """
+
+        if attempt >= self.max_attempts or not self.is_retryable(method, error):
+            return None
+
+        delay = self.delay(attempt)
+        if self.deadline is not None:
+            if self._clock() + delay - start > self.deadline:
+                return None
+
+        with self._lock:
+            self.retries += 1
+            self.backoff_time += delay
+        return delay
+
+    def _count_attempt(self, first):
+        with self._lock:
+            if first:
+                self.calls += 1
+            self.attempts += 1
+
+    def _count_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def call(self, method, func, *args):
+        """
+        Call ``func(*args)`` on behalf of the given API method until it
+        succeeds or the policy gives up.
+        """
+
+        start = self._clock()
+        for attempt in range(1, self.max_attempts + 1):
+            self._count_attempt(attempt == 1)
+            try:
+                return func(*args)
+            except Exception as e:
+                delay = self._next_delay(method, e, attempt, start)
+                if delay is None:
+                    self._count_failure()
+                    raise
+            self._sleep(delay)
+
+    async def call_async(self, method, func, *args):
+        """
+        Coroutine version of ``call`` where ``func`` is a coroutine function.
+        """
+
+        start = self._clock()
+        for attempt in range(1, self.max_attempts + 1):
+            self._count_attempt(attempt == 1)
+            try:
+                return await func(*args)
+            except Exception as e:
+                delay = self._next_delay(method, e, attempt, start)
+                if delay is None:
+                    self._count_failure()
+                    raise
+            await asyncio.sleep(delay)
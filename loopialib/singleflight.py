@@ -0,0 +1,133 @@
+import threading
+
+
+__all__ = [
+    "AsyncSingleFlight",
+    "SingleFlight",
+]
+
+
+#: Methods that only read state and may therefore share a response
+_read_methods = frozenset([
+    "getDomain",
+    "getDomains",
+    "getSubdomains",
+    "getZoneRecords",
+])
+
+
+class _Flight(object):
+    __slots__ = ("done", "response", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Deduplicate identical read calls that are in flight at the same time.
+
+    The first caller makes the call while callers that arrive before it has
+    completed wait for it and get the same response, or the same exception.
+    Calls that arrive afterwards make a new call, which means that responses
+    are never reused the way ``ResponseCache`` does.
+
+    Shared responses must not be modified by the callers.
+
+    :param methods: Names of the methods to deduplicate
+    """
+
+    def __init__(self, methods=_read_methods):
+        self.methods = frozenset(methods)
+
+        self._lock = threading.Lock()
+        self._flights = {}
+
+        self.calls = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    def call(self, method, args, func):
+        """
+        Return the response of ``func(method, *args)``, sharing it with any
+        identical calls made at the same time.
+        """
+
+        if method not in self.methods:
+            return func(method, *args)
+
+        key = (method,) + tuple(args)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+
+        try:
+            flight.response = func(method, *args)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.response
+
+
+class AsyncSingleFlight(object):
+    """
+    Coroutine based counterpart of ``SingleFlight``. The call is made in a
+    task of its own, so cancelling one of the callers doesn't cancel the call
+    for the others.
+
+    :param methods: Names of the methods to deduplicate
+    """
+
+    def __init__(self, methods=_read_methods):
+        self.methods = frozenset(methods)
+        self._flights = {}
+
+        self.calls = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def call(self, method, args, func):
+        """
+        Return the response of ``await func(method, *args)``, sharing it with
+        any identical calls made at the same time.
+        """
+
+        # Imported here since asyncio is slow to import and only needed once
+        # there is an event loop running anyway
+        import asyncio
+
+        if method not in self.methods:
+            return await func(method, *args)
+
+        key = (method,) + tuple(args)
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(method, *args))
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
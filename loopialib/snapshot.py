@@ -0,0 +1,558 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from collections import deque, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .types import DnsRecord
+
+
+__all__ = [
+    "RecordChange",
+    "SnapshotFile",
+    "SnapshotFileWriter",
+    "SnapshotIndex",
+    "ZoneSnapshot",
+    "crawl",
+    "diff_records",
+    "diff_snapshots",
+    "load_snapshot",
+    "read_snapshot",
+    "save_snapshot",
+    "write_snapshot_file",
+    "zone_digest",
+]
+
+
+#: Records of a single sub domain
+ZoneSnapshot = namedtuple("ZoneSnapshot", ["domain", "subdomain", "records"])
+
+#: A record that was ``"added"``, ``"removed"`` or ``"modified"`` between two
+#: snapshots. ``old`` is ``None`` for added records and ``new`` is ``None`` for
+#: removed records
+RecordChange = namedtuple(
+    "RecordChange", ["action", "domain", "subdomain", "old", "new"])
+
+
+def crawl(
+        loopia, workers=8, skip_domains=(), skip_zones=(),
+        on_domain_done=None):
+    """
+    Yield a ``ZoneSnapshot`` for every sub domain of every domain of the
+    account, in no particular order.
+
+    At most ``workers`` calls are made at the same time. Zones of domains that
+    were started first are fetched first, which means domains are completed
+    one after another rather than all at the end.
+
+    :param loopia: ``Loopia`` client to crawl with
+    :param workers: Number of worker threads
+    :param skip_domains: Domain names to leave out
+    :param skip_zones: ``(domain, subdomain)`` tuples to leave out
+    :param on_domain_done: Function called with the domain name when all zones
+                           of a domain have been yielded
+    """
+
+    skip_domains = frozenset(skip_domains)
+    skip_zones = frozenset(skip_zones)
+
+    queue = deque(
+        (domain.domain, None)
+        for domain in loopia.get_domains()
+        if domain.domain not in skip_domains)
+    remaining = {}
+    pending = {}
+
+    def domain_done(domain):
+        del remaining[domain]
+        if on_domain_done is not None:
+            on_domain_done(domain)
+
+    with ThreadPoolExecutor(workers) as executor:
+        while queue or pending:
+            # Keep a bounded number of calls queued in the executor
+            while queue and len(pending) < workers * 2:
+                domain, subdomain = item = queue.popleft()
+                if subdomain is None:
+                    future = executor.submit(loopia.get_subdomains, domain)
+                else:
+                    future = executor.submit(
+                        loopia.get_zone_records, domain, subdomain)
+                pending[future] = item
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                domain, subdomain = pending.pop(future)
+                if subdomain is None:
+                    subdomains = [
+                        subdomain
+                        for subdomain in future.result()
+                        if (domain, subdomain) not in skip_zones
+                    ]
+                    remaining[domain] = len(subdomains)
+                    if not subdomains:
+                        domain_done(domain)
+                    queue.extendleft(
+                        (domain, subdomain)
+                        for subdomain in reversed(subdomains))
+                    continue
+
+                yield ZoneSnapshot(domain, subdomain, future.result())
+
+                remaining[domain] -= 1
+                if not remaining[domain]:
+                    domain_done(domain)
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True) + "\n"
+
+
+def read_snapshot(fp):
+    """
+    Yield every ``ZoneSnapshot`` in the given JSON Lines snapshot file.
+
+    :param fp: File object opened in text mode
+    """
+
+    for line in fp:
+        obj = json.loads(line)
+        if "records" in obj:
+            yield ZoneSnapshot(
+                obj["domain"],
+                obj["subdomain"],
+                [DnsRecord.from_dict(record) for record in obj["records"]])
+
+
+def _load_checkpoint(path):
+    """
+    Return the completed domains and zones of a partially written snapshot and
+    truncate the file after the last complete line.
+    """
+
+    domains = set()
+    zones = set()
+    with open(path, "rb+") as fp:
+        offset = 0
+        for line in fp:
+            try:
+                obj = json.loads(line.decode("utf-8"))
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+
+            offset += len(line)
+            if obj.get("complete"):
+                domains.add(obj["domain"])
+            else:
+                zones.add((obj["domain"], obj["subdomain"]))
+        fp.truncate(offset)
+    return domains, zones
+
+
+def save_snapshot(loopia, path, workers=8, resume=True):
+    """
+    Crawl the account and write every zone as a line of JSON to the given file.
+
+    Every line is flushed as soon as it has been written, which means that the
+    file also serves as a checkpoint. If ``resume`` is set and the file exists
+    the crawl continues where it was interrupted.
+
+    Zones are written as ``{"domain": ..., "subdomain": ..., "records": [...]}``
+    where every record is in the same format as ``DnsRecord.to_dict``. When all
+    zones of a domain have been written a ``{"domain": ..., "complete": true}``
+    line follows.
+
+    :param loopia: ``Loopia`` client to crawl with
+    :param path: Path of the snapshot file
+    :param workers: Number of worker threads
+    :param resume: Continue an existing snapshot instead of starting over
+    :return: Number of zones written
+    """
+
+    skip_domains = skip_zones = ()
+    if resume and os.path.exists(path):
+        skip_domains, skip_zones = _load_checkpoint(path)
+        mode = "a"
+    else:
+        mode = "w"
+
+    count = 0
+    with open(path, mode, encoding="utf-8") as fp:
+        def on_domain_done(domain):
+            fp.write(_dumps({"domain": domain, "complete": True}))
+            fp.flush()
+
+        zones = crawl(
+            loopia,
+            workers=workers,
+            skip_domains=skip_domains,
+            skip_zones=skip_zones,
+            on_domain_done=on_domain_done)
+        for zone in zones:
+            fp.write(_dumps({
+                "domain": zone.domain,
+                "subdomain": zone.subdomain,
+                "records": [record.to_dict() for record in zone.records],
+            }))
+            fp.flush()
+            count += 1
+    return count
+
+
+def load_snapshot(fp):
+    """
+    Return a ``dict`` of ``(domain, subdomain)`` tuples and their records from
+    the given JSON Lines snapshot file.
+
+    :param fp: File object opened in text mode
+    """
+
+    return {
+        (zone.domain, zone.subdomain): zone.records
+        for zone in read_snapshot(fp)
+    }
+
+
+def zone_digest(records):
+    """
+    Return a digest of the given records that doesn't depend on their order.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    for record in sorted(records):
+        digest.update(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class SnapshotIndex(object):
+    """
+    Digest of every zone in a snapshot.
+
+    Comparing two indexes tells which zones changed without looking at any
+    records, which means only changed zones have to be loaded and compared.
+
+    An index made with ``derive`` keeps track of the zones that are added or
+    discarded through it, so comparing it with the index it was derived from
+    only looks at those zones. Other indexes are compared zone by zone, which
+    takes time in proportion to the number of zones but still never looks at
+    any records.
+    """
+
+    def __init__(self, digests=None):
+        self.digests = dict(digests or {})
+
+        # Number of changes made through ``add`` and ``discard``, and for
+        # derived indexes the base index, its version when it was derived
+        # and the zones changed since
+        self._version = 0
+        self._base = None
+        self._base_version = None
+        self._touched = set()
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __contains__(self, key):
+        return key in self.digests
+
+    @classmethod
+    def from_zones(cls, zones):
+        """
+        Build an index from an iterable of ``ZoneSnapshot``.
+        """
+
+        index = cls()
+        for zone in zones:
+            index.add(zone)
+        return index
+
+    def derive(self):
+        """
+        Return a copy of the index that remembers which zones are changed
+        with ``add`` and ``discard``, for comparing it with this one.
+        """
+
+        index = type(self)(self.digests)
+        index._base = self
+        index._base_version = self._version
+        return index
+
+    def add(self, zone):
+        digest = zone_digest(zone.records)
+        key = (zone.domain, zone.subdomain)
+        self.digests[key] = digest
+        self._touched.add(key)
+        self._version += 1
+        return digest
+
+    def discard(self, domain, subdomain):
+        """
+        Remove a zone from the index if it is there.
+        """
+
+        key = (domain, subdomain)
+        if self.digests.pop(key, None) is not None:
+            self._touched.add(key)
+            self._version += 1
+
+    def _changed_keys(self, other):
+        """
+        Return the keys that may differ between the two indexes.
+        """
+
+        for derived, base in ((other, self), (self, other)):
+            if (derived._base is base and
+                    derived._base_version == base._version):
+                return derived._touched
+        return self.digests.keys() | other.digests.keys()
+
+    def changed(self, other):
+        """
+        Return a sorted ``list`` of ``(domain, subdomain)`` tuples for zones
+        that are different in the other index, including zones that only
+        exist in one of them.
+        """
+
+        a = self.digests
+        b = other.digests
+        return sorted(
+            key
+            for key in self._changed_keys(other)
+            if a.get(key) != b.get(key))
+
+    def save(self, fp):
+        """
+        Write the index to the given text file as JSON.
+        """
+
+        json.dump(
+            [[domain, subdomain, digest]
+             for (domain, subdomain), digest in sorted(self.digests.items())],
+            fp,
+            separators=(",", ":"))
+
+    @classmethod
+    def load(cls, fp):
+        return cls(
+            ((domain, subdomain), digest)
+            for domain, subdomain, digest in json.load(fp))
+
+
+#: Magic bytes, offset and length of the index at the start of snapshot files
+_header = struct.Struct("<8sQQ")
+_magic = b"LPSNAP\x00\x01"
+
+
+class SnapshotFileWriter(object):
+    """
+    Write zones to a snapshot file that ``SnapshotFile`` can read single
+    zones from without reading the rest of the file.
+
+    Zones are written as they come, each as a JSON array of ``[type, ttl,
+    priority, data, id]`` arrays. Closing the writer appends an index of the
+    offset, length and digest of every zone and fills in the header at the
+    start of the file, which points at the index. Files that were never
+    closed have no index and can't be read.
+
+    :param fp: File object opened in binary mode, which must be seekable
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._zones = []
+        self._keys = set()
+        self._offset = _header.size
+
+        fp.write(_header.pack(_magic, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def __len__(self):
+        return len(self._zones)
+
+    def write(self, zone):
+        """
+        Write a ``ZoneSnapshot``, or any ``(domain, subdomain, records)``
+        tuple.
+        """
+
+        domain, subdomain, records = zone
+        records = list(records)
+        key = (domain, subdomain)
+        if key in self._keys:
+            raise ValueError("Zone {} is already in the snapshot".format(key))
+        self._keys.add(key)
+
+        block = json.dumps(
+            [list(record) for record in records],
+            separators=(",", ":")).encode("utf-8")
+        self.fp.write(block)
+        self._zones.append([
+            domain, subdomain, self._offset, len(block),
+            zone_digest(records)])
+        self._offset += len(block)
+
+    def close(self):
+        """
+        Write the index and the header. The file object is left open.
+        """
+
+        index = json.dumps(
+            self._zones, separators=(",", ":")).encode("utf-8")
+        self.fp.write(index)
+        self.fp.seek(0)
+        self.fp.write(_header.pack(_magic, self._offset, len(index)))
+        self.fp.seek(0, os.SEEK_END)
+        self.fp.flush()
+
+
+def write_snapshot_file(path, zones):
+    """
+    Write an iterable of ``ZoneSnapshot``, such as ``Loopia.snapshot`` or
+    ``read_snapshot``, to a snapshot file in a single pass.
+
+    :param path: Path of the snapshot file
+    :return: Number of zones written
+    """
+
+    with open(path, "wb") as fp:
+        with SnapshotFileWriter(fp) as writer:
+            for zone in zones:
+                writer.write(zone)
+    return len(writer)
+
+
+class SnapshotFile(Mapping):
+    """
+    Read only mapping of ``(domain, subdomain)`` tuples to the records of a
+    snapshot file written by ``SnapshotFileWriter``.
+
+    The file is memory mapped and only its index is read when it is opened,
+    so looking up a zone only reads and parses the records of that zone.
+    Since it is a lazy mapping it can be given to ``diff_snapshots``
+    together with the ``SnapshotIndex`` returned by ``index``.
+
+    :param path: Path of the snapshot file
+    :raises ValueError: If the file is not a complete snapshot file
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self._map) < _header.size:
+                raise ValueError("Not a snapshot file")
+            magic, offset, length = _header.unpack_from(self._map)
+            if magic != _magic:
+                raise ValueError("Not a snapshot file")
+            if not offset or offset + length > len(self._map):
+                raise ValueError("Snapshot file is incomplete")
+
+            self._zones = {
+                (domain, subdomain): (offset, length, digest)
+                for domain, subdomain, offset, length, digest in json.loads(
+                    self._map[offset:offset + length].decode("utf-8"))
+            }
+        except Exception:
+            self._map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return len(self._zones)
+
+    def __iter__(self):
+        return iter(self._zones)
+
+    def __contains__(self, key):
+        return key in self._zones
+
+    def __getitem__(self, key):
+        offset, length, _ = self._zones[key]
+
+        # Files may come from anywhere, so records are validated like those
+        # of read_snapshot
+        return [
+            DnsRecord(*record)
+            for record in json.loads(
+                self._map[offset:offset + length].decode("utf-8"))
+        ]
+
+    def index(self):
+        """
+        Return a ``SnapshotIndex`` of the digests stored in the file, without
+        reading any records.
+        """
+
+        return SnapshotIndex(
+            (key, digest) for key, (_, _, digest) in self._zones.items())
+
+    def zones(self):
+        """
+        Yield a ``ZoneSnapshot`` for every zone in the order they were
+        written.
+        """
+
+        for domain, subdomain in self._zones:
+            yield ZoneSnapshot(domain, subdomain, self[(domain, subdomain)])
+
+
+def diff_records(domain, subdomain, old, new):
+    """
+    Yield a ``RecordChange`` for every difference between two versions of the
+    records of a zone. Records are matched on ID.
+    """
+
+    old_by_id = {record.id: record for record in old}
+    for record in new:
+        previous = old_by_id.pop(record.id, None)
+        if previous is None:
+            yield RecordChange("added", domain, subdomain, None, record)
+        elif previous != record:
+            yield RecordChange("modified", domain, subdomain, previous, record)
+
+    for record in old_by_id.values():
+        yield RecordChange("removed", domain, subdomain, record, None)
+
+
+def diff_snapshots(old_index, new_index, old_zones, new_zones):
+    """
+    Yield a ``RecordChange`` for every difference between two snapshots.
+
+    Only zones with differing digests are looked up in ``old_zones`` and
+    ``new_zones``, which may therefore be lazy mappings.
+
+    :param old_index: ``SnapshotIndex`` of the old snapshot
+    :param new_index: ``SnapshotIndex`` of the new snapshot
+    :param old_zones: Mapping of ``(domain, subdomain)`` to records of the old
+                      snapshot
+    :param new_zones: Mapping of ``(domain, subdomain)`` to records of the new
+                      snapshot
+    """
+
+    for key in old_index.changed(new_index):
+        old = old_zones[key] if key in old_index else ()
+        new = new_zones[key] if key in new_index else ()
+        for change in diff_records(key[0], key[1], old, new):
+            yield change
@@ -0,0 +1,144 @@
+from base64 import b64decode
+from xml.parsers import expat
+
+from ._compat import Fault
+
+
+__all__ = [
+    "StreamParser",
+]
+
+
+def _to_bool(text):
+    return text.strip() == "1"
+
+
+#: Conversions of XML-RPC scalar types
+_scalars = {
+    "string": lambda text: text,
+    "int": int,
+    "i4": int,
+    "i8": int,
+    "boolean": _to_bool,
+    "double": float,
+    "dateTime.iso8601": lambda text: text.strip(),
+    "base64": lambda text: b64decode(text.encode("ascii")),
+    "nil": lambda text: None,
+}
+
+
+class StreamParser(object):
+    """
+    Incremental parser for XML-RPC responses that hands out the items of a
+    top level array as soon as they have been parsed.
+
+    Feed it the response a chunk at a time and it returns the items completed
+    by every chunk, which means that only one item at a time needs to be kept
+    in memory no matter how large the response is. Structs become ``dict``
+    and are passed through ``factory``. A response that is not an array
+    results in a single item. Faults are raised as ``Fault`` when the parser is
+    closed.
+
+    :param factory: Function to create objects from structs
+    """
+
+    def __init__(self, factory=None):
+        self._factory = factory
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._data
+
+        self._text = []
+        self._typed = False
+        self._fault = None
+
+        # Stack of open arrays and structs. Structs keep track of the name of
+        # the member being parsed
+        self._containers = []
+        self._names = []
+
+        # The response array is not kept in memory. Instead its items end up
+        # in the output list
+        self._streaming = False
+        self._items = []
+
+    def feed(self, data):
+        """
+        Parse the given chunk of the response and return a ``list`` of the
+        items it completed.
+        """
+
+        self._parser.Parse(data, False)
+        items, self._items = self._items, []
+        return items
+
+    def close(self):
+        """
+        Finish parsing and return a ``list`` of the remaining items.
+        """
+
+        self._parser.Parse(b"", True)
+        if self._fault is not None:
+            raise Fault(self._fault["faultCode"], self._fault["faultString"])
+        return self._items
+
+    def _start(self, tag, attrs):
+        self._text = []
+        if tag == "value":
+            self._typed = False
+        elif tag in _scalars:
+            self._typed = True
+        elif tag == "array":
+            self._typed = True
+            if self._containers or self._streaming:
+                self._containers.append([])
+            else:
+                self._streaming = True
+        elif tag == "struct":
+            self._typed = True
+            self._containers.append({})
+            self._names.append(None)
+        elif tag == "fault":
+            self._fault = {}
+
+    def _data(self, text):
+        self._text.append(text)
+
+    def _end(self, tag):
+        if tag in _scalars:
+            self._add(_scalars[tag]("".join(self._text)))
+        elif tag == "value":
+            # Values without a type are strings
+            if not self._typed:
+                self._add("".join(self._text))
+            self._typed = True
+        elif tag == "name":
+            self._names[-1] = "".join(self._text)
+        elif tag == "struct":
+            self._names.pop()
+            struct = self._containers.pop()
+            is_item = not self._containers and self._fault is None
+            if is_item and self._factory is not None:
+                struct = self._factory(struct)
+            self._add(struct)
+        elif tag == "array":
+            if self._containers:
+                self._add(self._containers.pop())
+            else:
+                self._streaming = False
+
+    def _add(self, value):
+        if not self._containers:
+            if self._fault is not None:
+                self._fault = value
+            else:
+                self._items.append(value)
+            return
+
+        container = self._containers[-1]
+        if isinstance(container, dict):
+            container[self._names[-1]] = value
+        else:
+            container.append(value)
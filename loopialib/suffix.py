@@ -0,0 +1,195 @@
+"""
+Public suffix lookup using a trie compiled from the bundled snapshot of the
+`Public Suffix List <https://publicsuffix.org/>`_.
+
+To update the snapshot, download the list and run::
+
+    python -m loopialib.suffix public_suffix_list.dat
+"""
+
+import os
+import sys
+
+
+__all__ = [
+    "SuffixTrie",
+    "compile_rules",
+]
+
+
+#: Trie node keys for rules ending at the node and exception rules. They are
+#: not strings so they can never be mistaken for labels
+_END = 0
+_EXCEPTION = 1
+_WILDCARD = "*"
+
+
+def _to_ascii(label):
+    """
+    Return the IDNA ASCII form of the given lower case label
+    """
+
+    if label.isascii():
+        return label
+    return "xn--" + label.encode("punycode").decode("ascii")
+
+
+class SuffixTrie(object):
+    """
+    Trie of public suffix rules with support for wildcard and exception rules.
+
+    Rules are given in Public Suffix List syntax, for example ``co.uk``,
+    ``*.ck`` or ``!www.ck``. Internationalized rules and names may be given in
+    either Unicode or ASCII form.
+
+    :param rules: Iterable of rules
+    """
+
+    def __init__(self, rules=()):
+        self._root = {}
+        for rule in rules:
+            self.add(rule)
+
+    @classmethod
+    def default(cls, private=True):
+        """
+        Return a trie of the bundled Public Suffix List.
+
+        :param private: Include suffixes from the private section, such as
+                        ``uk.com``, in addition to the ICANN section
+        """
+
+        from ._suffix_data import ICANN, PRIVATE
+
+        trie = cls()
+        trie._add_compiled(ICANN)
+        if private:
+            trie._add_compiled(PRIVATE)
+        return trie
+
+    def _add_compiled(self, rules):
+        """
+        Add whitespace separated rules that are known to be in lower case
+        ASCII form, which is a lot faster than ``add``.
+        """
+
+        root = self._root
+        for rule in rules.split():
+            marker = _END
+            if rule[0] == "!":
+                marker, rule = _EXCEPTION, rule[1:]
+
+            node = root
+            for label in reversed(rule.split(".")):
+                child = node.get(label)
+                if child is None:
+                    child = node[label] = {}
+                node = child
+            node[marker] = True
+
+    def add(self, rule):
+        exception = rule.startswith("!")
+        if exception:
+            rule = rule[1:]
+
+        node = self._root
+        for label in reversed(rule.lower().split(".")):
+            node = node.setdefault(_to_ascii(label), {})
+        node[_EXCEPTION if exception else _END] = True
+
+    def suffix_length(self, labels):
+        """
+        Return the number of trailing labels that make up the public suffix of
+        the given ``list`` of labels. Names that don't match any rule are
+        considered to have a suffix of one label.
+        """
+
+        node = self._root
+        length = 1
+        depth = 0
+        for label in reversed(labels):
+            depth += 1
+            child = node.get(label)
+
+            # Most names are already in lower case ASCII form, so only
+            # normalize labels that don't match as they are
+            if child is None:
+                normalized = _to_ascii(label.lower())
+                if normalized != label:
+                    child = node.get(normalized)
+
+            if child is not None:
+                # Exception rules make the parent the public suffix, no
+                # matter what other rules match
+                if _EXCEPTION in child:
+                    return depth - 1
+                if _END in child or _WILDCARD in node:
+                    length = depth
+                node = child
+            else:
+                if _WILDCARD in node:
+                    length = depth
+                break
+        return length
+
+
+def compile_rules(text):
+    """
+    Return a tuple of the ICANN and private rules in the given Public Suffix
+    List file contents, in ASCII form.
+    """
+
+    sections = {"ICANN": [], "PRIVATE": []}
+    section = sections["ICANN"]
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("// ===BEGIN "):
+            section = sections[line.split()[2]]
+            continue
+
+        if not line or line.startswith("//"):
+            continue
+
+        rule = line.split()[0].lower()
+        prefix = ""
+        if rule.startswith("!"):
+            prefix, rule = "!", rule[1:]
+        section.append(
+            prefix + ".".join(_to_ascii(label) for label in rule.split(".")))
+    return sections["ICANN"], sections["PRIVATE"]
+
+
+_module_template = '''\
+# This file is generated by ``python -m loopialib.suffix`` from the Public
+# Suffix List (https://publicsuffix.org/), which is subject to the Mozilla
+# Public License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+ICANN = """
+{icann}
+"""
+
+PRIVATE = """
+{private}
+"""
+'''
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("Usage: python -m loopialib.suffix <public_suffix_list.dat>")
+        return 1
+
+    with open(argv[1], encoding="utf-8") as fp:
+        icann, private = compile_rules(fp.read())
+
+    path = os.path.join(os.path.dirname(__file__), "_suffix_data.py")
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(_module_template.format(
+            icann="\n".join(icann),
+            private="\n".join(private)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,65 @@
+from collections import namedtuple
+
+
+__all__ = [
+    "ZonePlan",
+    "plan_zone",
+]
+
+
+#: Changes needed to make a sub domain match the desired records. ``add`` and
+#: ``update`` contain records as they should be sent, ``remove`` the records
+#: to remove
+ZonePlan = namedtuple("ZonePlan", ["add", "update", "remove"])
+
+
+def _record_key(record):
+    return (record.type, record.data, record.priority)
+
+
+def plan_zone(current, desired):
+    """
+    Return a ``ZonePlan`` with the fewest calls needed to turn the current
+    records into the desired ones.
+
+    Records are considered the same when their type, data and priority match.
+    IDs of desired records are ignored. A record that only differs in TTL is
+    updated. Left over records are updated in place to become records of the
+    same type that must be added, since that takes one call instead of two.
+
+    :param current: Records that currently exist, with IDs
+    :param desired: Records that should exist
+    :return: A ``ZonePlan``
+    """
+
+    existing = {}
+    for record in current:
+        existing.setdefault(_record_key(record), []).append(record)
+
+    missing = []
+    update = []
+    for record in desired:
+        matches = existing.get(_record_key(record))
+        if not matches:
+            missing.append(record)
+            continue
+
+        match = matches.pop()
+        if match.ttl != record.ttl:
+            update.append(record.replace(id=match.id))
+
+    spare = {}
+    for records in existing.values():
+        for record in records:
+            spare.setdefault(record.type, []).append(record)
+
+    add = []
+    for record in missing:
+        reusable = spare.get(record.type)
+        if reusable:
+            update.append(record.replace(id=reusable.pop().id))
+        else:
+            add.append(record.replace(id=0))
+
+    remove = [record for records in spare.values() for record in records]
+    return ZonePlan(add=add, update=update, remove=remove)
@@ -0,0 +1,253 @@
+from array import array
+from itertools import compress
+
+from .types import DnsRecord, _record_types
+
+
+__all__ = [
+    "RecordTable",
+]
+
+
+#: Record types by code, and codes by record type
+_type_names = tuple(sorted(_record_types))
+_type_codes = {name: code for code, name in enumerate(_type_names)}
+
+_tuple_new = tuple.__new__
+
+
+def _select(column, value):
+    """
+    Return a sequence of whether every row of a column equals the given
+    value, or is in it if it is a ``frozenset``.
+    """
+
+    values = value if isinstance(value, frozenset) else frozenset([value])
+    if column.typecode == "B":
+        # Byte columns can be translated in one go
+        table = bytes(int(i in values) for i in range(256))
+        return column.tobytes().translate(table)
+    if len(values) == 1:
+        value, = values
+        return [v == value for v in column]
+    return [v in values for v in column]
+
+
+class _Pool(object):
+    """
+    Values stored once and referred to by their position.
+    """
+
+    __slots__ = ("values", "positions")
+
+    def __init__(self):
+        self.values = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        position = self.positions.get(value)
+        if position is None:
+            position = self.positions[value] = len(self.values)
+            self.values.append(value)
+        return position
+
+
+class RecordTable(object):
+    """
+    Column oriented store of zone records for accounts with millions of
+    them, using a fraction of the memory of a ``list`` of ``DnsRecord``.
+
+    Every row takes one byte for the type, four bytes each for the TTL,
+    priority, ID, data and sub domain, plus the data and sub domains which
+    are only stored once no matter how many rows have them. Indexing and
+    iterating creates ``DnsRecord`` views on access, which are only kept
+    alive as long as the caller needs them.
+
+    Rows may belong to a ``(domain, subdomain)`` zone, which is ``(None,
+    None)`` for rows added without one. ``rows`` and ``filter`` find rows by
+    comparing the integer columns, without creating records.
+
+    :param records: Iterable of ``DnsRecord`` to add
+    """
+
+    def __init__(self, records=()):
+        self._types = array("B")
+        self._ttls = array("I")
+        self._priorities = array("I")
+        self._ids = array("I")
+        self._data = array("I")
+        self._zones = array("I")
+
+        # Pools are shared with the tables returned by ``filter``, which only
+        # ever adds values to them
+        self._data_pool = _Pool()
+        self._zone_pool = _Pool()
+
+        self.extend(records)
+
+    @classmethod
+    def from_snapshots(cls, zones):
+        """
+        Return a table of the records of ``(domain, subdomain, records)``
+        tuples such as ``ZoneSnapshot``.
+        """
+
+        table = cls()
+        for domain, subdomain, records in zones:
+            table.extend(records, domain, subdomain)
+        return table
+
+    def __len__(self):
+        return len(self._types)
+
+    def _record(self, i):
+        return _tuple_new(DnsRecord, (
+            _type_names[self._types[i]],
+            self._ttls[i],
+            self._priorities[i],
+            self._data_pool.values[self._data[i]],
+            self._ids[i],
+        ))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._record(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("RecordTable index out of range")
+        return self._record(i)
+
+    def __iter__(self):
+        types = _type_names
+        data = self._data_pool.values
+        for row in zip(
+                self._types, self._ttls, self._priorities, self._data,
+                self._ids):
+            yield _tuple_new(DnsRecord, (
+                types[row[0]], row[1], row[2], data[row[3]], row[4]))
+
+    def zone(self, i):
+        """
+        Return the ``(domain, subdomain)`` of the given row.
+        """
+
+        return self._zone_pool.values[self._zones[i]]
+
+    def zones(self):
+        """
+        Return an iterator of ``(domain, subdomain, record)`` for every row.
+        """
+
+        zones = self._zone_pool.values
+        for zone, record in zip(self._zones, self):
+            yield zones[zone] + (record,)
+
+    def append(self, record, domain=None, subdomain=None):
+        self.extend([record], domain, subdomain)
+
+    def extend(self, records, domain=None, subdomain=None):
+        """
+        Add records, all of which belong to the given zone.
+        """
+
+        zone = self._zone_pool.intern((domain, subdomain))
+        intern = self._data_pool.intern
+        start = len(self)
+        try:
+            for record in records:
+                type, ttl, priority, data, id = record
+                self._types.append(_type_codes[type])
+                self._ttls.append(ttl)
+                self._priorities.append(priority)
+                self._ids.append(id)
+                self._data.append(intern(data))
+                self._zones.append(zone)
+        except Exception:
+            # Don't leave a partially added row behind
+            self._truncate(start)
+            raise
+
+    def _truncate(self, length):
+        for column in self._columns():
+            del column[length:]
+
+    def _columns(self):
+        return [
+            self._types, self._ttls, self._priorities, self._ids,
+            self._data, self._zones,
+        ]
+
+    def to_list(self):
+        return list(self)
+
+    def rows(self, type=None, data=None, ttl=None, priority=None,
+             domain=None, subdomain=None):
+        """
+        Return a ``list`` of the numbers of the rows that match all of the
+        given values. The values are compared as integer codes, so no
+        ``DnsRecord`` is created for rows that don't match.
+
+        :param subdomain: Sub domain, which requires ``domain``
+        """
+
+        conditions = []
+        if type is not None:
+            conditions.append((self._types, _type_codes.get(type)))
+        if data is not None:
+            conditions.append(
+                (self._data, self._data_pool.positions.get(data)))
+        if ttl is not None:
+            conditions.append((self._ttls, ttl))
+        if priority is not None:
+            conditions.append((self._priorities, priority))
+
+        if subdomain is not None:
+            if domain is None:
+                raise ValueError("A sub domain must be given with its domain")
+            conditions.append((
+                self._zones,
+                self._zone_pool.positions.get((domain, subdomain))))
+        elif domain is not None:
+            zones = frozenset(
+                position
+                for (zone_domain, _), position in
+                self._zone_pool.positions.items()
+                if zone_domain == domain)
+            conditions.append((self._zones, zones))
+
+        # The first condition scans the whole column and the rest only check
+        # the rows that are left
+        rows = None
+        for column, value in conditions:
+            if value is None:
+                # Values that were never interned can't match any row
+                return []
+            if rows is None:
+                rows = list(compress(range(len(self)), _select(column, value)))
+            elif isinstance(value, frozenset):
+                rows = [i for i in rows if column[i] in value]
+            else:
+                rows = [i for i in rows if column[i] == value]
+
+        if rows is None:
+            return list(range(len(self)))
+        return rows
+
+    def filter(self, **criteria):
+        """
+        Return a new table of the rows that match all of the given values,
+        which are the same as for ``rows``. The new table shares the pools of
+        data and sub domains with this one.
+        """
+
+        rows = self.rows(**criteria)
+        table = RecordTable()
+        table._data_pool = self._data_pool
+        table._zone_pool = self._zone_pool
+        for source, target in zip(self._columns(), table._columns()):
+            target.extend([source[i] for i in rows])
+        return table
@@ -0,0 +1,372 @@
+"""
+Offline emulator of the Loopia API for tests and load testing.
+
+The emulator is a real XML-RPC server that keeps an account in memory, which
+means that clients exercise the whole transport stack. Latency, error
+statuses and dropped connections can be injected to see how clients cope.
+
+To run a standalone emulator with a single domain::
+
+    python -m loopialib.testing --port 8000 --domain example.com --latency 0.05
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+from collections import Counter, deque
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+
+__all__ = [
+    "LoopiaEmulator",
+]
+
+
+#: Methods that respond with an array, which means that errors are wrapped in
+#: an array as well
+_list_methods = frozenset(["getDomains", "getSubdomains", "getZoneRecords"])
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ("/RPCSERV",)
+
+    def do_POST(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        # Close the connection without responding at all
+        if server._should_drop():
+            self.close_connection = True
+            return
+
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+        # Close the connection without telling the client, like servers that
+        # silently drop idle connections
+        if not server.keep_alive:
+            self.close_connection = True
+
+
+class LoopiaEmulator(ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    In-memory Loopia API served over XML-RPC.
+
+    Supports ``getDomain``, ``getDomains``, ``getSubdomains``,
+    ``addSubdomain``, ``removeSubdomain``, ``addZoneRecord``, ``getZoneRecords``,
+    ``updateZoneRecord``, ``removeZoneRecord`` and ``system.multicall``. Calls
+    with the wrong credentials respond with ``AUTH_ERROR`` and calls for
+    unknown domains with ``UNKNOWN_ERROR``.
+
+    Use ``start`` and ``stop``, or the emulator as a context manager, to serve
+    from a background thread::
+
+        with LoopiaEmulator() as emulator:
+            emulator.add_domain("example.com", ["@", "www"])
+            loopia = Loopia("user", "password", base_url=emulator.url)
+
+    :param address: ``(host, port)`` to listen on. Port 0 picks a free port
+    :param user: Username that is accepted
+    :param password: Password that is accepted
+    :param latency: Number of seconds to wait before handling every request
+    :param rate_limit: Maximum number of calls per ``rate_limit_period``
+                       before calls respond with ``RATE_LIMITED``, or ``None``
+                       for no limit
+    :param rate_limit_period: Length of the rate limit window in seconds
+    :param error_rate: Probability that a call responds with ``error_status``
+    :param error_status: Status to respond with for random errors
+    :param drop_rate: Probability that a request is dropped without a response
+    :param multicall: Support ``system.multicall``
+    :param seed: Seed for random errors and dropped connections
+    :param clock: Monotonic clock function, mainly useful for testing
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+            self, address=("127.0.0.1", 0), user="user", password="password",
+            latency=0.0, rate_limit=None, rate_limit_period=60.0,
+            error_rate=0.0, error_status="UNKNOWN_ERROR", drop_rate=0.0,
+            multicall=True, seed=None, clock=time.monotonic):
+        SimpleXMLRPCServer.__init__(
+            self,
+            address,
+            requestHandler=_RequestHandler,
+            logRequests=False,
+            allow_none=True)
+
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_limit_period = rate_limit_period
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.keep_alive = True
+        self._clock = clock
+        self._random = random.Random(seed)
+
+        self.lock = threading.RLock()
+        self.domains = {}
+        self.next_id = 1
+        self._injected = deque()
+        self._drops = 0
+        self._recent_calls = deque()
+        self._thread = None
+
+        self.calls = Counter()
+        self.requests_dropped = 0
+
+        if multicall:
+            self.register_multicall_functions()
+        self.register_function(self.get_domain, "getDomain")
+        self.register_function(self.get_domains, "getDomains")
+        self.register_function(self.get_subdomains, "getSubdomains")
+        self.register_function(self.add_subdomain, "addSubdomain")
+        self.register_function(self.remove_subdomain, "removeSubdomain")
+        self.register_function(self.add_zone_record, "addZoneRecord")
+        self.register_function(self.get_zone_records, "getZoneRecords")
+        self.register_function(self.update_zone_record, "updateZoneRecord")
+        self.register_function(self.remove_zone_record, "removeZoneRecord")
+
+    @property
+    def url(self):
+        return "http://{}:{}/RPCSERV".format(*self.server_address[:2])
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Serve requests from a background thread.
+        """
+
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def add_domain(self, domain, subdomains=("@",)):
+        """
+        Add a domain with the given sub domains, which have no records.
+        """
+
+        with self.lock:
+            self.domains[domain] = {subdomain: [] for subdomain in subdomains}
+
+    def fail_next(self, status, count=1):
+        """
+        Respond to the next ``count`` calls with the given status, for example
+        ``"RATE_LIMITED"`` or ``"AUTH_ERROR"``.
+        """
+
+        with self.lock:
+            self._injected.extend([status] * count)
+
+    def drop_next(self, count=1):
+        """
+        Close the connection of the next ``count`` requests without responding.
+        """
+
+        with self.lock:
+            self._drops += count
+
+    def _should_drop(self):
+        with self.lock:
+            drop = self._drops > 0
+            if drop:
+                self._drops -= 1
+            elif self.drop_rate:
+                drop = self._random.random() < self.drop_rate
+
+            if drop:
+                self.requests_dropped += 1
+            return drop
+
+    def _status(self, params):
+        """
+        Return the error status to respond with, if any.
+        """
+
+        with self.lock:
+            if self._injected:
+                return self._injected.popleft()
+
+            if self.rate_limit is not None:
+                now = self._clock()
+                recent = self._recent_calls
+                while recent and now - recent[0] >= self.rate_limit_period:
+                    recent.popleft()
+                if len(recent) >= self.rate_limit:
+                    return "RATE_LIMITED"
+                recent.append(now)
+
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self.error_status
+
+        if tuple(params[:2]) != (self.user, self.password):
+            return "AUTH_ERROR"
+        return None
+
+    def _dispatch(self, method, params):
+        if method.startswith("system."):
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+
+        with self.lock:
+            self.calls[method] += 1
+
+        status = self._status(params)
+        if status is not None:
+            return [status] if method in _list_methods else status
+        return SimpleXMLRPCServer._dispatch(self, method, params[2:])
+
+    def _domain_info(self, domain):
+        return {
+            "domain": domain,
+            "paid": 1,
+            "registered": 1,
+            "renewal_status": "NORMAL",
+            "expiration_date": "2030-01-01",
+            "reference_no": 0,
+        }
+
+    def get_domain(self, domain):
+        if domain not in self.domains:
+            return "UNKNOWN_ERROR"
+        return self._domain_info(domain)
+
+    def get_domains(self):
+        with self.lock:
+            return [self._domain_info(domain) for domain in self.domains]
+
+    def get_subdomains(self, domain):
+        with self.lock:
+            if domain not in self.domains:
+                return ["UNKNOWN_ERROR"]
+            return list(self.domains[domain])
+
+    def add_subdomain(self, domain, subdomain):
+        with self.lock:
+            zones = self.domains.get(domain)
+            if zones is None:
+                return "UNKNOWN_ERROR"
+            zones.setdefault(subdomain, [])
+        return "OK"
+
+    def remove_subdomain(self, domain, subdomain):
+        with self.lock:
+            zones = self.domains.get(domain)
+            if zones is None:
+                return "UNKNOWN_ERROR"
+            if zones.pop(subdomain, None) is None:
+                return "BAD_INDATA"
+        return "OK"
+
+    def _records(self, domain, subdomain):
+        """
+        Return the records of the given sub domain, or an error status.
+        """
+
+        zones = self.domains.get(domain)
+        if zones is None:
+            return "UNKNOWN_ERROR"
+        if subdomain not in zones:
+            return "BAD_INDATA"
+        return zones[subdomain]
+
+    def add_zone_record(self, domain, subdomain, record):
+        with self.lock:
+            records = self._records(domain, subdomain)
+            if isinstance(records, str):
+                return records
+            records.append(dict(record, record_id=self.next_id))
+            self.next_id += 1
+        return "OK"
+
+    def get_zone_records(self, domain, subdomain):
+        with self.lock:
+            records = self._records(domain, subdomain)
+            if isinstance(records, str):
+                return [records]
+            return [dict(record) for record in records]
+
+    def update_zone_record(self, domain, subdomain, record):
+        with self.lock:
+            records = self._records(domain, subdomain)
+            if isinstance(records, str):
+                return records
+            for i, current in enumerate(records):
+                if current["record_id"] == record["record_id"]:
+                    records[i] = dict(record)
+                    return "OK"
+        return "BAD_INDATA"
+
+    def remove_zone_record(self, domain, subdomain, id):
+        with self.lock:
+            records = self._records(domain, subdomain)
+            if isinstance(records, str):
+                return records
+            for i, record in enumerate(records):
+                if record["record_id"] == id:
+                    del records[i]
+                    return "OK"
+        return "BAD_INDATA"
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m loopialib.testing",
+        description="Serve an in-memory emulator of the Loopia API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--user", default="user")
+    parser.add_argument("--password", default="password")
+    parser.add_argument(
+        "--domain", action="append", default=[],
+        help="domain to add to the account, may be given multiple times")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    args = parser.parse_args(argv[1:])
+
+    emulator = LoopiaEmulator(
+        (args.host, args.port),
+        user=args.user,
+        password=args.password,
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate)
+    for domain in args.domain:
+        emulator.add_domain(domain)
+
+    print("Serving Loopia API emulator on {}".format(emulator.url))
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,374 @@
+import gzip
+import select
+import selectors
+import threading
+import time
+
+from ._compat import Fault, ProtocolError, Transport, http_client
+
+
+__all__ = [
+    "PoolTimeoutError",
+    "PooledTransport",
+]
+
+
+#: Errors that indicate that a kept-alive connection was closed by the server
+#: while it was idle in the pool
+_RESET_ERRORS = (
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+class PoolTimeoutError(TimeoutError):
+    """
+    Raised when no connection became available within the wait timeout of a
+    ``PooledTransport``.
+    """
+
+
+def _is_healthy(connection):
+    """
+    Return whether an idle connection still looks usable. A socket that is
+    readable while idle has either been closed by the server or received
+    data it shouldn't have, and can't be used for another request.
+    """
+
+    sock = connection.sock
+    if sock is None:
+        return False
+
+    # select() can't watch descriptors above FD_SETSIZE, which processes with
+    # many open files easily have. Errors and hang ups are always reported
+    try:
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN | select.POLLPRI)
+            return not poller.poll(0)
+        with selectors.DefaultSelector() as selector:
+            selector.register(sock, selectors.EVENT_READ)
+            return not selector.select(0)
+    except (OSError, ValueError):
+        # The socket has been closed
+        return False
+
+
+def _read_body(response):
+    body = response.read()
+    if response.getheader("Content-Encoding", "") == "gzip":
+        body = gzip.decompress(body)
+    return body
+
+
+class PooledTransport(Transport):
+    """
+    XML-RPC transport that keeps HTTP connections alive between calls.
+
+    Idle connections are kept in a bounded pool per host and reused by later
+    requests. Connections that have been idle for longer than
+    ``idle_timeout`` seconds are closed instead of reused. If a reused
+    connection turns out to have been closed by the server the request is
+    sent once more over a fresh connection.
+
+    Idle connections are checked before they are reused, and connections that
+    the server has closed are evicted without sending anything over them.
+
+    The transport is safe to share between threads since every request checks
+    out a connection of its own, which means that a single ``Loopia`` client
+    may serve any number of threads. Use ``max_size`` to limit the number of
+    connections that are open at once, in which case requests wait for a
+    connection to be checked in when all of them are in use.
+
+    :param use_https: Use TLS when connecting
+    :param max_connections: Maximum number of idle connections kept per host
+    :param idle_timeout: Number of seconds a connection may be idle and still
+                         be reused
+    :param max_size: Maximum number of connections per host that may be open
+                     at once, in use or idle, or ``None`` for no limit
+    :param wait_timeout: Number of seconds to wait for a connection when
+                         ``max_size`` connections are in use before raising
+                         ``PoolTimeoutError``, or ``None`` to wait forever
+    :param timeout: Socket timeout in seconds, or ``None`` for the default
+    :param context: ``ssl.SSLContext`` to use for HTTPS connections
+    :param clock: Monotonic clock function, mainly useful for testing
+    """
+
+    #: Number of bytes to read at a time from streamed responses
+    stream_chunk_size = 16384
+
+    def __init__(
+            self, use_https=False, max_connections=4, idle_timeout=30.0,
+            timeout=None, context=None, max_size=None, wait_timeout=None,
+            clock=time.monotonic, **kwargs):
+        Transport.__init__(self, **kwargs)
+
+        if max_connections < 1:
+            raise ValueError("'max_connections' must not be less than 1")
+
+        if max_size is not None and max_size < 1:
+            raise ValueError("'max_size' must not be less than 1")
+
+        self.use_https = use_https
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.context = context
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = {}
+
+        # Number of open connections per host, both idle and checked out
+        self._open = {}
+
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.connections_evicted = 0
+        self.reconnects = 0
+        self.waits = 0
+
+    def make_connection(self, host):
+        chost, _, x509 = self.get_host_info(host)
+
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs["timeout"] = self.timeout
+
+        if self.use_https:
+            return http_client.HTTPSConnection(
+                chost, context=self.context, **dict(x509 or {}, **kwargs))
+        return http_client.HTTPConnection(chost, **kwargs)
+
+    def _checkout(self, host):
+        """
+        Return a tuple of a connection to the given host and whether it was
+        reused from the pool or not.
+        """
+
+        deadline = None
+        if self.wait_timeout is not None:
+            deadline = self._clock() + self.wait_timeout
+
+        evicted = []
+        try:
+            with self._available:
+                while True:
+                    connection = self._pop_idle(host, evicted)
+                    if connection is not None:
+                        self.connections_reused += 1
+                        return connection, True
+
+                    open_count = self._open.get(host, 0)
+                    if self.max_size is None or open_count < self.max_size:
+                        self._open[host] = open_count + 1
+                        self.connections_opened += 1
+                        break
+
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - self._clock()
+                        if timeout <= 0:
+                            raise PoolTimeoutError(
+                                "No connection to {} became available within "
+                                "{} seconds".format(host, self.wait_timeout))
+                    self.waits += 1
+                    self._available.wait(timeout)
+        finally:
+            for connection in evicted:
+                connection.close()
+
+        return self.make_connection(host), False
+
+    def _pop_idle(self, host, evicted):
+        """
+        Return the most recently used idle connection that is still usable,
+        or ``None``. Unusable connections are added to ``evicted`` to be
+        closed once the lock is released. Must be called with the lock held.
+        """
+
+        idle = self._idle.get(host)
+        now = self._clock()
+        while idle:
+            connection, last_used = idle.pop()
+
+            # The most recently used connection is at the end, which means
+            # that if it is too old, so are all the others
+            if now - last_used > self.idle_timeout:
+                stale = [connection] + [c for c, _ in idle]
+                del idle[:]
+            elif not _is_healthy(connection):
+                stale = [connection]
+            else:
+                return connection
+
+            evicted.extend(stale)
+            self.connections_evicted += len(stale)
+            self._release(host, len(stale))
+        return None
+
+    def _release(self, host, count=1):
+        """
+        Forget closed connections so that other requests may open new ones.
+        Must be called with the lock held.
+        """
+
+        self._open[host] -= count
+        self._available.notify(count)
+
+    def _discard(self, host, connection):
+        connection.close()
+        with self._lock:
+            self._release(host)
+
+    def _checkin(self, host, connection, response):
+        if not response.will_close:
+            with self._lock:
+                idle = self._idle.setdefault(host, [])
+                if len(idle) < self.max_connections:
+                    idle.append((connection, self._clock()))
+                    self._available.notify()
+                    return
+        self._discard(host, connection)
+
+    def request(self, host, handler, request_body, verbose=False):
+        return self._request(
+            host, handler, request_body, verbose, self.parse_response)
+
+    def request_raw(self, host, handler, request_body):
+        """
+        Send a request and return the body of the response as ``bytes``
+        without parsing it. Compressed responses are decompressed.
+        """
+
+        return self._request(host, handler, request_body, False, _read_body)
+
+    def _request(self, host, handler, request_body, verbose, read):
+        for attempt in (0, 1):
+            connection, reused = self._checkout(host)
+            try:
+                return self._single_request(
+                    connection, host, handler, request_body, verbose, read)
+            except _RESET_ERRORS:
+                # Only retry when the server may have dropped an idle
+                # connection. Failing on a fresh connection is a real error
+                if attempt or not reused:
+                    raise
+                self.reconnects += 1
+
+    def _single_request(
+            self, connection, host, handler, request_body, verbose, read):
+        try:
+            self._send_request(
+                connection, host, handler, request_body, verbose)
+            response = connection.getresponse()
+            if response.status != 200:
+                response.read()
+                raise ProtocolError(
+                    host + handler,
+                    response.status,
+                    response.reason,
+                    dict(response.getheaders()))
+
+            self.verbose = verbose
+            result = read(response)
+        except Fault:
+            # Faults are well formed responses so the connection is still good
+            self._checkin(host, connection, response)
+            raise
+        except BaseException:
+            # Interrupted requests leave the connection in an unknown state,
+            # and it must still be released so that its slot can be reused
+            self._discard(host, connection)
+            raise
+
+        self._checkin(host, connection, response)
+        return result
+
+    def request_stream(self, host, handler, request_body, parser):
+        """
+        Send a request and yield the items that the given ``StreamParser``
+        parses from the response while it is being received.
+
+        The connection is only returned to the pool if the whole response was
+        consumed. Compression is never requested since gzip responses can't be
+        decoded incrementally by ``xmlrpc.client``.
+        """
+
+        for attempt in (0, 1):
+            connection, reused = self._checkout(host)
+            try:
+                self._send_request(
+                    connection, host, handler, request_body, False,
+                    accept_gzip=False)
+                response = connection.getresponse()
+                break
+            except _RESET_ERRORS:
+                self._discard(host, connection)
+                if attempt or not reused:
+                    raise
+                self.reconnects += 1
+            except BaseException:
+                self._discard(host, connection)
+                raise
+
+        completed = False
+        try:
+            if response.status != 200:
+                response.read()
+                raise ProtocolError(
+                    host + handler,
+                    response.status,
+                    response.reason,
+                    dict(response.getheaders()))
+
+            while True:
+                chunk = response.read(self.stream_chunk_size)
+                if not chunk:
+                    break
+                for item in parser.feed(chunk):
+                    yield item
+
+            completed = True
+            for item in parser.close():
+                yield item
+        finally:
+            if completed:
+                self._checkin(host, connection, response)
+            else:
+                self._discard(host, connection)
+
+    def _send_request(
+            self, connection, host, handler, request_body, debug,
+            accept_gzip=True):
+        _, extra_headers, _ = self.get_host_info(host)
+        headers = self._headers + extra_headers
+        if debug:
+            connection.set_debuglevel(1)
+        if accept_gzip and self.accept_gzip_encoding:
+            connection.putrequest("POST", handler, skip_accept_encoding=True)
+            headers.append(("Accept-Encoding", "gzip"))
+        else:
+            connection.putrequest("POST", handler)
+        headers.append(("Content-Type", "text/xml"))
+        headers.append(("User-Agent", self.user_agent))
+        self.send_headers(connection, headers)
+        self.send_content(connection, request_body)
+
+    def close(self):
+        """
+        Close all idle connections in the pool.
+        """
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            for host, connections in idle.items():
+                self._release(host, len(connections))
+
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
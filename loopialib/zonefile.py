@@ -0,0 +1,410 @@
+"""
+Streaming import and export of BIND style zone files (RFC 1035 master files).
+
+Both directions work one record at a time, so memory use doesn't grow with
+the size of the zone file. Imports are sent through ``Loopia.batch`` a
+window of records at a time, which takes two requests per window when the
+API supports ``system.multicall``.
+"""
+
+import re
+
+from collections import OrderedDict, namedtuple
+
+from .sync import _record_key, plan_zone
+from .types import DnsRecord, _record_types
+from .utils import split_domain
+
+
+__all__ = [
+    "ZoneImport",
+    "export_zone_file",
+    "format_record",
+    "import_zone_file",
+    "read_zone_file",
+]
+
+
+#: Number of sub domains and records changed by ``import_zone_file``
+ZoneImport = namedtuple(
+    "ZoneImport", ["subdomains", "added", "updated", "removed"])
+
+
+#: A quoted string, a parenthesis, a comment, a plain token or an unterminated
+#: quote, which is an error
+_token = re.compile(r'"(?:[^"\\]|\\.)*"|[()]|;.*|(?:[^\s;()"\\]|\\.)+|["\\]')
+
+_special = re.compile(r'["();\\]')
+
+_escape = re.compile(r"\\(\d{3}|.)")
+
+_ttl_units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_ttl = re.compile(r"(\d+)([smhdw]?)", re.IGNORECASE)
+
+_classes = frozenset(["IN", "CH", "HS", "CS"])
+
+#: Record types whose data is a single domain name
+_name_types = frozenset(["CNAME", "NS"])
+
+#: Maximum length of a single character string in TXT data
+_max_string = 255
+
+
+def _unescape(match):
+    value = match.group(1)
+    return chr(int(value)) if len(value) == 3 else value
+
+
+def _unquote(token):
+    if token.startswith('"'):
+        token = token[1:-1]
+    return _escape.sub(_unescape, token)
+
+
+def _quote(text):
+    escaped = text.replace("\\", "\\\\").replace('"', '\\"')
+    chunks = [
+        escaped[i:i + _max_string]
+        for i in range(0, len(escaped), _max_string)
+    ] or [""]
+
+    # Don't split in the middle of an escape sequence
+    for i in range(len(chunks) - 1):
+        trailing = len(chunks[i]) - len(chunks[i].rstrip("\\"))
+        if trailing % 2:
+            chunks[i + 1] = "\\" + chunks[i + 1]
+            chunks[i] = chunks[i][:-1]
+    return " ".join('"{}"'.format(chunk) for chunk in chunks)
+
+
+def _parse_ttl(token):
+    """
+    Return the TTL in seconds of a token such as ``3600`` or ``1h30m``, or
+    ``None`` if the token is not a TTL.
+    """
+
+    if token.isdigit():
+        return int(token)
+
+    parts = _ttl.findall(token)
+    if not parts or "".join(a + b for a, b in parts) != token:
+        return None
+    if not all(unit for _, unit in parts):
+        return None
+    return sum(int(value) * _ttl_units[unit.lower()] for value, unit in parts)
+
+
+def _absolute(name, origin):
+    """
+    Return the given name relative to ``origin`` as a lower case absolute
+    name without the trailing dot.
+    """
+
+    if name == "@":
+        return origin
+    if name.endswith(".") and not name.endswith("\\."):
+        return name[:-1].lower()
+    if not origin:
+        return name.lower()
+    return "{}.{}".format(name, origin).lower()
+
+
+def _logical_lines(fp):
+    """
+    Yield ``(line number, has owner, tokens)`` for every entry of a zone
+    file, joining entries that span several lines with parentheses.
+    """
+
+    tokens = []
+    depth = 0
+    start = None
+    has_owner = False
+    for number, line in enumerate(fp, 1):
+        if depth == 0:
+            start = number
+            has_owner = line[:1] not in (" ", "\t")
+
+            # Most lines are plain tokens, which split() handles much faster
+            if _special.search(line) is None:
+                tokens = line.split()
+                if tokens:
+                    yield start, has_owner, tokens
+                    tokens = []
+                continue
+
+        for match in _token.finditer(line):
+            token = match.group()
+            if token == "(":
+                depth += 1
+            elif token == ")":
+                depth -= 1
+                if depth < 0:
+                    raise ValueError("Line {}: unbalanced ')'".format(number))
+            elif token[0] == ";":
+                break
+            elif token in ('"', "\\"):
+                raise ValueError(
+                    "Line {}: unterminated string".format(number))
+            else:
+                tokens.append(token)
+
+        if depth == 0 and tokens:
+            yield start, has_owner, tokens
+            tokens = []
+
+    if depth:
+        raise ValueError("Line {}: unbalanced '('".format(start))
+
+
+def _record_data(type, rdata, origin):
+    """
+    Return ``(priority, data)`` of a record from its RDATA tokens.
+    """
+
+    if type == "TXT":
+        return 0, "".join(_unquote(token) for token in rdata)
+
+    if type in _name_types:
+        name, = rdata
+        return 0, _absolute(name, origin) + "."
+
+    if type == "MX":
+        priority, name = rdata
+        return int(priority), _absolute(name, origin) + "."
+
+    if type == "SRV":
+        priority, weight, port, name = rdata
+        target = "." if name == "." else _absolute(name, origin) + "."
+        return int(priority), "{} {} {}".format(int(weight), int(port), target)
+
+    return 0, " ".join(rdata)
+
+
+def read_zone_file(fp, origin=""):
+    """
+    Yield ``(name, DnsRecord)`` for every record of a zone file while it is
+    being read. Names are absolute and lower case without the trailing dot.
+
+    ``$ORIGIN`` and ``$TTL`` are supported, as well as ``@``, relative names,
+    omitted owners, TTLs and classes, TTL units such as ``1h`` and entries
+    spanning several lines. SOA records are skipped since the API manages
+    them. Domain names in CNAME, NS, MX and SRV data are made absolute.
+
+    :param fp: File object opened in text mode
+    :param origin: Origin of relative names until the first ``$ORIGIN``
+    :raises ValueError: On syntax errors and unsupported record types, with
+                        the line number
+    """
+
+    origin = origin.rstrip(".").lower()
+    default_ttl = None
+    last_ttl = None
+    owner = None
+    for number, has_owner, tokens in _logical_lines(fp):
+        directive = tokens[0].upper()
+        if directive in ("$ORIGIN", "$TTL") and len(tokens) != 2:
+            raise ValueError("Line {}: invalid {}".format(number, directive))
+        if directive == "$ORIGIN":
+            origin = _absolute(tokens[1], origin)
+            continue
+        if directive == "$TTL":
+            default_ttl = _parse_ttl(tokens[1])
+            if default_ttl is None:
+                raise ValueError("Line {}: invalid TTL '{}'".format(
+                    number, tokens[1]))
+            continue
+        if directive.startswith("$"):
+            raise ValueError("Line {}: unsupported directive '{}'".format(
+                number, tokens[0]))
+
+        if has_owner:
+            owner = _absolute(tokens.pop(0), origin)
+        elif owner is None:
+            raise ValueError("Line {}: missing owner name".format(number))
+
+        ttl = None
+        while len(tokens) > 1:
+            if tokens[0].upper() in _classes:
+                tokens.pop(0)
+                continue
+            value = _parse_ttl(tokens[0])
+            if value is None:
+                break
+            ttl = value
+            tokens.pop(0)
+
+        if not tokens:
+            raise ValueError("Line {}: missing record type".format(number))
+        type = tokens[0].upper()
+        if type == "SOA":
+            continue
+        if type not in _record_types:
+            raise ValueError("Line {}: unsupported record type '{}'".format(
+                number, tokens[0]))
+
+        # Records without a TTL get the one of $TTL, or else the previous one
+        if ttl is None:
+            ttl = default_ttl if default_ttl is not None else last_ttl
+        last_ttl = ttl
+
+        try:
+            priority, data = _record_data(type, tokens[1:], origin)
+        except ValueError:
+            raise ValueError("Line {}: invalid {} record".format(number, type))
+        yield owner, DnsRecord(type, ttl=ttl, priority=priority, data=data)
+
+
+def format_record(subdomain, record):
+    """
+    Return a zone file line for the given record of a sub domain, relative to
+    an ``$ORIGIN`` of the domain.
+    """
+
+    data = record.data
+    if record.type == "TXT":
+        data = _quote(data)
+    elif record.type in ("MX", "SRV"):
+        data = "{} {}".format(record.priority, data)
+
+    return "{}\t{}\tIN\t{}\t{}\n".format(
+        subdomain or "@", record.ttl, record.type, data)
+
+
+def export_zone_file(loopia, domain, fp):
+    """
+    Write all records of a domain to a text file in the zone file format,
+    streaming the records of every sub domain as they are received.
+
+    Record data is written the way the API returns it.
+
+    :param loopia: ``Loopia`` client
+    :param domain: Domain name
+    :param fp: File object opened in text mode
+    :return: Number of records written
+    """
+
+    domain = domain.rstrip(".").lower()
+    subdomains = loopia.get_subdomains(domain)
+    subdomains.sort(key=lambda subdomain: subdomain != "@")
+
+    fp.write("$ORIGIN {}.\n".format(domain))
+    count = 0
+    for subdomain in subdomains:
+        for record in loopia.iter_zone_records(domain, subdomain):
+            fp.write(format_record(subdomain, record))
+            count += 1
+    return count
+
+
+def _subdomain(name, domain):
+    parts = split_domain(name)
+    if parts.domain != domain:
+        raise ValueError("'{}' is not in '{}'".format(name, domain))
+    return parts.subdomain or "@"
+
+
+def _windows(records, domain, size):
+    """
+    Yield ``OrderedDict`` of sub domains and records with about ``size``
+    records each.
+    """
+
+    window = OrderedDict()
+    count = 0
+    for name, record in records:
+        window.setdefault(_subdomain(name, domain), []).append(record)
+        count += 1
+        if count >= size:
+            yield window
+            window = OrderedDict()
+            count = 0
+
+    if window:
+        yield window
+
+
+def import_zone_file(
+        loopia, domain, fp, origin=None, replace=False, window=100):
+    """
+    Add the records of a zone file to a domain, reading and sending them a
+    window at a time.
+
+    Records that already exist are left alone and records that only differ in
+    TTL are updated. With ``replace`` the other records of every sub domain in
+    the file are removed, or reused for records that must be added. Sub
+    domains that are not in the file are never touched. Since only a window
+    of the file is known at a time, the records of a sub domain should be
+    kept together in the file, the way ``export_zone_file`` writes them.
+    Otherwise ``replace`` removes records that are added again later on.
+
+    Sub domains that don't exist are added. Every window takes one batch to
+    read the current records and one to write the changes.
+
+    :param loopia: ``Loopia`` client
+    :param domain: Domain name
+    :param fp: File object opened in text mode
+    :param origin: Origin of relative names until the first ``$ORIGIN``,
+                   defaults to the domain
+    :param replace: Remove records that are not in the file
+    :param window: Number of records to read before sending them
+    :return: A ``ZoneImport`` with the number of changes
+    :raises ValueError: On syntax errors and records of other domains
+    :raises LoopiaError: When a call fails. Earlier windows have been
+                         imported by then
+    """
+
+    # Names read from the file are lower case absolute names without the
+    # trailing dot, and the domain has to compare equal to their domains
+    domain = domain.rstrip(".").lower()
+    if origin is None:
+        origin = domain
+
+    existing = set(loopia.get_subdomains(domain))
+    seen = set()
+    added = updated = removed = 0
+    records = read_zone_file(fp, origin)
+    for zones in _windows(records, domain, window):
+        with loopia.batch() as batch:
+            futures = OrderedDict()
+            for subdomain in zones:
+                if subdomain in existing:
+                    futures[subdomain] = batch.get_zone_records(
+                        domain, subdomain)
+                else:
+                    futures[subdomain] = batch.add_subdomain(
+                        domain, subdomain)
+
+        with loopia.batch() as batch:
+            writes = []
+            for subdomain, desired in zones.items():
+                # Sub domains that were just added have no records
+                current = futures[subdomain].result() or []
+
+                if subdomain in seen or not replace:
+                    keys = set(_record_key(record) for record in desired)
+                    desired = desired + [
+                        record for record in current
+                        if _record_key(record) not in keys
+                    ]
+                plan = plan_zone(current, desired)
+
+                for record in plan.update:
+                    writes.append(batch.update_zone_record(
+                        record, domain, subdomain))
+                for record in plan.add:
+                    writes.append(batch.add_zone_record(
+                        record, domain, subdomain))
+                for record in plan.remove:
+                    writes.append(batch.remove_zone_record(
+                        record.id, domain, subdomain))
+
+                added += len(plan.add)
+                updated += len(plan.update)
+                removed += len(plan.remove)
+                existing.add(subdomain)
+                seen.add(subdomain)
+
+        for future in writes:
+            future.result()
+
+    return ZoneImport(len(seen), added, updated, removed)
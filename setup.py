@@ -23,6 +23,11 @@ if __name__ == "__main__":
         url="https://www.github.com/runfalk/loopialib",
         packages=["loopialib"],
         install_requires=[],
+        entry_points={
+            "console_scripts": [
+                "loopialib = loopialib.__main__:main",
+            ],
+        },
         extras_require={
             "dev": [
                 "mock",
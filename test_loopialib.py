@@ -1,9 +1,44 @@
+import asyncio
+import http.client
+import io
+import os
 import pytest
-
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from contextlib import ExitStack
 from datetime import date
-from loopialib import Loopia, LoopiaError, DnsRecord, split_domain
+from loopialib import (
+    AsyncLoopia, Loopia, LoopiaError, DnsRecord, split_domain, split_domains)
+from loopialib.batch import Batch
+from loopialib.cache import ResponseCache
+from loopialib.__main__ import main as cli_main
+from loopialib.ddns import DynDnsUpdater, get_addresses, parse_source
+from loopialib.exceptions import AuthError, BadIndataError, RateLimitedError
+from loopialib.index import IndexedRecord, RecordIndex
+from loopialib.metrics import CallHook, Histogram, MetricsCollector
+from loopialib.ratelimit import RateLimiter
+from loopialib.retry import RetryPolicy
+from loopialib.stream import StreamParser
+from loopialib.singleflight import SingleFlight
+from loopialib.snapshot import (
+    RecordChange, SnapshotFile, SnapshotFileWriter, SnapshotIndex,
+    ZoneSnapshot, diff_snapshots, load_snapshot, read_snapshot,
+    write_snapshot_file, zone_digest)
+from loopialib.testing import LoopiaEmulator
+from loopialib.suffix import SuffixTrie, compile_rules
+from loopialib.sync import ZonePlan, plan_zone
+from loopialib.table import RecordTable
+from loopialib.transport import PoolTimeoutError, PooledTransport
 from loopialib.types import Domain
+from loopialib.utils import iter_split_domains
+from loopialib.zonefile import format_record, read_zone_file
 from mock import Mock
+from xmlrpc.client import Fault, ProtocolError, ServerProxy, dumps
 
 try:
     ustr = unicode
@@ -28,14 +63,37 @@ class MockRpcClient(object):
 
 class LoopiaMock(Loopia):
     def __init__(self, user, password):
-        self.user = user
-        self.password = password
+        super(LoopiaMock, self).__init__(user, password)
         self._client = MockRpcClient()
 
     def intercept(self, method):
         return self._client.intercept(method)
 
 
+@pytest.fixture(params=[True], ids=["multicall"])
+def server(request):
+    with LoopiaEmulator(multicall=request.param) as server:
+        server.add_domain("foo.bar", ["@", "www", "mail"])
+        server.add_domain("biz.baz", [])
+        yield server
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
 @pytest.fixture
 def record():
     return DnsRecord(type="A", ttl=3600, priority=0, data="127.0.0.1", id=1)
@@ -148,6 +206,17 @@ def test_dns_record_from_dict(record_obj, record):
     assert DnsRecord.from_dict(record_obj) == record
 
 
+def test_dns_record_from_trusted_dict(record_obj, record):
+    trusted = DnsRecord.from_trusted_dict(record_obj)
+    assert trusted == record
+    assert type(trusted) is DnsRecord
+    assert repr(trusted) == repr(record)
+
+
+def test_dns_record_slots(record):
+    assert not hasattr(record, "__dict__")
+
+
 def test_dns_record_to_dict(record, record_obj):
     assert record.to_dict() == record_obj
 
@@ -350,6 +419,14 @@ def test_remove_zone_record_no_int(loopia, record):
     ("static.img.test.com", "test.com", "static.img"),
     ("test.co.uk", "test.co.uk", None),
     ("www.test.co.uk", "test.co.uk", "www"),
+    ("www.Test.CO.UK", "Test.CO.UK", "www"),
+    ("www.test.uk.com", "test.uk.com", "www"),
+    ("a.b.city.kawasaki.jp", "city.kawasaki.jp", "a.b"),
+    ("www.test.kawasaki.jp", "www.test.kawasaki.jp", None),
+    ("www.city.kawasaki.jp", "city.kawasaki.jp", "www"),
+    ("www.test.unknowntld", "test.unknowntld", "www"),
+    (u"www.test.\u516c\u53f8.cn", u"test.\u516c\u53f8.cn", "www"),
+    ("www.test.xn--55qx5d.cn", "test.xn--55qx5d.cn", "www"),
 ])
 def test_utils_split_domain(full_domain, domain, subdomain):
     split = split_domain(full_domain)
@@ -358,8 +435,1846 @@ def test_utils_split_domain(full_domain, domain, subdomain):
     assert split.subdomain == subdomain
 
 
+def test_utils_split_domains():
+    names = [
+        "com",
+        "www.test.com",
+        "test.co.uk",
+        "www.test.com",
+        "a.b.city.kawasaki.jp",
+        "a..b.com",
+    ]
+
+    domains, subdomains = split_domains(names, batch_size=2)
+    assert list(zip(domains, subdomains)) == [split_domain(n) for n in names]
+    assert split_domains([]) == ([], [])
+
+
+def test_utils_iter_split_domains():
+    fp = io.StringIO(u"www.test.com\n\ntest.co.uk\nmail.test.se\n")
+
+    assert list(iter_split_domains(fp, batch_size=2)) == [
+        (["test.com", "test.co.uk"], ["www", None]),
+        (["test.se"], ["mail"]),
+    ]
+
+
+def test_suffix_trie():
+    trie = SuffixTrie(["uk", "co.uk", "*.ck", "!www.ck", u"\u516c\u53f8.cn"])
+
+    assert trie.suffix_length(["test", "co", "uk"]) == 2
+    assert trie.suffix_length(["test", "uk"]) == 1
+    assert trie.suffix_length(["test", "any", "ck"]) == 2
+    assert trie.suffix_length(["test", "www", "ck"]) == 1
+    assert trie.suffix_length(["test", "xn--55qx5d", "cn"]) == 2
+    assert trie.suffix_length(["test", "unknown"]) == 1
+
+
+def test_compile_rules():
+    icann, private = compile_rules(u"""
+// ===BEGIN ICANN DOMAINS===
+uk
+co.uk
+!www.ck
+\u516c\u53f8.cn
+// ===END ICANN DOMAINS===
+// ===BEGIN PRIVATE DOMAINS===
+uk.com
+// ===END PRIVATE DOMAINS===
+""")
+
+    assert icann == ["uk", "co.uk", "!www.ck", "xn--55qx5d.cn"]
+    assert private == ["uk.com"]
+
+
 def test_exception_double_register():
     with pytest.raises(ValueError):
         @LoopiaError.register
         class DupeAuthError(LoopiaError):
             code = "AUTH_ERROR"
+
+
+def test_loopia_uses_pooled_transport():
+    loopia = Loopia("user", "password")
+    assert isinstance(loopia.transport, PooledTransport)
+    assert loopia.transport.use_https
+
+
+def test_pooled_transport_reuses_connection(server):
+    transport = PooledTransport()
+    proxy = ServerProxy(server.url, transport=transport)
+
+    for _ in range(3):
+        assert proxy.getSubdomains("user", "password", "foo.bar") == ["@", "www", "mail"]
+
+    assert transport.connections_opened == 1
+    assert transport.connections_reused == 2
+
+
+def test_pooled_transport_bounded_pool(server):
+    transport = PooledTransport(max_connections=1)
+    host = server.url.split("/")[2]
+
+    # Check out two connections at the same time, only one can go back
+    first, _ = transport._checkout(host)
+    second, _ = transport._checkout(host)
+    for connection in (first, second):
+        connection.connect()
+        transport._checkin(host, connection, Mock(will_close=False))
+
+    assert len(transport._idle[host]) == 1
+    assert second.sock is None
+
+    transport.close()
+    assert not transport._idle
+
+
+def test_pooled_transport_idle_timeout(server):
+    now = [0.0]
+    transport = PooledTransport(idle_timeout=10, clock=lambda: now[0])
+    proxy = ServerProxy(server.url, transport=transport)
+
+    proxy.getSubdomains("user", "password", "foo.bar")
+    now[0] = 5.0
+    proxy.getSubdomains("user", "password", "foo.bar")
+    now[0] = 20.0
+    proxy.getSubdomains("user", "password", "foo.bar")
+
+    assert transport.connections_opened == 2
+    assert transport.connections_reused == 1
+    assert transport.connections_evicted == 1
+
+
+def test_pooled_transport_reconnect_on_reset(server, monkeypatch):
+    transport = PooledTransport()
+    proxy = ServerProxy(server.url, transport=transport)
+
+    # Pretend that the connection is closed after it has been checked out
+    monkeypatch.setattr("loopialib.transport._is_healthy", lambda c: True)
+
+    server.keep_alive = False
+    assert proxy.getSubdomains("user", "password", "foo.bar") == ["@", "www", "mail"]
+    assert proxy.getSubdomains("user", "password", "foo.bar") == ["@", "www", "mail"]
+
+    assert transport.connections_opened == 2
+    assert transport.reconnects == 1
+
+
+def test_pooled_transport_evicts_closed_connections(server):
+    transport = PooledTransport()
+    proxy = ServerProxy(server.url, transport=transport)
+
+    server.keep_alive = False
+    proxy.getSubdomains("user", "password", "foo.bar")
+    host = server.url.split("/")[2]
+    connection, _ = transport._idle[host][0]
+    select.select([connection.sock], [], [], 5)
+
+    proxy.getSubdomains("user", "password", "foo.bar")
+    assert transport.connections_opened == 2
+    assert transport.connections_evicted == 1
+    assert transport.reconnects == 0
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32", reason="Descriptors can't be renumbered")
+def test_pooled_transport_high_descriptors(server):
+    import resource
+
+    high = 1500
+    if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= high:
+        pytest.skip("Not enough descriptors")
+
+    transport = PooledTransport()
+    proxy = ServerProxy(server.url, transport=transport)
+    proxy.getSubdomains("user", "password", "foo.bar")
+
+    # Idle connections with descriptors above FD_SETSIZE are still reused
+    host = server.url.split("/")[2]
+    connection, _ = transport._idle[host][0]
+    low = connection.sock
+    connection.sock = socket.socket(fileno=os.dup2(low.fileno(), high))
+    low.close()
+
+    proxy.getSubdomains("user", "password", "foo.bar")
+    assert transport.connections_reused == 1
+    assert transport.connections_evicted == 0
+    transport.close()
+
+
+def test_pooled_transport_max_size(server):
+    transport = PooledTransport(max_size=1, wait_timeout=0.05)
+    host = server.url.split("/")[2]
+
+    connection, _ = transport._checkout(host)
+    with pytest.raises(PoolTimeoutError):
+        transport._checkout(host)
+    assert transport.waits >= 1
+
+    # Discarding a connection makes room for a new one
+    transport._discard(host, connection)
+    connection, _ = transport._checkout(host)
+    transport._discard(host, connection)
+
+
+def test_pooled_transport_wait_timeout_clock(server, clock):
+    transport = PooledTransport(max_size=1, wait_timeout=60, clock=clock)
+    host = server.url.split("/")[2]
+    connection, _ = transport._checkout(host)
+
+    # The deadline is measured with the given clock, so the waiting request
+    # gives up as soon as it has passed without waiting a real minute
+    done = threading.Event()
+    def advance():
+        while not transport.waits:
+            done.wait(0.01)
+        clock.now = 61.0
+        while not done.is_set():
+            with transport._available:
+                transport._available.notify_all()
+            done.wait(0.01)
+
+    thread = threading.Thread(target=advance)
+    thread.start()
+    try:
+        with pytest.raises(PoolTimeoutError):
+            transport._checkout(host)
+    finally:
+        done.set()
+        thread.join()
+    transport._discard(host, connection)
+
+
+def test_pooled_transport_interrupted_request(server, monkeypatch):
+    transport = PooledTransport(max_size=1, wait_timeout=0.05)
+    proxy = ServerProxy(server.url, transport=transport)
+    host = server.url.split("/")[2]
+
+    def interrupt(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(transport, "_send_request", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        proxy.getSubdomains("user", "password", "foo.bar")
+    with pytest.raises(KeyboardInterrupt):
+        list(transport.request_stream(host, "/", b"", None))
+
+    # The slots of the interrupted requests were released
+    assert transport._open[host] == 0
+    monkeypatch.undo()
+    assert proxy.getSubdomains("user", "password", "foo.bar") == ["@", "www", "mail"]
+
+
+def test_loopia_shared_between_threads(server, record):
+    transport = PooledTransport(max_size=2)
+    loopia = Loopia(
+        "user", "password", base_url=server.url, transport=transport,
+        single_flight=False)
+
+    errors = []
+    def worker(i):
+        try:
+            loopia.add_zone_record(
+                record.replace(id=0, data="127.0.0.{}".format(i)),
+                "foo.bar",
+                "www")
+            loopia.get_zone_records("foo.bar", "www")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(loopia.get_zone_records("foo.bar", "www")) == 16
+    assert transport.connections_opened <= 2
+    assert transport._open[server.url.split("/")[2]] <= 2
+
+
+def test_loopia_over_pooled_transport(server):
+    loopia = Loopia("user", "password", base_url=server.url)
+    assert loopia.get_subdomains("foo.bar") == ["@", "www", "mail"]
+
+
+def test_async_loopia(server):
+    async def main():
+        loopia = AsyncLoopia("user", "password", base_url=server.url)
+        assert await loopia.get_subdomains("foo.bar") == ["@", "www", "mail"]
+        server.fail_next("AUTH_ERROR")
+        with pytest.raises(AuthError):
+            await loopia.remove_subdomain("foo.bar")
+        loopia.close()
+
+    asyncio.run(main())
+
+
+def test_async_loopia_methods(server):
+    async def main():
+        loopia = AsyncLoopia("user", "password", base_url=server.url)
+        domain = await loopia.get_domain("foo.bar")
+        assert domain.domain == "foo.bar"
+        assert [d.domain for d in await loopia.get_domains()] == [
+            "foo.bar", "biz.baz"]
+        with pytest.raises(LoopiaError):
+            await loopia.get_domain("bad.domain")
+
+        await loopia.add_subdomain("biz.baz", "www")
+        await loopia.add_zone_record(
+            DnsRecord("A", data="192.0.2.1"), "biz.baz", "www")
+        with pytest.raises(ValueError):
+            await loopia.add_zone_record(
+                DnsRecord("A", id=1), "biz.baz", "www")
+        record, = await loopia.get_zone_records("biz.baz", "www")
+        assert record.data == "192.0.2.1"
+
+        await loopia.update_zone_record(
+            record.replace(data="192.0.2.2"), "biz.baz", "www")
+        assert [r.data for r in await loopia.get_zone_records(
+            "biz.baz", "www")] == ["192.0.2.2"]
+        with pytest.raises(BadIndataError):
+            await loopia.update_zone_record(
+                record.replace(id=12345), "biz.baz", "www")
+
+        await loopia.remove_zone_record(record.id, "biz.baz", "www")
+        assert await loopia.get_zone_records("biz.baz", "www") == []
+        with pytest.raises(BadIndataError):
+            await loopia.remove_zone_record(record.id, "biz.baz", "www")
+
+        await loopia.add_zone_record(DnsRecord("TXT", data="apex"), "biz.baz")
+        record, = await loopia.get_zone_records("biz.baz")
+        await loopia.update_zone_record(record.replace(ttl=60), "biz.baz")
+        assert (await loopia.get_zone_records("biz.baz"))[0].ttl == 60
+        await loopia.remove_zone_record(record.id, "biz.baz")
+        assert await loopia.get_zone_records("biz.baz") == []
+        loopia.close()
+
+    server.add_domain("biz.baz", ["@"])
+    asyncio.run(main())
+
+
+_OK_RESPONSE = dumps(
+    (["@", "www"],), methodresponse=True).encode("utf-8")
+
+
+def _chunked(body, size=16):
+    chunks = [body[i:i + size] for i in range(0, len(body), size)]
+    return b"".join(
+        b"%x;ext=1\r\n%s\r\n" % (len(chunk), chunk) for chunk in chunks
+    ) + b"0\r\nX-Trailer: 1\r\n\r\n"
+
+
+@pytest.mark.parametrize("response, reused", [
+    (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" +
+     _chunked(_OK_RESPONSE), True),
+    (b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (
+        len(_OK_RESPONSE), _OK_RESPONSE), True),
+    (b"HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: %d\r\n"
+     b"\r\n%s" % (len(_OK_RESPONSE), _OK_RESPONSE), False),
+    (b"HTTP/1.0 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (
+        len(_OK_RESPONSE), _OK_RESPONSE), False),
+    (b"HTTP/1.0 200 OK\r\nConnection: keep-alive\r\nContent-Length: %d\r\n"
+     b"\r\n%s" % (len(_OK_RESPONSE), _OK_RESPONSE), True),
+    (b"HTTP/1.1 200 OK\r\n\r\n" + _OK_RESPONSE, False),
+], ids=[
+    "chunked", "keep-alive", "close", "http/1.0", "http/1.0-keep-alive",
+    "until-eof",
+])
+def test_async_transport_responses(response, reused):
+    """
+    Serve canned HTTP responses to check the parts of ``AsyncTransport``
+    that the emulator doesn't use.
+    """
+
+    async def handle(reader, writer):
+        while True:
+            try:
+                headers = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            length = int(headers.lower().split(b"content-length:")[1].split(
+                b"\r\n")[0])
+            await reader.readexactly(length)
+            writer.write(response)
+            await writer.drain()
+            if not reused:
+                break
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        loopia = AsyncLoopia(
+            "user", "password",
+            base_url="http://127.0.0.1:{}/RPCSERV".format(port))
+        for _ in range(2):
+            assert await loopia.get_subdomains("foo.bar") == ["@", "www"]
+        transport = loopia.transport
+        assert transport.connections_opened == (1 if reused else 2)
+        assert transport.reconnects == 0
+        loopia.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(main())
+
+
+def test_async_transport_error_status():
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(
+            b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 4\r\n"
+            b"\r\nbusy")
+        await writer.drain()
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        loopia = AsyncLoopia(
+            "user", "password",
+            base_url="http://127.0.0.1:{}/RPCSERV".format(port))
+        with pytest.raises(ProtocolError) as e:
+            await loopia.get_domains()
+        assert e.value.errcode == 503
+        assert loopia.transport._idle == []
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(main())
+
+
+def test_async_loopia_concurrency_limit(server):
+    async def main():
+        loopia = AsyncLoopia(
+            "user", "password", base_url=server.url, max_concurrency=2,
+            single_flight=False)
+        results = await asyncio.gather(*[
+            loopia.get_subdomains("foo.bar")
+            for _ in range(20)
+        ])
+        assert results == [["@", "www", "mail"]] * 20
+        assert loopia.transport.connections_opened <= 2
+        assert loopia.transport.connections_reused >= 18
+        loopia.close()
+
+    asyncio.run(main())
+
+
+def test_async_transport_reconnect_on_reset(server):
+    async def main():
+        loopia = AsyncLoopia("user", "password", base_url=server.url)
+        server.keep_alive = False
+        assert await loopia.get_subdomains("foo.bar") == ["@", "www", "mail"]
+        assert await loopia.get_subdomains("foo.bar") == ["@", "www", "mail"]
+        assert loopia.transport.reconnects == 1
+        loopia.close()
+
+    asyncio.run(main())
+
+
+def test_bulk_zone_records(server, record):
+    loopia = Loopia("user", "password", base_url=server.url, workers=4)
+    record = record.replace(id=0)
+
+    results = loopia.add_zone_records([
+        (record.replace(data="127.0.0.{}".format(i)), "foo.bar", "www")
+        for i in range(20)
+    ])
+    assert results == [None] * 20
+
+    zones = loopia.get_zone_records_many([
+        ("foo.bar", "www"),
+        ("foo.bar", "mail"),
+        ("bad.domain", "www"),
+    ])
+    assert len(zones[0]) == 20
+    assert zones[1] == []
+    assert isinstance(zones[2], LoopiaError)
+
+    results = loopia.remove_zone_records([
+        (r.id, "foo.bar", "www") for r in zones[0]
+    ] + [(1000, "foo.bar", "www")])
+    assert results[:-1] == [None] * 20
+    assert isinstance(results[-1], LoopiaError)
+    assert loopia.get_zone_records("foo.bar", "www") == []
+
+
+def test_bulk_zone_records_stop_on_error(server, record):
+    loopia = Loopia("user", "password", base_url=server.url, workers=1)
+    items = [(record.replace(id=0), "foo.bar")] * 5
+    items.insert(1, (record.replace(id=0), "bad.domain"))
+
+    with pytest.raises(LoopiaError):
+        loopia.add_zone_records(items, stop_on_error=True)
+
+    # Only the calls until the first failure may have been made with a single
+    # worker
+    assert len(loopia.get_zone_records("foo.bar")) < 5
+
+
+def test_rate_limiter_throughput(clock):
+    limiter = RateLimiter(10, burst=5, clock=clock, sleep=clock.sleep)
+
+    # The burst is free, after that calls are spaced evenly
+    for _ in range(105):
+        limiter.acquire()
+
+    assert clock.now == pytest.approx(10.0)
+    assert limiter.waited == pytest.approx(10.0)
+
+
+def test_rate_limiter_threads(clock):
+    limiter = RateLimiter(10, burst=1, clock=clock, sleep=lambda s: None)
+    delays = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(10):
+            delay = limiter._reserve()
+            with lock:
+                delays.append(delay)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every reservation gets a slot of its own even though time stands still
+    assert sorted(delays) == pytest.approx([i / 10.0 for i in range(40)])
+
+
+def test_rate_limiter_async(clock):
+    limiter = RateLimiter(100, burst=1, clock=clock)
+
+    async def main():
+        await asyncio.gather(*[limiter.acquire_async() for _ in range(5)])
+
+    asyncio.run(main())
+    assert limiter.waited == pytest.approx(0.01 + 0.02 + 0.03 + 0.04)
+
+
+def test_rate_limiter_adaptive(clock):
+    limiter = RateLimiter(
+        10, burst=1, recovery=1, clock=clock, sleep=clock.sleep)
+
+    limiter.rate_limited()
+    assert limiter.rate == 5
+    limiter.rate_limited()
+    assert limiter.rate == 2.5
+
+    for _ in range(100):
+        limiter.acquire()
+    assert clock.now == pytest.approx(100 / 2.5)
+
+    for _ in range(10):
+        limiter.succeeded()
+    assert limiter.rate == 10
+
+
+def test_loopia_rate_limiter(loopia, clock):
+    loopia.rate_limiter = RateLimiter(
+        10, burst=1, clock=clock, sleep=clock.sleep)
+    responses = iter(["RATE_LIMITED", "OK"])
+
+    @loopia.intercept("removeSubdomain")
+    def remove_subdomain(user, password, domain, subdomain):
+        return next(responses)
+
+    with pytest.raises(RateLimitedError):
+        loopia.remove_subdomain("foo.bar")
+    assert loopia.rate_limiter.rate == 5
+
+    loopia.remove_subdomain("foo.bar")
+    assert clock.now == pytest.approx(0.2)
+    assert loopia.rate_limiter.rate == 5.5
+
+
+@pytest.fixture
+def retry_policy(clock):
+    return RetryPolicy(
+        max_attempts=4,
+        base_delay=1,
+        jitter=0.5,
+        clock=clock,
+        sleep=clock.sleep,
+        random=lambda: 0.5)
+
+
+def test_retry_policy_backoff(retry_policy):
+    assert retry_policy.delay(1) == 0.75
+    assert retry_policy.delay(2) == 1.5
+    assert retry_policy.delay(3) == 3.0
+
+    retry_policy.max_delay = 2
+    assert retry_policy.delay(3) == 1.5
+
+
+def test_retry_policy_retryable(retry_policy):
+    assert retry_policy.is_retryable("addZoneRecord", RateLimitedError())
+    assert not retry_policy.is_retryable("getZoneRecords", AuthError())
+    assert not retry_policy.is_retryable("getZoneRecords", ValueError())
+    assert retry_policy.is_retryable("getZoneRecords", ConnectionResetError())
+    assert not retry_policy.is_retryable("addZoneRecord", ConnectionResetError())
+    assert retry_policy.is_retryable("addZoneRecord", ConnectionRefusedError())
+
+
+def test_loopia_retry(loopia, retry_policy, clock):
+    loopia.retry_policy = retry_policy
+    responses = iter(["RATE_LIMITED", "RATE_LIMITED", "OK"])
+
+    @loopia.intercept("removeSubdomain")
+    def remove_subdomain(user, password, domain, subdomain):
+        return next(responses)
+
+    loopia.remove_subdomain("foo.bar")
+    assert remove_subdomain.call_count == 3
+    assert retry_policy.calls == 1
+    assert retry_policy.attempts == 3
+    assert retry_policy.retries == 2
+    assert retry_policy.backoff_time == clock.now == 0.75 + 1.5
+
+
+def test_loopia_retry_gives_up(loopia, retry_policy):
+    loopia.retry_policy = retry_policy
+
+    @loopia.intercept("getSubdomains")
+    def get_subdomains(user, password, domain):
+        raise ConnectionResetError()
+
+    with pytest.raises(ConnectionResetError):
+        loopia.get_subdomains("foo.bar")
+    assert get_subdomains.call_count == 4
+    assert retry_policy.failures == 1
+
+
+def test_loopia_retry_not_idempotent(loopia, retry_policy, record):
+    loopia.retry_policy = retry_policy
+
+    @loopia.intercept("addZoneRecord")
+    def add_zone_record(user, password, domain, subdomain, record):
+        raise ConnectionResetError()
+
+    with pytest.raises(ConnectionResetError):
+        loopia.add_zone_record(record.replace(id=0), "foo.bar")
+    assert add_zone_record.call_count == 1
+
+
+def test_loopia_retry_deadline(loopia, retry_policy):
+    retry_policy.deadline = 2
+    loopia.retry_policy = retry_policy
+
+    @loopia.intercept("getSubdomains")
+    def get_subdomains(user, password, domain):
+        return "RATE_LIMITED"
+
+    with pytest.raises(RateLimitedError):
+        loopia.get_subdomains("foo.bar")
+
+    # The third attempt would have been after 0.75 + 1.5 seconds
+    assert get_subdomains.call_count == 2
+
+
+def test_async_loopia_retry(server, retry_policy):
+    async def main():
+        loopia = AsyncLoopia(
+            "user", "password", base_url=server.url,
+            retry_policy=retry_policy)
+        server.fail_next("AUTH_ERROR")
+        with pytest.raises(AuthError):
+            await loopia.remove_subdomain("foo.bar")
+        assert await loopia.get_subdomains("foo.bar") == ["@", "www", "mail"]
+        loopia.close()
+
+    asyncio.run(main())
+    assert retry_policy.attempts == 2
+
+
+def test_cache_ttl(loopia, clock):
+    loopia.cache = ResponseCache(ttls={"getSubdomains": 10}, clock=clock)
+
+    @loopia.intercept("getSubdomains")
+    def get_subdomains(user, password, domain):
+        return ["www", "mail"]
+
+    for _ in range(3):
+        assert loopia.get_subdomains("foo.bar") == ["www", "mail"]
+    assert get_subdomains.call_count == 1
+
+    loopia.get_subdomains("biz.baz")
+    assert get_subdomains.call_count == 2
+
+    clock.now = 10
+    loopia.get_subdomains("foo.bar")
+    assert get_subdomains.call_count == 3
+
+    assert loopia.cache.hits == 2
+    assert loopia.cache.misses == 3
+
+
+def test_cache_invalidation(loopia, record, record_obj):
+    loopia.cache = ResponseCache()
+
+    @loopia.intercept("getZoneRecords")
+    def get_zone_records(user, password, domain, subdomain):
+        return [record_obj]
+
+    @loopia.intercept("updateZoneRecord")
+    def update_zone_record(user, password, domain, subdomain, record):
+        return "OK"
+
+    loopia.get_zone_records("foo.bar")
+    loopia.get_zone_records("foo.bar", "www")
+    loopia.get_zone_records("foo.bar")
+    assert get_zone_records.call_count == 2
+
+    loopia.update_zone_record(record, "foo.bar")
+    loopia.get_zone_records("foo.bar")
+    loopia.get_zone_records("foo.bar", "www")
+    assert get_zone_records.call_count == 3
+    assert loopia.cache.invalidations == 1
+
+
+def test_cache_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+
+    cache.set("getSubdomains", ("a",), ["www", "mail"])
+    cache.set("getSubdomains", ("b",), ["www", "mail"])
+    assert cache.get("getSubdomains", ("a",))[0]
+    cache.set("getSubdomains", ("c",), ["www", "mail"])
+
+    assert cache.get("getSubdomains", ("a",))[0]
+    assert not cache.get("getSubdomains", ("b",))[0]
+    assert cache.evictions == 1
+
+
+def test_cache_max_size():
+    cache = ResponseCache(max_size=1000)
+
+    for i in range(100):
+        cache.set("getSubdomains", (str(i),), ["www", "mail"])
+        assert cache.size <= 1000
+    assert 0 < len(cache) < 100
+
+    # Responses larger than the cache are never stored
+    cache.set("getSubdomains", ("big",), ["x" * 1000])
+    assert not cache.get("getSubdomains", ("big",))[0]
+
+    cache.clear()
+    assert len(cache) == cache.size == 0
+
+
+def test_plan_zone():
+    current = [
+        DnsRecord("A", data="127.0.0.1", id=1),
+        DnsRecord("A", data="127.0.0.2", id=2),
+        DnsRecord("MX", priority=10, data="mx1", id=3),
+        DnsRecord("MX", priority=20, data="mx2", id=4),
+        DnsRecord("TXT", data="old", id=5),
+    ]
+    desired = [
+        DnsRecord("A", data="127.0.0.1"),
+        DnsRecord("A", ttl=300, data="127.0.0.2", id=100),
+        DnsRecord("MX", priority=10, data="mx1"),
+        DnsRecord("MX", priority=30, data="mx2"),
+        DnsRecord("CNAME", data="foo.bar"),
+    ]
+
+    assert plan_zone(current, desired) == ZonePlan(
+        add=[DnsRecord("CNAME", data="foo.bar")],
+        update=[
+            DnsRecord("A", ttl=300, data="127.0.0.2", id=2),
+            DnsRecord("MX", priority=30, data="mx2", id=4),
+        ],
+        remove=[DnsRecord("TXT", data="old", id=5)],
+    )
+
+
+def test_plan_zone_duplicates():
+    current = [DnsRecord("A", data="127.0.0.1", id=i) for i in (1, 2, 3)]
+    desired = [DnsRecord("A", data="127.0.0.1")] * 2
+
+    plan = plan_zone(current, desired)
+    assert plan.add == plan.update == []
+    assert len(plan.remove) == 1
+
+    assert plan_zone(current, current) == ZonePlan([], [], [])
+
+
+def test_sync_zone_dry_run(loopia, record_obj):
+    @loopia.intercept("getZoneRecords")
+    def get_zone_records(user, password, domain, subdomain):
+        return [record_obj]
+
+    plan = loopia.sync_zone("foo.bar", None, [], dry_run=True)
+    assert plan == ZonePlan([], [], [DnsRecord.from_dict(record_obj)])
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_sync_zone(server, workers):
+    loopia = Loopia("user", "password", base_url=server.url)
+    for data in ("127.0.0.1", "127.0.0.2", "127.0.0.3"):
+        loopia.add_zone_record(DnsRecord("A", data=data), "foo.bar", "www")
+
+    desired = [
+        DnsRecord("A", data="127.0.0.1"),
+        DnsRecord("A", data="127.0.0.4"),
+        DnsRecord("AAAA", data="::1"),
+        DnsRecord("TXT", data="hello"),
+    ]
+    plan = loopia.sync_zone("foo.bar", "www", desired, workers=workers)
+    assert len(plan.add) == 2
+    assert len(plan.update) == 1
+    assert len(plan.remove) == 1
+
+    records = loopia.get_zone_records("foo.bar", "www")
+    assert sorted(r.replace(id=0) for r in records) == sorted(desired)
+    assert loopia.sync_zone("foo.bar", "www", desired) == ZonePlan([], [], [])
+
+
+@pytest.fixture
+def account(loopia, record_obj):
+    zones = {
+        "foo.bar": ["@", "www", "mail"],
+        "biz.baz": ["@", "www"],
+        "empty.bar": [],
+    }
+    failing = set()
+
+    @loopia.intercept("getDomains")
+    def get_domains(user, password):
+        return [
+            {
+                "domain": domain,
+                "expiration_date": "2000-01-01",
+                "renewal_status": "NORMAL",
+                "registered": 1,
+                "paid": 1,
+                "reference_no": 0,
+            }
+            for domain in zones
+        ]
+
+    @loopia.intercept("getSubdomains")
+    def get_subdomains(user, password, domain):
+        return zones[domain]
+
+    @loopia.intercept("getZoneRecords")
+    def get_zone_records(user, password, domain, subdomain):
+        if (domain, subdomain) in failing:
+            raise ConnectionResetError()
+        return [dict(record_obj, rdata=domain + "/" + subdomain)]
+
+    return zones, failing
+
+
+def test_snapshot(loopia, account):
+    zones, _ = account
+    snapshot = sorted(loopia.snapshot(workers=2))
+
+    assert [(z.domain, z.subdomain) for z in snapshot] == sorted(
+        (domain, subdomain)
+        for domain, subdomains in zones.items()
+        for subdomain in subdomains)
+    for zone in snapshot:
+        assert zone.records[0].data == zone.domain + "/" + zone.subdomain
+
+
+def test_save_snapshot_resume(loopia, account, tmpdir):
+    _, failing = account
+    path = str(tmpdir.join("snapshot.jsonl"))
+
+    failing.add(("foo.bar", "mail"))
+    with pytest.raises(ConnectionResetError):
+        loopia.save_snapshot(path, workers=1)
+
+    with open(path) as fp:
+        saved = len(list(read_snapshot(fp)))
+    assert saved < 5
+
+    # Simulate a crash in the middle of writing a line
+    with open(path, "a") as fp:
+        fp.write('{"domain": "foo.b')
+
+    failing.clear()
+    calls_before = loopia._client.getZoneRecords.call_count
+    assert loopia.save_snapshot(path, workers=1) == 5 - saved
+    assert loopia._client.getZoneRecords.call_count == calls_before + 5 - saved
+
+    with open(path) as fp:
+        snapshot = sorted(read_snapshot(fp))
+    assert len(snapshot) == 5
+    assert snapshot[0] == ZoneSnapshot(
+        "biz.baz",
+        "@",
+        [DnsRecord("A", data="biz.baz/@", id=1)])
+
+
+def test_zone_digest(record):
+    other = record.replace(id=2, data="127.0.0.2")
+
+    assert zone_digest([record, other]) == zone_digest([other, record])
+    assert zone_digest([record]) != zone_digest([record.replace(ttl=300)])
+    assert zone_digest([]) != zone_digest([record])
+
+
+def test_diff_snapshots(record):
+    mx = DnsRecord("MX", priority=10, data="mx", id=2)
+    old = {
+        ("foo.bar", "@"): [record, mx],
+        ("foo.bar", "www"): [record],
+        ("foo.bar", "old"): [record],
+    }
+    new = {
+        ("foo.bar", "@"): [mx.replace(priority=20), record.replace(id=3)],
+        ("foo.bar", "www"): [record],
+        ("foo.bar", "new"): [record],
+    }
+
+    class Lazy(dict):
+        accessed = []
+
+        def __getitem__(self, key):
+            self.accessed.append(key)
+            return dict.__getitem__(self, key)
+
+    old_index = SnapshotIndex.from_zones(
+        ZoneSnapshot(domain, subdomain, records)
+        for (domain, subdomain), records in old.items())
+    new_index = SnapshotIndex.from_zones(
+        ZoneSnapshot(domain, subdomain, records)
+        for (domain, subdomain), records in new.items())
+    changes = list(diff_snapshots(old_index, new_index, Lazy(old), Lazy(new)))
+
+    assert changes == [
+        RecordChange("modified", "foo.bar", "@", mx, mx.replace(priority=20)),
+        RecordChange("added", "foo.bar", "@", None, record.replace(id=3)),
+        RecordChange("removed", "foo.bar", "@", record, None),
+        RecordChange("added", "foo.bar", "new", None, record),
+        RecordChange("removed", "foo.bar", "old", record, None),
+    ]
+
+    # Unchanged zones are never loaded
+    assert ("foo.bar", "www") not in Lazy.accessed
+
+
+def test_snapshot_index_save_load(loopia, account, tmpdir):
+    path = str(tmpdir.join("snapshot.jsonl"))
+    loopia.save_snapshot(path)
+    with open(path) as fp:
+        zones = load_snapshot(fp)
+
+    index = SnapshotIndex.from_zones(
+        ZoneSnapshot(domain, subdomain, records)
+        for (domain, subdomain), records in zones.items())
+    assert len(index) == 5
+
+    with tmpdir.join("index.json").open("w") as fp:
+        index.save(fp)
+    with tmpdir.join("index.json").open() as fp:
+        loaded = SnapshotIndex.load(fp)
+    assert loaded.digests == index.digests
+    assert loaded.changed(index) == []
+
+
+def test_snapshot_index_derive(record):
+    class CountingDict(dict):
+        looked_up = 0
+
+        def get(self, key, default=None):
+            self.looked_up += 1
+            return dict.get(self, key, default)
+
+    old = SnapshotIndex.from_zones(
+        ZoneSnapshot("foo.bar", "sub{}".format(i), [record])
+        for i in range(100))
+    new = old.derive()
+    new.add(ZoneSnapshot("foo.bar", "sub1", [record.replace(ttl=60)]))
+    new.add(ZoneSnapshot("foo.bar", "sub2", [record]))
+    new.add(ZoneSnapshot("foo.bar", "added", [record]))
+    new.discard("foo.bar", "sub3")
+    new.discard("foo.bar", "missing")
+
+    # Only the zones changed through the derived index are compared
+    old.digests = CountingDict(old.digests)
+    expected = [("foo.bar", "added"), ("foo.bar", "sub1"), ("foo.bar", "sub3")]
+    assert old.changed(new) == expected
+    assert new.changed(old) == expected
+    assert old.digests.looked_up == 8
+
+    # Changing the base index afterwards falls back to comparing every zone
+    old.discard("foo.bar", "sub4")
+    assert old.changed(new) == expected + [("foo.bar", "sub4")]
+    assert SnapshotIndex(new.digests).changed(old) == (
+        expected + [("foo.bar", "sub4")])
+
+
+def test_stream_parser():
+    body = dumps(([
+        {"a": 1, "b": "x", "c": [1, 2.5, {"d": True}]},
+        "s",
+        [4, 5],
+    ],), methodresponse=True).encode("utf-8")
+
+    parser = StreamParser(factory=lambda struct: sorted(struct))
+    items = []
+    for i in range(0, len(body), 7):
+        items.extend(parser.feed(body[i:i + 7]))
+    items.extend(parser.close())
+
+    assert items == [["a", "b", "c"], "s", [4, 5]]
+
+
+def test_stream_parser_fault():
+    parser = StreamParser()
+    parser.feed(dumps(Fault(1, "Boom"), methodresponse=True).encode("utf-8"))
+    with pytest.raises(Fault):
+        parser.close()
+
+
+def test_iter_zone_records(server, record):
+    loopia = Loopia("user", "password", base_url=server.url)
+    loopia.transport.stream_chunk_size = 64
+    records = [
+        record.replace(id=0, data="127.0.0.{}".format(i))
+        for i in range(50)
+    ]
+    for r in records:
+        loopia.add_zone_record(r, "foo.bar")
+
+    streamed = loopia.iter_zone_records("foo.bar")
+    assert not isinstance(streamed, list)
+    assert list(streamed) == loopia.get_zone_records("foo.bar")
+
+    # Abandoning a stream closes its connection instead of reusing it
+    opened = loopia.transport.connections_opened
+    streamed = loopia.iter_zone_records("foo.bar")
+    next(streamed)
+    streamed.close()
+    assert list(loopia.iter_zone_records("foo.bar"))[-1].data == "127.0.0.49"
+    assert loopia.transport.connections_opened == opened + 1
+
+    with pytest.raises(LoopiaError):
+        list(loopia.iter_zone_records("bad.domain"))
+
+
+def test_iter_domains(server):
+    loopia = Loopia("user", "password", base_url=server.url)
+    assert list(loopia.iter_domains()) == loopia.get_domains()
+    assert [d.domain for d in loopia.iter_domains()] == ["foo.bar", "biz.baz"]
+
+
+@pytest.mark.parametrize(
+    "server", [True, False], ids=["multicall", "pipelined"], indirect=True)
+def test_batch(server, record):
+    loopia = Loopia("user", "password", base_url=server.url)
+    requests = loopia.transport.request = Mock(wraps=loopia.transport.request)
+
+    with loopia.batch() as batch:
+        assert isinstance(batch, Batch)
+        added = [
+            batch.add_zone_record(
+                record.replace(id=0, data="127.0.0.{}".format(i)), "foo.bar")
+            for i in range(3)
+        ]
+        failed = batch.add_zone_record(record.replace(id=0), "bad.domain")
+        subdomains = batch.get_subdomains("foo.bar")
+        unknown = batch.remove_subdomain("foo.bar", "unknown")
+        assert len(batch) == 6
+        assert not subdomains.done()
+
+    assert [future.result() for future in added] == [None] * 3
+    assert subdomains.result() == ["@", "www", "mail"]
+    with pytest.raises(LoopiaError):
+        failed.result()
+    assert isinstance(unknown.exception(), BadIndataError)
+
+    with loopia.batch(max_calls=2) as batch:
+        records = batch.get_zone_records("foo.bar")
+        domains = batch.get_domains()
+        missing = batch.get_zone_records("bad.domain")
+    assert sorted(r.data for r in records.result()) == [
+        "127.0.0.0", "127.0.0.1", "127.0.0.2"]
+    assert [d.domain for d in domains.result()] == ["foo.bar", "biz.baz"]
+    assert isinstance(missing.exception(), LoopiaError)
+
+    if loopia._multicall:
+        # One request per batch of at most two calls
+        assert requests.call_count == 3
+    else:
+        # The failed multicall attempt is not repeated by later batches
+        assert requests.call_count == 1 + 6 + 3
+
+
+def test_batch_cancelled_on_error(loopia):
+    with pytest.raises(RuntimeError):
+        with loopia.batch() as batch:
+            future = batch.get_domains()
+            raise RuntimeError()
+    assert future.cancelled()
+    assert len(batch) == 0
+
+
+def test_batch_invalidates_cache(server, record):
+    loopia = Loopia(
+        "user", "password", base_url=server.url, cache=ResponseCache())
+    assert loopia.get_zone_records("foo.bar") == []
+    with loopia.batch() as batch:
+        batch.add_zone_record(record.replace(id=0), "foo.bar")
+    assert len(loopia.get_zone_records("foo.bar")) == 1
+
+
+def test_emulator_state(server, record):
+    loopia = Loopia("user", "password", base_url=server.url)
+    assert loopia.get_domain("foo.bar").domain == "foo.bar"
+    with pytest.raises(LoopiaError):
+        loopia.get_domain("bad.domain")
+
+    loopia.add_zone_record(record.replace(id=0), "foo.bar", "www")
+    added, = loopia.get_zone_records("foo.bar", "www")
+    loopia.update_zone_record(added.replace(ttl=60), "foo.bar", "www")
+    assert loopia.get_zone_records("foo.bar", "www")[0].ttl == 60
+    with pytest.raises(BadIndataError):
+        loopia.add_zone_record(record.replace(id=0), "foo.bar", "unknown")
+
+    loopia.remove_subdomain("foo.bar", "www")
+    assert loopia.get_subdomains("foo.bar") == ["@", "mail"]
+    assert server.calls["addZoneRecord"] == 2
+
+    with pytest.raises(AuthError):
+        Loopia("user", "wrong", base_url=server.url).get_domains()
+
+
+def test_emulator_fault_injection(server, clock):
+    loopia = Loopia(
+        "user", "password", base_url=server.url,
+        retry_policy=RetryPolicy(sleep=clock.sleep))
+
+    server.fail_next("RATE_LIMITED", 2)
+    assert loopia.get_subdomains("foo.bar") == ["@", "www", "mail"]
+    assert loopia.retry_policy.retries == 2
+
+    server.drop_next()
+    assert loopia.get_subdomains("foo.bar") == ["@", "www", "mail"]
+    assert server.requests_dropped == 1
+
+    server.fail_next("AUTH_ERROR")
+    with pytest.raises(AuthError):
+        loopia.get_subdomains("foo.bar")
+
+
+def test_emulator_rate_limit(clock):
+    with LoopiaEmulator(rate_limit=2, rate_limit_period=1.0, clock=clock) as server:
+        server.add_domain("foo.bar", ["@", "www"])
+        loopia = Loopia("user", "password", base_url=server.url)
+        loopia.get_subdomains("foo.bar")
+        loopia.get_subdomains("foo.bar")
+        with pytest.raises(RateLimitedError):
+            loopia.get_subdomains("foo.bar")
+
+        clock.now += 1.0
+        loopia.get_subdomains("foo.bar")
+
+
+def test_histogram():
+    histogram = Histogram([1, 5])
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [
+        (1, 2), (5, 3), (float("inf"), 4)]
+    assert histogram.sum == 14.5
+
+
+def test_call_hooks(server, record):
+    events = []
+
+    class Hook(CallHook):
+        def before_call(self, method, args):
+            events.append(("before", method, args))
+
+        def after_call(self, info):
+            events.append(("after", info))
+
+        def call_failed(self, info, error):
+            events.append(("failed", info, error))
+
+    collector = MetricsCollector()
+    loopia = Loopia(
+        "user", "password", base_url=server.url, hooks=[Hook(), collector])
+    loopia.add_zone_record(record.replace(id=0), "foo.bar")
+    assert len(loopia.get_zone_records("foo.bar")) == 1
+
+    assert events[0] == (
+        "before", "addZoneRecord",
+        ("foo.bar", "@", record.replace(id=0).to_dict()))
+    info = events[3][1]
+    assert info.method == "getZoneRecords"
+    assert info.status == "OK"
+    assert info.request_bytes > 0
+    assert info.response_bytes > info.request_bytes
+    assert info.duration >= info.transport_time > 0
+    assert info.serialize_time > 0 and info.deserialize_time > 0
+
+    server.fail_next("AUTH_ERROR")
+    with pytest.raises(AuthError) as e:
+        loopia.get_domains()
+    assert events[-1] == ("failed", events[-1][1], e.value)
+    assert events[-1][1].status == "AUTH_ERROR"
+
+    assert collector.calls == {
+        ("addZoneRecord", "OK"): 1,
+        ("getZoneRecords", "OK"): 1,
+        ("getDomains", "AUTH_ERROR"): 1,
+    }
+    text = collector.to_prometheus()
+    assert "# TYPE loopia_call_duration_seconds histogram\n" in text
+    assert 'loopia_calls_total{method="getDomains",status="AUTH_ERROR"} 1\n' in (
+        text)
+    assert (
+        'loopia_call_duration_seconds_count'
+        '{method="getZoneRecords",phase="transport"} 1\n') in text
+    assert (
+        'loopia_call_payload_bytes_bucket'
+        '{direction="request",le="+Inf",method="addZoneRecord"} 1\n') in text
+
+    # Faults are counted along with the other statuses of the method
+    with pytest.raises(Fault):
+        loopia._call("getDomain")
+    loopia._call("getDomain", "foo.bar")
+    assert collector.calls[("getDomain", "1")] == 1
+    assert collector.calls[("getDomain", "OK")] == 1
+    assert 'loopia_calls_total{method="getDomain",status="1"} 1\n' in (
+        collector.to_prometheus())
+
+
+def test_call_hooks_without_raw_transport(loopia):
+    collector = MetricsCollector()
+    loopia.hooks.append(collector)
+    loopia.transport = Mock(spec=[])
+
+    @loopia.intercept("getSubdomains")
+    def get_subdomains(user, password, domain):
+        return ["www", "mail"]
+
+    assert loopia.get_subdomains("foo.bar") == ["www", "mail"]
+    assert ("getSubdomains", "transport") in collector.durations
+    assert ("getSubdomains", "serialize") not in collector.durations
+    assert not collector.sizes
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_single_flight(loopia, record, fail):
+    release = threading.Event()
+
+    @loopia.intercept("getZoneRecords")
+    def get_zone_records(user, password, domain, subdomain):
+        release.wait()
+        return "AUTH_ERROR" if fail else [record.to_dict()]
+
+    results = []
+    def worker():
+        try:
+            results.append(loopia.get_zone_records("foo.bar"))
+        except LoopiaError as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 10
+    try:
+        while (loopia.single_flight.shared < 7 and
+               time.monotonic() < deadline):
+            time.sleep(0.001)
+        assert loopia.single_flight.shared == 7
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert get_zone_records.call_count == 1
+    if fail:
+        assert all(isinstance(result, AuthError) for result in results)
+    else:
+        assert results == [[record]] * 8
+    assert len(loopia.single_flight) == 0
+
+    # Calls made after the flight landed are not shared
+    with pytest.raises(AuthError) if fail else ExitStack():
+        loopia.get_zone_records("foo.bar")
+    assert get_zone_records.call_count == 2
+
+
+def test_single_flight_writes_not_shared():
+    flight = SingleFlight()
+    assert flight.call("updateZoneRecord", (), lambda method: method) == (
+        "updateZoneRecord")
+    assert flight.calls == 0
+
+
+def test_async_single_flight(server):
+    async def main():
+        loopia = AsyncLoopia("user", "password", base_url=server.url)
+        server.latency = 0.05
+        results = await asyncio.gather(*[
+            loopia.get_zone_records("foo.bar") for _ in range(10)
+        ] + [loopia.get_subdomains("foo.bar")])
+        assert results[:10] == [[]] * 10
+        assert loopia.single_flight.shared == 9
+
+        # Callers that share a response get lists of their own
+        first, second = await asyncio.gather(
+            loopia.get_subdomains("foo.bar"), loopia.get_subdomains("foo.bar"))
+        first.append("mutated")
+        assert "mutated" not in second
+        assert loopia.single_flight.shared == 10
+        loopia.close()
+
+    asyncio.run(main())
+    assert server.calls["getZoneRecords"] == 1
+    assert server.calls["getSubdomains"] == 2
+
+
+def test_ddns_updater(server, clock):
+    server.add_domain("foo.bar", ["@", "home"])
+    loopia = Loopia("user", "password", base_url=server.url)
+    loopia.add_zone_record(DnsRecord("A", data="192.0.2.1"), "foo.bar", "home")
+    loopia.add_zone_record(DnsRecord("MX", data="mx"), "foo.bar")
+    updater = DynDnsUpdater(
+        loopia, ["home.foo.bar", "foo.bar"], ttl=300, refresh_interval=60,
+        clock=clock)
+    assert list(updater.hosts) == [("foo.bar", "@"), ("foo.bar", "home")]
+
+    updates = updater.sync({"A": "192.0.2.1"})
+    assert [(u.hostname, u.old, u.new) for u in updates] == [
+        ("foo.bar", None, "192.0.2.1")]
+    assert loopia.get_zone_records("foo.bar")[-1].ttl == 300
+
+    # Nothing changed, so the cached records are enough
+    server.calls.clear()
+    assert updater.sync({"A": "192.0.2.1"}) == []
+    assert not server.calls
+
+    updates = updater.sync({"A": "192.0.2.2"})
+    assert [(u.hostname, u.old, u.new) for u in updates] == [
+        ("foo.bar", "192.0.2.1", "192.0.2.2"),
+        ("home.foo.bar", "192.0.2.1", "192.0.2.2"),
+    ]
+    assert server.calls["updateZoneRecord"] == 2
+    assert [r.data for r in loopia.get_zone_records("foo.bar", "home")] == [
+        "192.0.2.2"]
+
+    # Changes made elsewhere are picked up once the cache is refreshed
+    record, = loopia.get_zone_records("foo.bar", "home")
+    loopia.update_zone_record(record.replace(data="192.0.2.9"), "foo.bar", "home")
+    assert updater.sync({"A": "192.0.2.2"}) == []
+    clock.now += 60
+    assert len(updater.sync({"A": "192.0.2.2"})) == 1
+
+
+def test_ddns_state(server, clock, tmpdir):
+    loopia = Loopia("user", "password", base_url=server.url)
+    updater = DynDnsUpdater(loopia, ["www.foo.bar"], clock=clock)
+    updater.sync({"AAAA": "2001:db8::1"})
+
+    path = str(tmpdir.join("state.json"))
+    with open(path, "w") as fp:
+        updater.save_state(fp)
+
+    server.calls.clear()
+    updater = DynDnsUpdater(loopia, ["www.foo.bar"], clock=clock)
+    with open(path) as fp:
+        updater.load_state(fp)
+    assert updater.sync({"AAAA": "2001:db8::1"}) == []
+    assert not server.calls
+
+
+def test_ddns_multiple_records(server, clock):
+    loopia = Loopia("user", "password", base_url=server.url)
+    for address in ("192.0.2.1", "192.0.2.2", "192.0.2.3"):
+        loopia.add_zone_record(DnsRecord("A", data=address), "foo.bar", "www")
+    updater = DynDnsUpdater(loopia, ["www.foo.bar"], clock=clock)
+
+    # The record that already has the address is kept and the rest removed
+    updates = updater.sync({"A": "192.0.2.2"})
+    assert sorted((u.old, u.new) for u in updates) == [
+        ("192.0.2.1", None), ("192.0.2.3", None)]
+    assert [r.data for r in loopia.get_zone_records("foo.bar", "www")] == [
+        "192.0.2.2"]
+
+    server.calls.clear()
+    assert updater.sync({"A": "192.0.2.2"}) == []
+    assert not server.calls
+
+    loopia.add_zone_record(DnsRecord("A", data="192.0.2.4"), "foo.bar", "www")
+    clock.now += 3600
+    updates = updater.sync({"A": "192.0.2.5"})
+    assert [(u.old, u.new) for u in updates] == [
+        ("192.0.2.2", "192.0.2.5"), ("192.0.2.4", None)]
+    assert [r.data for r in loopia.get_zone_records("foo.bar", "www")] == [
+        "192.0.2.5"]
+
+
+def test_ddns_add_and_update(server, clock):
+    loopia = Loopia("user", "password", base_url=server.url)
+    loopia.add_zone_record(
+        DnsRecord("AAAA", data="2001:db8::1"), "foo.bar", "www")
+    updater = DynDnsUpdater(loopia, ["www.foo.bar"], clock=clock)
+
+    # The add makes the host stale before its update is applied
+    updates = updater.sync({"A": "192.0.2.1", "AAAA": "2001:db8::2"})
+    assert [(u.type, u.old, u.new, u.error) for u in updates] == [
+        ("A", None, "192.0.2.1", None),
+        ("AAAA", "2001:db8::1", "2001:db8::2", None),
+    ]
+
+    server.calls.clear()
+    assert updater.sync({"A": "192.0.2.1", "AAAA": "2001:db8::2"}) == []
+    assert not server.calls
+
+
+def test_ddns_run_survives_outages(server, clock):
+    loopia = Loopia("user", "password", base_url=server.url)
+    updater = DynDnsUpdater(loopia, ["www.foo.bar"], clock=clock)
+    source = parse_source("static:192.0.2.7")
+
+    # A dead endpoint, then a rate limited call and a dropped connection
+    dead = Loopia("user", "password", base_url="http://127.0.0.1:9/RPCSERV")
+    DynDnsUpdater(dead, ["www.foo.bar"], clock=clock).run(
+        [source], iterations=2, sleep=lambda _: None)
+
+    server.fail_next("RATE_LIMITED")
+    server.drop_next()
+    server.drop_next()
+    sleeps = []
+    updater.run([source], iterations=4, sleep=sleeps.append)
+    assert len(sleeps) == 3
+    assert [r.data for r in loopia.get_zone_records("foo.bar", "www")] == [
+        "192.0.2.7"]
+
+
+def test_ddns_sources():
+    assert get_addresses([
+        parse_source("static:192.0.2.1"),
+        parse_source("static:192.0.2.2"),
+        parse_source("static:2001:db8::1"),
+    ]) == {"A": "192.0.2.1", "AAAA": "2001:db8::1"}
+
+    def broken():
+        raise OSError("unreachable")
+
+    def truncated():
+        raise http.client.IncompleteRead(b"19")
+    assert get_addresses([broken, truncated]) == {}
+
+    with pytest.raises(ValueError):
+        parse_source("static:not-an-address")
+    with pytest.raises(ValueError):
+        parse_source("carrier-pigeon")
+
+
+def test_ddns_cli(server, tmpdir):
+    state = str(tmpdir.join("state.json"))
+    args = [
+        "--user", "user", "--password", "password", "--base-url", server.url,
+        "ddns", "--once", "--state", state, "--source", "static:192.0.2.7",
+        "www.foo.bar",
+    ]
+    assert cli_main(args) == 0
+    assert server.calls["addZoneRecord"] == 1
+
+    # The second run trusts the saved records
+    calls = sum(server.calls.values())
+    assert cli_main(args) == 0
+    assert sum(server.calls.values()) == calls
+
+
+ZONE_FILE = u"""\
+$ORIGIN foo.bar.
+$TTL 1h
+@       IN SOA ns1 hostmaster ( 1 7200 3600
+                                1209600 300 ) ; managed by the API
+        IN  A     192.0.2.1
+        600 MX    10 mail
+www     CNAME     @
+mail.foo.bar. 300 IN A 192.0.2.2
+_sip._tcp SRV 10 60 5060 sip.example.com.
+@       TXT       "v=spf1 -all" ; comment
+txt     TXT       ( "a \\"quoted\\" "
+                    "string;" )
+"""
+
+
+def test_read_zone_file():
+    records = list(read_zone_file(io.StringIO(ZONE_FILE)))
+    assert records == [
+        ("foo.bar", DnsRecord("A", ttl=3600, data="192.0.2.1")),
+        ("foo.bar", DnsRecord("MX", ttl=600, priority=10, data="mail.foo.bar.")),
+        ("www.foo.bar", DnsRecord("CNAME", data="foo.bar.")),
+        ("mail.foo.bar", DnsRecord("A", ttl=300, data="192.0.2.2")),
+        ("_sip._tcp.foo.bar", DnsRecord(
+            "SRV", priority=10, data="60 5060 sip.example.com.")),
+        ("foo.bar", DnsRecord("TXT", data="v=spf1 -all")),
+        ("txt.foo.bar", DnsRecord("TXT", data='a "quoted" string;')),
+    ]
+
+    # Without $TTL, records get the TTL of the previous one
+    zone = u"a 300 A 192.0.2.1\n  A 192.0.2.2\n"
+    assert [r.ttl for _, r in read_zone_file(io.StringIO(zone), "x")] == [
+        300, 300]
+
+
+@pytest.mark.parametrize("zone, error", [
+    (u"@ A 192.0.2.1\n@ TXT \"open\n", "Line 2: unterminated string"),
+    (u"@ A ( 192.0.2.1\n", "Line 1: unbalanced '('"),
+    (u"@ CAA 0 issue \"ca\"\n", "Line 1: unsupported record type 'CAA'"),
+    (u"$INCLUDE other.zone\n", "Line 1: unsupported directive"),
+    (u"  A 192.0.2.1\n", "Line 1: missing owner name"),
+    (u"@ MX mail\n", "Line 1: invalid MX record"),
+])
+def test_read_zone_file_errors(zone, error):
+    with pytest.raises(ValueError) as e:
+        list(read_zone_file(io.StringIO(zone), "foo.bar"))
+    assert str(e.value).startswith(error)
+
+
+def test_format_record_round_trip():
+    records = [
+        DnsRecord("TXT", data='x' * 300 + '\\"'),
+        DnsRecord("MX", priority=5, data="mail.foo.bar."),
+        DnsRecord("A", ttl=60, data="192.0.2.1"),
+    ]
+    zone = u"$ORIGIN foo.bar.\n" + u"".join(
+        format_record("www", record) for record in records)
+    assert [r for _, r in read_zone_file(io.StringIO(zone))] == records
+
+
+def test_zone_file_import_export(server):
+    loopia = Loopia("user", "password", base_url=server.url)
+    loopia.add_zone_record(DnsRecord("A", data="192.0.2.9"), "foo.bar", "www")
+
+    result = loopia.import_zone_file("foo.bar", io.StringIO(ZONE_FILE))
+    assert result == (5, 7, 0, 0)
+    assert server.calls["addSubdomain"] == 2
+    assert len(loopia.get_zone_records("foo.bar", "www")) == 2
+
+    # Importing again changes nothing
+    assert loopia.import_zone_file(
+        "foo.bar", io.StringIO(ZONE_FILE)) == (5, 0, 0, 0)
+
+    # Replacing reuses the record that isn't in the file
+    result = loopia.import_zone_file(
+        "foo.bar", io.StringIO(ZONE_FILE), replace=True)
+    assert result == (5, 0, 0, 1)
+    assert [r.type for r in loopia.get_zone_records("foo.bar", "www")] == [
+        "CNAME"]
+
+    exported = io.StringIO()
+    assert loopia.export_zone_file("foo.bar", exported) == 7
+    assert exported.getvalue().startswith(u"$ORIGIN foo.bar.\n@\t")
+    assert sorted(read_zone_file(io.StringIO(exported.getvalue()))) == sorted(
+        (name, record.replace(id=0))
+        for name, record in read_zone_file(io.StringIO(ZONE_FILE)))
+
+    with pytest.raises(ValueError):
+        loopia.import_zone_file("foo.bar", io.StringIO(u"biz.baz. A 192.0.2.1"))
+
+    # The domain is compared case insensitively
+    server.calls.clear()
+    assert loopia.import_zone_file(
+        "Foo.BAR.", io.StringIO(ZONE_FILE)) == (5, 0, 0, 0)
+    exported = io.StringIO()
+    assert loopia.export_zone_file("Foo.BAR.", exported) == 7
+    assert exported.getvalue().startswith(u"$ORIGIN foo.bar.\n")
+
+
+def test_zone_file_import_windows(server):
+    loopia = Loopia("user", "password", base_url=server.url)
+    zone = u"".join(
+        u"host{} A 192.0.2.{}\n".format(i % 7, i) for i in range(50))
+    result = loopia.import_zone_file("biz.baz", io.StringIO(zone))
+    assert result.added == 50
+    assert result.subdomains == 7
+    assert len(loopia.get_zone_records("biz.baz", "host3")) == 7
+
+    server.calls.clear()
+    from loopialib.zonefile import import_zone_file
+    result = import_zone_file(loopia, "biz.baz", io.StringIO(zone), window=10)
+    assert result == (7, 0, 0, 0)
+    assert server.calls["getZoneRecords"] == 5 * 7
+    assert not server.calls["addZoneRecord"]
+
+    # Sub domains spread over several windows keep the records of all of them
+    import_zone_file(
+        loopia, "biz.baz", io.StringIO(zone), replace=True, window=10)
+    assert len(loopia.get_zone_records("biz.baz", "host3")) == 7
+
+
+def test_zone_file_cli(server, tmpdir):
+    path = str(tmpdir.join("foo.bar.zone"))
+    with open(path, "w") as fp:
+        fp.write(ZONE_FILE)
+
+    args = ["--user", "user", "--password", "password", "--base-url", server.url]
+    assert cli_main(args + ["import", "foo.bar", path]) == 0
+    assert cli_main(args + ["export", "foo.bar", path]) == 0
+    with open(path) as fp:
+        assert len(list(read_zone_file(fp))) == 7
+
+
+def test_record_index():
+    a = DnsRecord("A", ttl=300, data="203.0.113.7", id=1)
+    mx = DnsRecord("MX", ttl=3600, priority=10, data="mail.foo.bar.", id=2)
+    www = DnsRecord("A", ttl=600, data="203.0.113.7", id=3)
+    index = RecordIndex([
+        ZoneSnapshot("foo.bar", "@", [a, mx]),
+        ZoneSnapshot("foo.bar", "www", [www]),
+    ])
+    assert len(index) == 3
+
+    assert index.hostnames(data="203.0.113.7") == ["foo.bar", "www.foo.bar"]
+    assert index.find(type="MX", priority=10) == [
+        IndexedRecord("foo.bar", "@", mx)]
+    assert index.find(type="A", min_ttl=400) == [
+        IndexedRecord("foo.bar", "www", www)]
+    assert [r.record for r in index.find(max_ttl=600)] == [a, www]
+    assert index.find(domain="foo.bar", subdomain="www", type="MX") == []
+    assert index.find(type="TXT", data="203.0.113.7") == []
+    assert len(index.find()) == 3
+    with pytest.raises(ValueError):
+        index.find(subdomain="www")
+
+    index.update("foo.bar", "www", www.replace(data="203.0.113.8", ttl=300))
+    assert index.hostnames(data="203.0.113.7") == ["foo.bar"]
+    assert index.find(ttl=600) == []
+    assert index._sorted_ttls == [300, 3600]
+
+    index.remove("foo.bar", "@", 1)
+    index.remove_zone("foo.bar", "www")
+    assert index.zones() == [("foo.bar", "@")]
+    assert index.find(data="203.0.113.7") == []
+
+    with pytest.raises(ValueError):
+        index.add("foo.bar", "@", DnsRecord("A"))
+
+
+def test_record_index_follows_writes(server):
+    loopia = Loopia("user", "password", base_url=server.url)
+    loopia.index = index = RecordIndex()
+
+    loopia.add_zone_record(DnsRecord("A", data="192.0.2.1"), "foo.bar", "www")
+    found, = index.find(data="192.0.2.1")
+    assert found.subdomain == "www"
+
+    # The refetch can't share a read that started before the write
+    assert loopia.single_flight.calls == 0
+
+    loopia.update_zone_record(
+        found.record.replace(data="192.0.2.2"), "foo.bar", "www")
+    assert index.hostnames(data="192.0.2.2") == ["www.foo.bar"]
+
+    with loopia.batch() as batch:
+        batch.add_zone_record(DnsRecord("A", data="192.0.2.3"), "foo.bar")
+        batch.remove_zone_record(found.record.id, "foo.bar", "www")
+        batch.remove_zone_record(12345, "foo.bar", "mail")
+    assert [r.subdomain for r in index.find(type="A")] == ["@"]
+
+    # Added records are fetched once per sub domain and bulk call or batch
+    server.calls.clear()
+    loopia.add_zone_records(
+        [(DnsRecord("A", data="192.0.2.{}".format(i)), "foo.bar", "mail")
+         for i in range(10, 20)],
+        stop_on_error=True)
+    assert server.calls["getZoneRecords"] == 1
+    with loopia.batch(max_calls=3) as batch:
+        for i in range(20, 30):
+            batch.add_zone_record(
+                DnsRecord("A", data="192.0.2.{}".format(i)), "foo.bar", "mail")
+    assert server.calls["getZoneRecords"] == 2
+    assert len(index.find(domain="foo.bar", subdomain="mail")) == 20
+    loopia.remove_subdomain("foo.bar", "mail")
+
+    # Failed writes leave the index alone
+    server.fail_next("AUTH_ERROR")
+    with pytest.raises(AuthError):
+        loopia.remove_subdomain("foo.bar")
+    assert len(index) == 1
+
+    loopia.remove_subdomain("foo.bar")
+    assert len(index) == 0
+
+
+def test_record_index_refresh(server):
+    class FailingHook(CallHook):
+        fail = False
+
+        def before_call(self, method, args):
+            if self.fail and method == "getZoneRecords":
+                raise OSError("Connection reset")
+
+    hook = FailingHook()
+    loopia = Loopia(
+        "user", "password", base_url=server.url, hooks=[hook],
+        index=RecordIndex())
+    index = loopia.index
+
+    # The record was added, so a failed refresh must not fail the write
+    hook.fail = True
+    loopia.add_zone_record(DnsRecord("A", data="192.0.2.1"), "foo.bar", "www")
+    assert index.stale_zones() == [("foo.bar", "www")]
+    hook.fail = False
+    assert len(loopia.get_zone_records("foo.bar", "www")) == 1
+
+    # Stale sub domains are fetched again along with the next refresh
+    loopia.add_zone_record(DnsRecord("A", data="192.0.2.2"), "foo.bar")
+    assert index.stale_zones() == []
+    assert index.hostnames(type="A") == ["foo.bar", "www.foo.bar"]
+
+    # Refreshes are only deferred for the thread that asked for it
+    with loopia._defer_index_refresh():
+        thread = threading.Thread(
+            target=loopia.add_zone_record,
+            args=(DnsRecord("A", data="192.0.2.3"), "foo.bar", "mail"))
+        thread.start()
+        thread.join()
+        assert index.hostnames(data="192.0.2.3") == ["mail.foo.bar"]
+
+        loopia.add_zone_record(
+            DnsRecord("A", data="192.0.2.4"), "foo.bar", "mail")
+        assert index.hostnames(data="192.0.2.4") == []
+    assert index.hostnames(data="192.0.2.4") == ["mail.foo.bar"]
+
+
+def test_record_table():
+    a = DnsRecord("A", ttl=300, data="203.0.113.7", id=1)
+    mx = DnsRecord("MX", priority=10, data="mail.foo.bar.", id=2)
+    www = DnsRecord("A", ttl=300, data="203.0.113.7", id=3)
+    table = RecordTable.from_snapshots([
+        ZoneSnapshot("foo.bar", "@", [a, mx]),
+        ZoneSnapshot("foo.bar", "www", [www]),
+    ])
+    assert len(table) == 3
+    assert table.to_list() == [a, mx, www]
+    assert table[-1] == www and type(table[-1]) is DnsRecord
+    assert table[1:] == [mx, www]
+    assert table.zone(2) == ("foo.bar", "www")
+    assert list(table.zones())[0] == ("foo.bar", "@", a)
+    with pytest.raises(IndexError):
+        table[3]
+
+    # Equal data is only stored once
+    assert table[0].data is table[2].data
+    assert len(table._data_pool) == 2
+
+    assert table.rows(type="A") == [0, 2]
+    assert table.rows(type="A", domain="foo.bar", subdomain="www") == [2]
+    assert table.rows(data="203.0.113.7", ttl=300, domain="foo.bar") == [0, 2]
+    assert table.rows(type="MX", priority=10) == [1]
+    assert table.rows(type="TXT") == []
+    assert table.rows(data="192.0.2.1") == []
+    assert table.rows() == [0, 1, 2]
+    assert table.filter(type="A").to_list() == [a, www]
+    with pytest.raises(ValueError):
+        table.rows(subdomain="www")
+
+    # Rows that can't be stored leave the table as it was
+    with pytest.raises(OverflowError):
+        table.extend([a, a.replace(id=2 ** 32)])
+    assert len(table) == 3
+    assert RecordTable([a, mx]).to_list() == [a, mx]
+
+
+def test_snapshot_file(tmpdir):
+    zones = [
+        ZoneSnapshot("foo.bar", "@", [
+            DnsRecord("A", data="192.0.2.1", id=1),
+            DnsRecord("TXT", data=u"v=spf1 -all \u00e5", id=2),
+        ]),
+        ZoneSnapshot("foo.bar", "www", []),
+        ZoneSnapshot("biz.baz", "@", [DnsRecord("MX", priority=5, id=3)]),
+    ]
+    path = str(tmpdir.join("snapshot.bin"))
+    assert write_snapshot_file(path, iter(zones)) == 3
+
+    with SnapshotFile(path) as snapshot:
+        assert len(snapshot) == 3
+        assert list(snapshot) == [(z.domain, z.subdomain) for z in zones]
+        assert snapshot[("biz.baz", "@")] == zones[2].records
+        assert type(snapshot[("foo.bar", "@")][0]) is DnsRecord
+        assert ("biz.baz", "www") not in snapshot
+        with pytest.raises(KeyError):
+            snapshot[("biz.baz", "www")]
+        assert list(snapshot.zones()) == zones
+        assert snapshot.index().digests == (
+            SnapshotIndex.from_zones(zones).digests)
+
+
+    # Only changed zones are read to diff two snapshots
+    read = []
+
+    class CountingSnapshotFile(SnapshotFile):
+        def __getitem__(self, key):
+            read.append(key)
+            return super(CountingSnapshotFile, self).__getitem__(key)
+
+    new = {(z.domain, z.subdomain): z.records for z in zones}
+    new[("foo.bar", "www")] = [DnsRecord("A", data="192.0.2.2", id=4)]
+    with CountingSnapshotFile(path) as snapshot:
+        changes = list(diff_snapshots(
+            snapshot.index(),
+            SnapshotIndex.from_zones(
+                ZoneSnapshot(d, s, r) for (d, s), r in new.items()),
+            snapshot,
+            new))
+    assert [(c.action, c.subdomain) for c in changes] == [("added", "www")]
+    assert read == [("foo.bar", "www")]
+
+
+def test_snapshot_file_errors(tmpdir):
+    path = str(tmpdir.join("snapshot.bin"))
+    with open(path, "wb") as fp:
+        writer = SnapshotFileWriter(fp)
+        writer.write(ZoneSnapshot("foo.bar", "@", []))
+        with pytest.raises(ValueError):
+            writer.write(ZoneSnapshot("foo.bar", "@", []))
+
+    # Never closed, so there is no index
+    with pytest.raises(ValueError):
+        SnapshotFile(path)
+
+    with open(path, "wb") as fp:
+        fp.write(b"{}\n" * 20)
+    with pytest.raises(ValueError):
+        SnapshotFile(path)
+
+    # Records are validated like those of JSON Lines snapshots
+    with open(path, "wb") as fp:
+        with SnapshotFileWriter(fp) as writer:
+            writer.write(("foo.bar", "@", [("BOGUS", 3600, 0, "", 1)]))
+    with SnapshotFile(path) as snapshot:
+        with pytest.raises(ValueError):
+            snapshot[("foo.bar", "@")]
+
+
+@pytest.mark.parametrize("statement, unwanted", [
+    ("import loopialib", ["loopialib.client", "xmlrpc.client", "asyncio"]),
+    ("from loopialib import DnsRecord", ["xmlrpc.client", "asyncio"]),
+    ("from loopialib import split_domain", ["loopialib._suffix_data"]),
+    ("from loopialib import Loopia", ["asyncio", "concurrent.futures"]),
+])
+def test_lazy_imports(statement, unwanted):
+    code = "{}; import sys; print(sorted(set({!r}) & set(sys.modules)))".format(
+        statement, unwanted)
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.decode().strip() == "[]"
+
+
+def test_lazy_attributes():
+    import loopialib
+    assert loopialib.Loopia is Loopia
+    assert "split_domains" in dir(loopialib)
+    with pytest.raises(AttributeError):
+        loopialib.missing